@@ -0,0 +1,78 @@
+#!/bin/env python3.9
+
+import argparse
+import os
+import sys
+import time
+
+from classes.RevocationList import RevocationList, HASH_LENGTH
+
+# Initialize components
+CLI_PARSER = argparse.ArgumentParser(
+    description='Builds a revocation index of random hashes and times its compilation, opening and lookups')
+INDEX_PATH = '.cache/revocation-benchmark.idx'
+
+
+def timed_lookups(revocation_list, hashes):
+    """Looks up every hash; returns (number found, microseconds per lookup)"""
+    start = time.perf_counter()
+    found = sum(1 for revocation_hash in hashes if revocation_list.contains(revocation_hash))
+    return found, (time.perf_counter() - start) * 1_000_000 / max(1, len(hashes))
+
+
+def bloom_passes(revocation_list, hashes):
+    """Returns how many of the (absent) hashes get past the Bloom filter, i.e. need the binary search"""
+    return sum(1 for revocation_hash in hashes if revocation_list.bloom_contains(revocation_hash))
+
+
+if __name__ == '__main__':
+    CLI_PARSER.add_argument(
+        '--entries',
+        type=int,
+        default=10_000_000,
+        help='Number of revoked hashes in the index (default: 10000000)')
+    CLI_PARSER.add_argument(
+        '--lookups',
+        type=int,
+        default=100_000,
+        help='Number of hits and of misses to look up (default: 100000)')
+    CLI_PARSER.add_argument(
+        '--false-positive-rate',
+        type=float,
+        default=0.01,
+        help='False positive rate of the Bloom filter (default: 0.01)')
+    CLI_PARSER.add_argument(
+        '--output',
+        type=str,
+        default=INDEX_PATH,
+        help=f'Index file to write (default: {INDEX_PATH})')
+
+    args = CLI_PARSER.parse_args()
+    if args.entries < 1 or args.lookups < 1:
+        CLI_PARSER.print_help()
+        sys.exit()
+
+    entries = os.urandom(args.entries * HASH_LENGTH)
+    start = time.perf_counter()
+    count = RevocationList.build(entries, args.output, args.false_positive_rate)
+    compile_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index = RevocationList.open(args.output)
+    open_microseconds = (time.perf_counter() - start) * 1_000_000
+
+    step = max(1, args.entries // args.lookups)
+    hits = [entries[offset:offset + HASH_LENGTH]
+            for offset in range(0, len(entries), step * HASH_LENGTH)][:args.lookups]
+    misses = [os.urandom(HASH_LENGTH) for _ in range(args.lookups)]
+    found_hits, hit_microseconds = timed_lookups(index, hits)
+    found_misses, miss_microseconds = timed_lookups(index, misses)
+    false_positive_rate = bloom_passes(index, misses) / len(misses)
+    index.close()
+
+    print(f"{count} revoked hashes, index of {os.path.getsize(args.output) / 1024 / 1024:.1f} MiB")
+    print(f"compile      {compile_seconds:>10.2f} s")
+    print(f"open         {open_microseconds:>10.1f} µs")
+    print(f"hit          {hit_microseconds:>10.2f} µs/lookup ({found_hits}/{len(hits)} found)")
+    print(f"miss         {miss_microseconds:>10.2f} µs/lookup ({found_misses}/{len(misses)} found)")
+    print(f"bloom        {false_positive_rate:>10.4f} false positive rate (target {args.false_positive_rate:g})")
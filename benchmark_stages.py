@@ -0,0 +1,176 @@
+#!/bin/env python3.9
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import zlib
+
+from base45 import b45decode
+from cbor2 import loads
+from cose.messages import Sign1Message
+
+import hcert
+from classes.DigitalCovidCertificate import DigitalCovidCertificate, CLAIM_ISSUER, CLAIM_ISSUED_AT, CLAIM_EXPIRES_AT
+from classes.RuleEngine import RuleEngine
+from classes.SchemaValidator import SchemaValidator, ENGINES, ENGINE_JSCHON
+from classes.SignatureValidator import SignatureValidator, VERIFIERS, VERIFIER_DIRECT
+from classes.TrustList import TrustList
+
+# Initialize components
+CLI_PARSER = argparse.ArgumentParser(
+    description='Times every decoding and validation stage separately over a corpus made by generate_corpus.py')
+
+STAGES = ["qr", "base45", "inflate", "cose", "cbor", "schema", "signature", "triage", "rules"]
+
+
+def timed(function, items, runs):
+    """Applies the function to every item, <runs> times; returns (outputs, best microseconds per item)"""
+    best = None
+    outputs = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        outputs = [function(item) for item in items]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return outputs, best * 1_000_000 / max(1, len(items))
+
+
+def run_stages(corpus, runs, schema_engine, verifier, with_qr, rules=None, value_sets=None, acceptor=None):
+    """Returns the microseconds per item for every stage; each stage is fed the output of the previous one"""
+    with open(os.path.join(corpus, "hcerts.txt"), mode='r', encoding='utf-8') as file:
+        qr_texts = [line.rstrip("\r\n") for line in file if line.strip() != ""]
+    schema_validator = SchemaValidator.create(schema_engine)
+    signature_validator = SignatureValidator(TrustList.load(os.path.join(corpus, "trustlist.json")), verifier)
+    timings = dict()
+
+    if with_qr:
+        from classes.QrReader import QrReader
+        reader = QrReader(use_zxing=False)
+        files = sorted(glob.glob(os.path.join(corpus, "*", "*", "*.png")))
+        try:
+            _, timings["qr"] = timed(reader.read, files, runs)
+        except ImportError as error:
+            print(f"Skipped qr: {error}")
+
+    compressed, timings["base45"] = timed(lambda text: b45decode(hcert.strip_prefix(text)), qr_texts, runs)
+    cose_bytes, timings["inflate"] = timed(zlib.decompress, compressed, runs)
+    messages, timings["cose"] = timed(Sign1Message.decode, cose_bytes, runs)
+    claims, timings["cbor"] = timed(lambda message: loads(message.payload), messages, runs)
+    dccs = [claim[hcert.CLAIM_HCERT][hcert.HCERT_DCC] for claim in claims]
+    # The first pass builds the schemas and the keys, it's not what's being measured
+    schema_validator.validate_dcc(dccs[0], dccs[0]["ver"])
+    signature_validator.preload_keys()
+    _, timings["schema"] = timed(lambda dcc: schema_validator.validate_dcc(dcc, dcc["ver"]), dccs, runs)
+    _, timings["signature"] = timed(signature_validator.validate, cose_bytes, runs)
+    # Header-only decoding (validate_hcert.py --triage), instead of the cose, cbor, schema and signature stages
+    _, timings["triage"] = timed(lambda cose: DigitalCovidCertificate.from_cose(cose).triage(), cose_bytes, runs)
+    if rules is not None:
+        engine = RuleEngine.load(rules, value_sets)
+        _, timings["rules"] = timed(lambda claim: engine.evaluate(claim[hcert.CLAIM_HCERT][hcert.HCERT_DCC],
+                                                                  claim.get(CLAIM_ISSUER), acceptor,
+                                                                  issued_at=claim.get(CLAIM_ISSUED_AT),
+                                                                  expires_at=claim.get(CLAIM_EXPIRES_AT)),
+                                    claims, runs)
+    return len(qr_texts), timings
+
+
+def regressions(timings, baseline, tolerance):
+    """Returns the stages that are more than <tolerance> percent slower than the baseline"""
+    slower = []
+    for stage, microseconds in timings.items():
+        if stage in baseline and microseconds > baseline[stage] * (1 + tolerance / 100):
+            slower.append(stage)
+    return slower
+
+
+if __name__ == '__main__':
+    CLI_PARSER.add_argument(
+        '--corpus',
+        type=str,
+        default="corpus",
+        help='Directory written by generate_corpus.py (default: corpus)')
+    CLI_PARSER.add_argument(
+        '--runs',
+        type=int,
+        default=3,
+        help='Number of passes over the corpus per stage, the fastest counts (default: 3)')
+    CLI_PARSER.add_argument(
+        '--schema-engine',
+        choices=ENGINES,
+        default=ENGINE_JSCHON,
+        help='Schema validation engine to time (default: jschon)')
+    CLI_PARSER.add_argument(
+        '--signature-verifier',
+        choices=VERIFIERS,
+        default=VERIFIER_DIRECT,
+        help='Signature verifier to time (default: direct)')
+    CLI_PARSER.add_argument(
+        '--no-qr',
+        action='store_true',
+        help='Skip the QR stage, e.g. when the corpus was generated with --no-png')
+    CLI_PARSER.add_argument(
+        '--rules',
+        type=str,
+        help='Also time the business rules in this JSON file or directory (see validate_hcert.py --rules)')
+    CLI_PARSER.add_argument(
+        '--value-sets',
+        type=str,
+        help='Value sets for --rules')
+    CLI_PARSER.add_argument(
+        '--acceptor',
+        type=str,
+        default="NL",
+        help='Accepting country for --rules (default: NL)')
+    CLI_PARSER.add_argument(
+        '--json',
+        type=str,
+        help='Optional file to write the results to, to use as a baseline later')
+    CLI_PARSER.add_argument(
+        '--baseline',
+        type=str,
+        help='Results of an earlier run (--json); exits with 1 when a stage got slower than the tolerance')
+    CLI_PARSER.add_argument(
+        '--tolerance',
+        type=float,
+        default=20.0,
+        help='Allowed slowdown against the baseline, in percent (default: 20)')
+
+    args = CLI_PARSER.parse_args()
+
+    if not os.path.isfile(os.path.join(args.corpus, "hcerts.txt")):
+        CLI_PARSER.print_help()
+        sys.exit()
+
+    count, stage_timings = run_stages(args.corpus, max(1, args.runs), args.schema_engine,
+                                      args.signature_verifier, not args.no_qr, args.rules, args.value_sets,
+                                      args.acceptor.upper())
+
+    baseline_timings = dict()
+    if args.baseline is not None:
+        with open(args.baseline, mode='r', encoding='utf-8') as file:
+            baseline_timings = json.load(file)["stages"]
+
+    print(f"{count} certificates, schema engine {args.schema_engine}, signature verifier {args.signature_verifier}")
+    print(f"{'stage':<12} {'µs/item':>10} {'baseline':>10}")
+    for stage in STAGES:
+        if stage not in stage_timings:
+            continue
+        reference = f"{baseline_timings[stage]:>10.1f}" if stage in baseline_timings else f"{'':>10}"
+        print(f"{stage:<12} {stage_timings[stage]:>10.1f} {reference}")
+
+    if args.json is not None:
+        with open(args.json, mode='w', encoding='utf-8') as file:
+            json.dump({
+                "count": count,
+                "schema_engine": args.schema_engine,
+                "signature_verifier": args.signature_verifier,
+                "stages": {stage: round(microseconds, 2) for stage, microseconds in stage_timings.items()}
+            }, file, indent=2)
+
+    slower_stages = regressions(stage_timings, baseline_timings, args.tolerance)
+    if len(slower_stages) > 0:
+        print(f"Slower than the baseline (>{args.tolerance:g}%): {', '.join(slower_stages)}")
+        sys.exit(1)
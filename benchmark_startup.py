@@ -0,0 +1,100 @@
+#!/bin/env python3.9
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Initialize components
+CLI_PARSER = argparse.ArgumentParser(
+    description='Measures the time-to-first-result of each entry point: one input, from process start to exit')
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def script(name):
+    return os.path.join(HERE, name)
+
+
+def entry_points(hcert, qr_file, repo):
+    """Returns (name, argv, stdin) for every entry point that has the input it needs"""
+    python = sys.executable
+    points = []
+    if hcert is not None:
+        points.append(("validate_hcert.py", [python, script("validate_hcert.py")], hcert))
+        points.append(("validate_hcert.py --schema-engine compiled",
+                       [python, script("validate_hcert.py"), "--schema-engine", "compiled"], hcert))
+        points.append(("print_payload_hcert.py", [python, script("print_payload_hcert.py")], hcert))
+        points.append(("hcert_to_qr.py", [python, script("hcert_to_qr.py")], hcert))
+    if qr_file is not None:
+        points.append(("qr_to_hcert.py", [python, script("qr_to_hcert.py"), qr_file], None))
+        points.append(("print_payload_qr.py", [python, script("print_payload_qr.py"), "--file", qr_file], None))
+    if repo is not None:
+        points.append(("validate_quality_assurance.py",
+                       [python, script("validate_quality_assurance.py"), "--repo", repo], None))
+    return points
+
+
+def measure(argv, stdin, runs):
+    """Runs the command <runs> times, returns the wall times in milliseconds"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(argv, input=stdin, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                       text=True, check=False)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+if __name__ == '__main__':
+    CLI_PARSER.add_argument(
+        '--hcerts',
+        type=str,
+        help='File with hcerts, one per line; the first one is used')
+    CLI_PARSER.add_argument(
+        '--qr',
+        type=str,
+        help='QR (PNG) file for the QR based entry points')
+    CLI_PARSER.add_argument(
+        '--repo',
+        type=str,
+        help='Optional (small) dcc-quality-assurance checkout for validate_quality_assurance.py')
+    CLI_PARSER.add_argument(
+        '--runs',
+        type=int,
+        default=5,
+        help='Number of runs per entry point (default: 5)')
+    CLI_PARSER.add_argument(
+        '--json',
+        type=str,
+        help='Optional file to write the results to, to track them over time')
+
+    args = CLI_PARSER.parse_args()
+
+    first_hcert = None
+    if args.hcerts is not None:
+        with open(args.hcerts, mode='r', encoding='utf-8') as file:
+            first_hcert = file.readline()
+
+    points = entry_points(first_hcert, args.qr, args.repo)
+    if len(points) == 0:
+        CLI_PARSER.print_help()
+        sys.exit()
+
+    results = dict()
+    print(f"{'entry point':<48} {'min ms':>8} {'median ms':>10} {'max ms':>8}")
+    for name, argv, stdin in points:
+        timings = measure(argv, stdin, max(1, args.runs))
+        results[name] = {
+            "min_ms": round(min(timings), 1),
+            "median_ms": round(statistics.median(timings), 1),
+            "max_ms": round(max(timings), 1),
+            "runs": len(timings)
+        }
+        print(f"{name:<48} {min(timings):>8.1f} {statistics.median(timings):>10.1f} {max(timings):>8.1f}")
+
+    if args.json is not None:
+        with open(args.json, mode='w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
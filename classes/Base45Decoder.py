@@ -0,0 +1,142 @@
+"""This file contains the batch base45 decoder"""
+
+BASE45_CHARSET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:"
+INVALID = 0xFF
+
+# Character code -> base45 value, INVALID for characters outside the alphabet
+DECODE_TABLE = bytes(BASE45_CHARSET.index(chr(code)) if chr(code) in BASE45_CHARSET else INVALID
+                     for code in range(256))
+
+# NumPy is optional; it's imported on first use and without it the decoder runs in pure Python
+_NUMPY = None
+
+
+def _numpy():
+    """Returns the numpy module, or False when it isn't installed"""
+    global _NUMPY
+    if _NUMPY is None:
+        try:
+            import numpy
+            _NUMPY = numpy
+        except ImportError:
+            _NUMPY = False
+    return _NUMPY
+
+
+class Base45Decoder:
+    """Decodes many base45 strings at once
+
+    With NumPy, the strings are joined into one buffer that is decoded with table lookups and array
+    arithmetic; without it, each string is decoded in a loop. Both report the same errors.
+    """
+    def __init__(self, use_numpy: bool = True):
+        self._numpy = _numpy() if use_numpy else False
+
+    def decode(self, text: str) -> bytes:
+        """Decodes a single string, raises Base45Error"""
+        result = self.decode_many([text])[0]
+        if isinstance(result, Base45Error):
+            raise result
+        return result
+
+    def decode_many(self, texts: list) -> list:
+        """Decodes the strings; returns per string the bytes, or the Base45Error describing what's wrong"""
+        results = [None] * len(texts)
+        valid = []
+        for index, text in enumerate(texts):
+            try:
+                raw = text.encode("ascii")
+            except UnicodeEncodeError as error:
+                results[index] = _invalid_character(text[error.start], error.start)
+                continue
+            if len(raw) % 3 == 1:
+                results[index] = Base45Error(f"Invalid base45 length {len(raw)}")
+                continue
+            valid.append((index, raw))
+        if self._numpy and len(valid) > 1:
+            self._decode_numpy(valid, results)
+        else:
+            for index, raw in valid:
+                results[index] = self._decode_python(raw)
+        return results
+
+    @staticmethod
+    def _decode_python(raw):
+        values = raw.translate(DECODE_TABLE)
+        position = values.find(INVALID)
+        if position >= 0:
+            return _invalid_character(chr(raw[position]), position)
+        decoded = bytearray()
+        full = len(values) - len(values) % 3
+        for position in range(0, full, 3):
+            value = values[position] + values[position + 1] * 45 + values[position + 2] * 2025
+            if value > 0xFFFF:
+                return Base45Error(f"Invalid base45 group at position {position}")
+            decoded.append(value >> 8)
+            decoded.append(value & 0xFF)
+        if full < len(values):
+            value = values[full] + values[full + 1] * 45
+            if value > 0xFF:
+                return Base45Error(f"Invalid base45 group at position {full}")
+            decoded.append(value)
+        return bytes(decoded)
+
+    @staticmethod
+    def _decode_numpy(valid, results):
+        numpy = _NUMPY
+        table = numpy.frombuffer(DECODE_TABLE, dtype=numpy.uint8)
+        # The full groups of 3 characters of all strings, back to back; the 2 character tails separately
+        full_lengths = numpy.array([len(raw) - len(raw) % 3 for _, raw in valid], dtype=numpy.int64)
+        starts = numpy.zeros(len(valid) + 1, dtype=numpy.int64)
+        numpy.cumsum(full_lengths, out=starts[1:])
+        full = numpy.frombuffer(b"".join(raw[:len(raw) - len(raw) % 3] for _, raw in valid), dtype=numpy.uint8)
+        values = table[full]
+
+        character_errors = dict()
+        for position in numpy.flatnonzero(values == INVALID)[::-1]:
+            item = int(numpy.searchsorted(starts, position, side="right")) - 1
+            offset = int(position - starts[item])
+            character_errors[item] = _invalid_character(chr(full[position]), offset)
+
+        groups = values.reshape(-1, 3).astype(numpy.uint32)
+        numbers = groups[:, 0] + groups[:, 1] * 45 + groups[:, 2] * 2025
+        group_errors = dict()
+        for group in numpy.flatnonzero(numbers > 0xFFFF)[::-1]:
+            item = int(numpy.searchsorted(starts, group * 3, side="right")) - 1
+            group_errors[item] = f"Invalid base45 group at position {int(group * 3 - starts[item])}"
+
+        decoded = numpy.empty((len(numbers), 2), dtype=numpy.uint8)
+        decoded[:, 0] = numbers >> 8
+        decoded[:, 1] = numbers & 0xFF
+        decoded = decoded.tobytes()
+
+        for item, (index, raw) in enumerate(valid):
+            start = int(starts[item])
+            end = int(starts[item + 1])
+            tail = raw[end - start:].translate(DECODE_TABLE)
+            # Same order as the pure Python decoder: invalid characters first, then invalid groups
+            if item in character_errors:
+                results[index] = character_errors[item]
+            elif INVALID in tail:
+                position = end - start + tail.index(INVALID)
+                results[index] = _invalid_character(chr(raw[position]), position)
+            elif item in group_errors:
+                results[index] = Base45Error(group_errors[item])
+            elif len(tail) > 0 and tail[0] + tail[1] * 45 > 0xFF:
+                results[index] = Base45Error(f"Invalid base45 group at position {end - start}")
+            else:
+                output = decoded[start // 3 * 2:end // 3 * 2]
+                if len(tail) > 0:
+                    output += bytes((tail[0] + tail[1] * 45,))
+                results[index] = output
+
+
+def _invalid_character(character, position):
+    return Base45Error(f"Invalid base45 character {character!r} at position {position}")
+
+
+class Base45Error(ValueError):
+    """Invalid base45 input"""
+    def __init__(self, message):
+        self.message = message
+        super().__init__(message)
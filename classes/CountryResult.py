@@ -0,0 +1,52 @@
+"""This file contains the compact QA result records"""
+
+STATUS_PASSED = "passed"
+STATUS_FAILED = "failed"
+STATUS_SKIPPED = "skipped"
+
+
+class TestCaseRecord:
+    """The verdict of one test case: only the file reference, the status and whether it was validated in this run"""
+    __slots__ = ("file", "status", "changed")
+
+    def __init__(self, file: str, status: str, changed: bool):
+        self.file = file
+        self.status = status
+        self.changed = changed
+
+
+class CountryResult:
+    """Counts and test case records of one country; the details of failures are only kept by the reports"""
+    __slots__ = ("country", "passed", "failed", "skipped", "changed", "exception", "records")
+
+    def __init__(self, country: str):
+        self.country = country
+        self.passed = 0
+        self.failed = 0
+        self.skipped = 0
+        # Test cases validated in this run, as opposed to verdicts taken from the result cache
+        self.changed = 0
+        self.exception = None
+        self.records = []
+
+    def add(self, file: str, status: str, changed: bool) -> TestCaseRecord:
+        """Counts the verdict and returns its record"""
+        record = TestCaseRecord(file, status, changed)
+        self.records.append(record)
+        if status == STATUS_PASSED:
+            self.passed += 1
+        elif status == STATUS_FAILED:
+            self.failed += 1
+        else:
+            self.skipped += 1
+        if changed:
+            self.changed += 1
+        return record
+
+    def valid(self) -> bool:
+        """Returns whether the country has test cases and none of them failed"""
+        return self.exception is None and self.failed == 0
+
+    def failed_records(self) -> list:
+        """Returns the records of the failed test cases"""
+        return [record for record in self.records if record.status == STATUS_FAILED]
@@ -1,13 +1,40 @@
 """This file contains the DCC abstraction"""
 
+import base64
 import json
+import zlib
 
-from SchemaValidator import SchemaValidator
-from SignatureValidator import SignatureValidator
+import cbor2
+from cose.messages import Sign1Message
+
+import hcert
+from classes.SchemaValidator import SchemaValidator
+from classes.SignatureValidator import SignatureValidator, COSE_HEADER_ALG, COSE_HEADER_KID, COSE_SIGN1_TAG
+
+# CWT claims
+CLAIM_ISSUER = 1
+CLAIM_EXPIRES_AT = 4
+CLAIM_ISSUED_AT = 6
+
+# CBOR major types
+CBOR_UINT = 0
+CBOR_NEGINT = 1
+CBOR_BYTES = 2
+CBOR_TEXT = 3
+CBOR_ARRAY = 4
+CBOR_MAP = 5
+CBOR_TAG = 6
 
 
 class DigitalCovidCertificate:
-    """Digital Covid Certificate"""
+    """Digital Covid Certificate
+
+    Every layer (base45, inflate, COSE structure and headers, CWT claims, DCC payload) is decoded on first
+    access and kept. The COSE parts and the claims are memoryviews into the COSE bytes, found by walking
+    the CBOR structure, so reading the KID or the expiry never decodes the DCC payload.
+    """
+    __slots__ = ("_qr_text", "_compressed", "_cose", "_protected", "_unprotected", "_payload", "_signature",
+                 "_headers", "_claim_data", "_claims", "_cose_message")
 
     # Shared SchemaValidator instance
     _schema_validator: SchemaValidator = None
@@ -15,37 +42,280 @@ class DigitalCovidCertificate:
     # Shared SignatureValidator instance
     _signature_validator: SignatureValidator = None
 
-    # Static initializer: CALL BEFORE FIRST USE
-    @staticmethod
-    def initialize(schema_validator: SchemaValidator, signature_validator):
+    # Static initializer: CALL BEFORE validate_schema/validate_signature
+    @classmethod
+    def initialize(cls, schema_validator: SchemaValidator, signature_validator: SignatureValidator):
         """Initializes this type for usage (for all instances)"""
-        _schema_validator = schema_validator
-        _signature_validator = signature_validator
+        cls._schema_validator = schema_validator
+        cls._signature_validator = signature_validator
 
-    # self = this, schema_provider = dictionary[version]=>json-schema-instance
-    def __init__(self, dgc_json: str, dgc_cose: bytes):
-        self._dgc_json: str = dgc_json
-        self._dgc_cose: str = dgc_cose
+    def __init__(self, qr_text: str = None, cose: bytes = None):
+        if qr_text is None and cose is None:
+            raise ValueError("A DCC needs a QR text or COSE bytes")
+        self._qr_text = qr_text
+        self._compressed = None
+        self._cose = cose
+        self._protected = None
+        self._unprotected = None
+        self._payload = None
+        self._signature = None
+        self._headers = None
+        self._claim_data = None
+        self._claims = dict()
+        self._cose_message = None
+
+    @classmethod
+    def from_hcert(cls, qr_text: str):
+        """Creates the DCC from the QR text (hcert string), with or without the HC1: prefix"""
+        return cls(qr_text=qr_text)
+
+    @classmethod
+    def from_cose(cls, cose: bytes):
+        """Creates the DCC from the COSE_Sign1 bytes"""
+        return cls(cose=bytes(cose))
 
     @classmethod
     def parse_from_test_json(cls, path: str):
         """Parses the DCC content from the T-systems test case JSON format"""
-        with open(path, 'r') as file:
+        with open(path, 'r', encoding='utf-8') as file:
             test_file_json = json.load(file)
-            dgc_json = test_file_json["JSON"]
-            dgc_cose = bytes.fromhex(test_file_json["COSE"])
-            return cls(None, dgc_json, dgc_cose)
+        if "COSE" in test_file_json:
+            return cls.from_cose(bytes.fromhex(test_file_json["COSE"]))
+        return cls.from_hcert(test_file_json["PREFIX"])
+
+    def qr_text(self) -> str:
+        """Returns the QR text, None when the DCC was created from COSE bytes"""
+        return self._qr_text
+
+    def compressed(self) -> bytes:
+        """Returns the zlib compressed COSE bytes (base45 decoded QR text), None without a QR text"""
+        if self._compressed is None and self._qr_text is not None:
+            self._compressed = hcert.BASE45_DECODER.decode(hcert.strip_prefix(self._qr_text))
+        return self._compressed
+
+    def cose(self) -> bytes:
+        """Returns the COSE_Sign1 bytes"""
+        if self._cose is None:
+            self._cose = zlib.decompress(self.compressed())
+        return self._cose
+
+    def protected_header(self) -> memoryview:
+        """Returns the encoded protected header"""
+        self._sign1()
+        return self._protected
+
+    def payload(self) -> memoryview:
+        """Returns the CBOR encoded CWT claims"""
+        self._sign1()
+        return self._payload
+
+    def signature(self) -> memoryview:
+        """Returns the signature"""
+        self._sign1()
+        return self._signature
+
+    def headers(self) -> dict:
+        """Returns the COSE headers by label; the protected ones win over the unprotected ones"""
+        if self._headers is None:
+            self._sign1()
+            headers = dict(cbor2.loads(self._unprotected))
+            if len(self._protected) > 0:
+                headers.update(cbor2.loads(self._protected))
+            self._headers = headers
+        return self._headers
+
+    def kid(self) -> str:
+        """Returns the base64 KID, or None"""
+        kid = self.headers().get(COSE_HEADER_KID)
+        return None if kid is None else base64.b64encode(kid).decode("UTF-8")
+
+    def algorithm(self) -> int:
+        """Returns the COSE algorithm identifier, or None"""
+        return self.headers().get(COSE_HEADER_ALG)
+
+    def claim(self, key: int):
+        """Returns a single CWT claim, decoding only that claim; None when it's absent"""
+        if key not in self._claims:
+            data = self._claim_slices().get(key)
+            if data is None:
+                return None
+            self._claims[key] = cbor2.loads(data)
+        return self._claims[key]
+
+    def claims(self) -> dict:
+        """Returns all CWT claims"""
+        return {key: self.claim(key) for key in self._claim_slices()}
+
+    def issuer(self) -> str:
+        """Returns the issuing country (iss claim)"""
+        return self.claim(CLAIM_ISSUER)
 
-    def validate_signature(self) -> bool:
+    def issued_at(self) -> int:
+        """Returns the issuing time as a unix timestamp (iat claim)"""
+        return self.claim(CLAIM_ISSUED_AT)
+
+    def expires_at(self) -> int:
+        """Returns the expiry as a unix timestamp (exp claim)"""
+        return self.claim(CLAIM_EXPIRES_AT)
+
+    def dcc(self) -> dict:
+        """Returns the DCC payload (the JSON of the certificate)"""
+        return self.claim(hcert.CLAIM_HCERT)[hcert.HCERT_DCC]
+
+    def version(self) -> str:
+        """Returns the schema version of the DCC payload; only "ver" is decoded when the payload wasn't yet"""
+        if hcert.CLAIM_HCERT in self._claims:
+            return self.dcc().get("ver")
+        return self._dcc_field("ver")
+
+    def triage(self) -> dict:
+        """Returns the fields for routing and deduplication, without decoding the DCC payload"""
+        return {
+            "kid": self.kid(),
+            "alg": self.algorithm(),
+            "iss": self.issuer(),
+            "iat": self.issued_at(),
+            "exp": self.expires_at(),
+            "ver": self.version()
+        }
+
+    def cose_message(self):
+        """Returns the decoded Sign1Message, for printing"""
+        if self._cose_message is None:
+            self._cose_message = Sign1Message.decode(self.cose())
+        return self._cose_message
+
+    def validate_signature(self) -> dict:
         """Validates the signature"""
-        return self._signature_validator.validate(self._dgc_cose)
+        return self._signature_validator.validate(self.cose())
 
     def validate_schema(self):
         """Validates the schema"""
-        version = self._dgc_json["ver"]
-        result = self._schema_validator.validate(self._dgc_json, version)
+        version = self.version()
+        result = self._schema_validator.validate_dcc(self.dcc(), version)
         return {
             'valid': result["valid"],
             'schema': version,
-            'errors': result["errors"]
+            'errors': result.get("errors", [])
         }
+
+    def _sign1(self):
+        if self._payload is not None:
+            return
+        buffer = memoryview(self.cose())
+        major, argument, offset = _cbor_head(buffer, 0)
+        if major == CBOR_TAG:
+            if argument != COSE_SIGN1_TAG:
+                raise DccDecodeError(f"Not a COSE_Sign1 message (tag {argument})")
+            major, argument, offset = _cbor_head(buffer, offset)
+        if major != CBOR_ARRAY or argument != 4:
+            raise DccDecodeError("Not a COSE_Sign1 message")
+        self._protected, offset = _cbor_bytes(buffer, offset)
+        end = _cbor_skip(buffer, offset)
+        self._unprotected = buffer[offset:end]
+        self._payload, offset = _cbor_bytes(buffer, end)
+        self._signature, _ = _cbor_bytes(buffer, offset)
+
+    def _claim_slices(self) -> dict:
+        if self._claim_data is None:
+            payload = self.payload()
+            major, count, offset = _cbor_head(payload, 0)
+            if major != CBOR_MAP:
+                raise DccDecodeError("The CWT claims aren't a map")
+            claim_data = dict()
+            for index in range(count):
+                key, end = _cbor_key(payload, offset)
+                # The last claim (usually the hcert) runs to the end, no need to walk all of the DCC
+                offset = _cbor_skip(payload, end) if index < count - 1 else len(payload)
+                claim_data[key] = payload[end:offset]
+            self._claim_data = claim_data
+        return self._claim_data
+
+    def _dcc_field(self, name):
+        """Decodes a single top level field of the DCC payload, walking past all others; None when absent"""
+        data = self._claim_slices().get(hcert.CLAIM_HCERT)
+        if data is None:
+            return None
+        major, count, offset = _cbor_head(data, 0)
+        if major != CBOR_MAP:
+            raise DccDecodeError("The hcert claim isn't a map")
+        for _ in range(count):
+            key, offset = _cbor_key(data, offset)
+            if key != hcert.HCERT_DCC:
+                offset = _cbor_skip(data, offset)
+                continue
+            major, fields, offset = _cbor_head(data, offset)
+            if major != CBOR_MAP:
+                raise DccDecodeError("The DCC payload isn't a map")
+            for _ in range(fields):
+                field, offset = _cbor_key(data, offset)
+                end = _cbor_skip(data, offset)
+                if field == name:
+                    return cbor2.loads(data[offset:end])
+                offset = end
+            return None
+        return None
+
+
+def _cbor_head(buffer, offset):
+    """Reads the head of the CBOR item at offset; returns (major type, argument, offset of its content)"""
+    if offset >= len(buffer):
+        raise DccDecodeError("Truncated CBOR")
+    initial = buffer[offset]
+    major = initial >> 5
+    info = initial & 0x1F
+    if info < 24:
+        return major, info, offset + 1
+    if info > 27:
+        # Indefinite lengths don't occur in DCCs
+        raise DccDecodeError(f"Unsupported CBOR item {initial:#04x} at position {offset}")
+    size = 1 << (info - 24)
+    if offset + 1 + size > len(buffer):
+        raise DccDecodeError("Truncated CBOR")
+    return major, int.from_bytes(buffer[offset + 1:offset + 1 + size], "big"), offset + 1 + size
+
+
+def _cbor_skip(buffer, offset):
+    """Returns the offset after the CBOR item at offset"""
+    major, argument, offset = _cbor_head(buffer, offset)
+    if major == CBOR_BYTES or major == CBOR_TEXT:
+        offset += argument
+        if offset > len(buffer):
+            raise DccDecodeError("Truncated CBOR")
+    elif major == CBOR_ARRAY:
+        for _ in range(argument):
+            offset = _cbor_skip(buffer, offset)
+    elif major == CBOR_MAP:
+        for _ in range(argument * 2):
+            offset = _cbor_skip(buffer, offset)
+    elif major == CBOR_TAG:
+        offset = _cbor_skip(buffer, offset)
+    return offset
+
+
+def _cbor_key(buffer, offset):
+    """Returns (the map key at offset, the offset after it); integer and text keys are read directly"""
+    major, argument, content = _cbor_head(buffer, offset)
+    if major == CBOR_UINT:
+        return argument, content
+    if major == CBOR_NEGINT:
+        return -1 - argument, content
+    end = _cbor_skip(buffer, offset)
+    if major == CBOR_TEXT:
+        return str(buffer[content:end], "utf-8"), end
+    return cbor2.loads(buffer[offset:end]), end
+
+
+def _cbor_bytes(buffer, offset):
+    """Returns (the content of the byte string at offset, the offset after it)"""
+    major, length, offset = _cbor_head(buffer, offset)
+    if major != CBOR_BYTES or offset + length > len(buffer):
+        raise DccDecodeError("Expected a CBOR byte string")
+    return buffer[offset:offset + length], offset + length
+
+
+class DccDecodeError(ValueError):
+    """Malformed DCC"""
+    def __init__(self, message):
+        self.message = message
+        super().__init__(message)
@@ -1,26 +1,75 @@
 """This file contains the DSC abstraction"""
 
 import base64
+from datetime import timezone
 
 from cryptography import x509
+from cryptography.hazmat.primitives import serialization
 
 
 class DigitalSigningCertificate:
+    """DSC; the X.509 certificate is only decoded when it's first needed"""
+    def __init__(self, country: str, kid: str, raw_data: str, public_key_der: bytes = None, validity: tuple = None):
+        self._country = country
+        self._kid = kid
+        self._raw_data = raw_data
+        self._public_key_der = public_key_der
+        # (notBefore, notAfter) as unix timestamps
+        self._validity = validity
+        self._cert = None
+        self._public_key = None
+
     @classmethod
     def parse(cls, dsc_json):
         """Factory method, parses DSC json and returns instance of this class"""
-        instance = cls()
-        instance._country = dsc_json["country"]
-        instance._kid = dsc_json["kid"]
-        raw_data = dsc_json["rawData"]
-        cert_bytes = base64.b64decode(raw_data)
-        instance._cert = x509.load_der_x509_certificate(cert_bytes)
-        return instance
+        return cls(dsc_json["country"], dsc_json["kid"], dsc_json["rawData"])
 
     def certificate(self):
         """Returns the x509 Certificate"""
+        if self._cert is None:
+            cert_bytes = base64.b64decode(self._raw_data)
+            self._cert = x509.load_der_x509_certificate(cert_bytes)
         return self._cert
 
+    def public_key(self):
+        """Returns the public key, from the snapshot's key material when available"""
+        if self._public_key is None:
+            if self._public_key_der is not None:
+                self._public_key = serialization.load_der_public_key(self._public_key_der)
+            else:
+                self._public_key = self.certificate().public_key()
+        return self._public_key
+
+    def public_key_der(self) -> bytes:
+        """Returns the public key as DER encoded SubjectPublicKeyInfo"""
+        if self._public_key_der is None:
+            self._public_key_der = self.public_key().public_bytes(
+                serialization.Encoding.DER,
+                serialization.PublicFormat.SubjectPublicKeyInfo)
+        return self._public_key_der
+
+    def validity(self) -> tuple:
+        """Returns (notBefore, notAfter) as unix timestamps, from the snapshot when available"""
+        if self._validity is None:
+            certificate = self.certificate()
+            try:
+                not_before, not_after = certificate.not_valid_before_utc, certificate.not_valid_after_utc
+            except AttributeError:
+                # cryptography < 42 only has naive datetimes, in UTC
+                not_before = certificate.not_valid_before.replace(tzinfo=timezone.utc)
+                not_after = certificate.not_valid_after.replace(tzinfo=timezone.utc)
+            self._validity = (not_before.timestamp(), not_after.timestamp())
+        return self._validity
+
+    def valid_at(self, timestamp: float) -> bool:
+        """Returns whether the DSC is valid at the unix timestamp"""
+        not_before, not_after = self.validity()
+        return not_before <= timestamp <= not_after
+
+    def raw_data(self) -> str:
+        """Returns the base64 encoded certificate"""
+        return self._raw_data
+
     def country(self):
         """Returns the Country"""
         return self._country
@@ -0,0 +1,124 @@
+"""This file contains the memory-mapped line index abstraction"""
+
+import argparse
+import hashlib
+import mmap
+import os
+import pickle
+
+from array import array
+
+# Bump when the layout of the index file changes
+INDEX_FORMAT = 1
+LINE_INDEX_CACHE = '.cache/line-index'
+
+
+class LineIndex:
+    """Memory-mapped text file with the offset of every line, for random access by line number
+
+    The offsets are built with one pass over the mapped file and cached per file, keyed by its path, size
+    and mtime. Line numbers start at 1, like the results of validate_hcert.py.
+    """
+    def __init__(self, path: str, mapped, offsets: array):
+        self._path = path
+        self._mapped = mapped
+        # Start of every line, followed by the size of the file
+        self._offsets = offsets
+
+    @classmethod
+    def open(cls, path: str, cache_dir: str = LINE_INDEX_CACHE):
+        """Maps the file and loads its line index from cache_dir (if given), building it when needed"""
+        file_stat = os.stat(path)
+        with open(path, mode='rb') as file:
+            # An empty file can't be mapped
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if file_stat.st_size > 0 else b""
+        key = (os.path.realpath(path), file_stat.st_size, file_stat.st_mtime_ns)
+        index_path = None
+        offsets = None
+        if cache_dir is not None:
+            index_path = os.path.join(cache_dir, f"{hashlib.sha256(key[0].encode('utf-8')).hexdigest()}.idx")
+            offsets = cls._load_offsets(index_path, key)
+        if offsets is None:
+            offsets = cls._build_offsets(mapped)
+            if index_path is not None:
+                cls._save_offsets(index_path, key, offsets)
+        return cls(path, mapped, offsets)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def close(self) -> None:
+        """Unmaps the file"""
+        if isinstance(self._mapped, mmap.mmap):
+            self._mapped.close()
+
+    def line(self, line_number: int) -> str:
+        """Returns the line, without its line break"""
+        start = self._offsets[line_number - 1]
+        end = self._offsets[line_number]
+        return self._mapped[start:end].decode("utf-8").rstrip("\r\n")
+
+    def lines(self, first: int = 1, last: int = None):
+        """Yields (line number, line) from first up to and including last (default: the last line)"""
+        last = len(self) if last is None else min(last, len(self))
+        for line_number in range(max(1, first), last + 1):
+            yield line_number, self.line(line_number)
+
+    def shard(self, shard: int, shards: int, resume_from: int = None):
+        """Yields the (line number, line) of one of <shards> contiguous, disjoint slices of the file
+
+        With resume_from, the lines of the slice before that line number are skipped.
+        """
+        first = len(self) * shard // shards + 1
+        last = len(self) * (shard + 1) // shards
+        if resume_from is not None:
+            first = max(first, resume_from)
+        return self.lines(first, last)
+
+    @staticmethod
+    def _build_offsets(mapped):
+        offsets = array('Q', [0])
+        position = mapped.find(b"\n")
+        while position >= 0:
+            offsets.append(position + 1)
+            position = mapped.find(b"\n", position + 1)
+        # A file ending with a line break doesn't have an empty last line
+        if offsets[-1] != len(mapped):
+            offsets.append(len(mapped))
+        return offsets
+
+    @staticmethod
+    def _load_offsets(index_path, key):
+        """Loads the cached offsets, returns None when they're missing or from another version of the file"""
+        try:
+            with open(index_path, mode='rb') as file:
+                index = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        if index.get("format") != INDEX_FORMAT or index.get("key") != key:
+            return None
+        return index["offsets"]
+
+    @staticmethod
+    def _save_offsets(index_path, key, offsets):
+        index = {
+            "format": INDEX_FORMAT,
+            "key": key,
+            "offsets": offsets
+        }
+        os.makedirs(os.path.dirname(index_path) or '.', exist_ok=True)
+        temp_path = f"{index_path}.{os.getpid()}.tmp"
+        with open(temp_path, mode='wb') as file:
+            pickle.dump(index, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, index_path)
+
+
+def parse_shard(value: str):
+    """Parses "i/N" (0 <= i < N) for argparse, returns (i, N)"""
+    try:
+        shard, shards = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected i/N, got {value}")
+    if shards < 1 or not 0 <= shard < shards:
+        raise argparse.ArgumentTypeError(f"Expected 0 <= i < N, got {value}")
+    return shard, shards
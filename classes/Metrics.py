@@ -0,0 +1,142 @@
+"""This file contains the per-stage timing instrumentation"""
+
+import json
+import math
+import os
+import time
+
+# Histogram buckets per power of two; 8 gives a resolution of about 9%
+BUCKETS_PER_OCTAVE = 8
+
+
+class _NullTimer:
+    """Returned by Metrics.measure when the metrics are off, so a disabled measurement costs one call"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ("_metrics", "_stage", "_start")
+
+    def __init__(self, metrics, stage):
+        self._metrics = metrics
+        self._stage = stage
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._metrics.record(self._stage, time.perf_counter() - self._start)
+        return False
+
+
+class Metrics:
+    """Wall time and count per stage, kept in log-scale histograms so memory doesn't grow with the input
+
+    Off by default; measure() then returns a shared no-op timer.
+    """
+    def __init__(self):
+        self._enabled = False
+        # stage -> {"count", "total", "min", "max", "buckets": {bucket: count}}, times in nanoseconds
+        self._stages = dict()
+
+    def enable(self, enabled: bool = True) -> None:
+        """Switches the recording on or off"""
+        self._enabled = enabled
+
+    def enabled(self) -> bool:
+        """Returns whether the metrics are recorded"""
+        return self._enabled
+
+    def measure(self, stage: str):
+        """Returns a context manager timing the block under the given stage"""
+        if not self._enabled:
+            return _NULL_TIMER
+        return _Timer(self, stage)
+
+    def record(self, stage: str, seconds: float) -> None:
+        """Adds one measurement of the stage"""
+        if not self._enabled:
+            return
+        nanoseconds = max(1, int(seconds * 1_000_000_000))
+        histogram = self._stages.get(stage)
+        if histogram is None:
+            histogram = {"count": 0, "total": 0, "min": nanoseconds, "max": nanoseconds, "buckets": dict()}
+            self._stages[stage] = histogram
+        histogram["count"] += 1
+        histogram["total"] += nanoseconds
+        histogram["min"] = min(histogram["min"], nanoseconds)
+        histogram["max"] = max(histogram["max"], nanoseconds)
+        bucket = int(math.log2(nanoseconds) * BUCKETS_PER_OCTAVE)
+        histogram["buckets"][bucket] = histogram["buckets"].get(bucket, 0) + 1
+
+    def drain(self) -> dict:
+        """Returns the raw histograms and starts over; used to hand a worker's metrics to the main process"""
+        stages = self._stages
+        self._stages = dict()
+        return stages
+
+    def merge(self, stages: dict) -> None:
+        """Adds the raw histograms of drain() (from another process) to these"""
+        for stage, other in stages.items():
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                self._stages[stage] = {**other, "buckets": dict(other["buckets"])}
+                continue
+            histogram["count"] += other["count"]
+            histogram["total"] += other["total"]
+            histogram["min"] = min(histogram["min"], other["min"])
+            histogram["max"] = max(histogram["max"], other["max"])
+            for bucket, count in other["buckets"].items():
+                histogram["buckets"][bucket] = histogram["buckets"].get(bucket, 0) + count
+
+    def summary(self) -> dict:
+        """Returns count, total, mean, min, max and p50/p95/p99 per stage, in milliseconds"""
+        summary = dict()
+        for stage in sorted(self._stages):
+            histogram = self._stages[stage]
+            summary[stage] = {
+                "count": histogram["count"],
+                "total_ms": round(histogram["total"] / 1_000_000, 3),
+                "mean_ms": round(histogram["total"] / histogram["count"] / 1_000_000, 4),
+                "min_ms": round(histogram["min"] / 1_000_000, 4),
+                "max_ms": round(histogram["max"] / 1_000_000, 4),
+                "p50_ms": self._percentile(histogram, 0.50),
+                "p95_ms": self._percentile(histogram, 0.95),
+                "p99_ms": self._percentile(histogram, 0.99)
+            }
+        return summary
+
+    def write(self, path: str) -> None:
+        """Writes the summary as JSON"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, mode='w', encoding='utf-8') as file:
+            json.dump(self.summary(), file, indent=2)
+
+    @staticmethod
+    def _percentile(histogram, fraction):
+        """Returns the upper bound of the bucket holding the percentile, clamped to the observed range"""
+        rank = math.ceil(histogram["count"] * fraction)
+        seen = 0
+        for bucket in sorted(histogram["buckets"]):
+            seen += histogram["buckets"][bucket]
+            if seen >= rank:
+                upper = 2 ** ((bucket + 1) / BUCKETS_PER_OCTAVE)
+                nanoseconds = min(max(upper, histogram["min"]), histogram["max"])
+                return round(nanoseconds / 1_000_000, 4)
+        return round(histogram["max"] / 1_000_000, 4)
+
+
+# One instance per process, switched on by the --metrics flags of the scripts
+METRICS = Metrics()
@@ -0,0 +1,134 @@
+"""This file contains the QR reader abstraction"""
+
+import os
+import tempfile
+import time
+
+from classes.Metrics import METRICS
+
+BACKEND_PYZBAR = "pyzbar"
+BACKEND_ZXING = "zxing"
+
+# Scans larger than this (in pixels, on the longest side) are scaled down before decoding
+MAX_DIMENSION = 1000
+
+
+class QrReader:
+    """Reads QR codes from image files
+
+    pyzbar is the primary backend; zxing (a JVM per call) is only used for the images pyzbar can't read.
+    Without pyzbar (or the zbar library it loads) every image goes to zxing. One reader is meant to be
+    reused for many files, the zxing reader is created once on first use.
+    """
+    def __init__(self, use_zxing: bool = True, max_dimension: int = MAX_DIMENSION):
+        self._use_zxing = use_zxing
+        self._max_dimension = max_dimension
+        self._zxing_reader = None
+        # (decode, ZBarSymbol) once imported, False when pyzbar can't be loaded
+        self._pyzbar = None
+        self._stats = {
+            BACKEND_PYZBAR: {"calls": 0, "failures": 0, "seconds": 0.0, "unavailable": 0},
+            BACKEND_ZXING: {"calls": 0, "failures": 0, "seconds": 0.0, "unavailable": 0}
+        }
+
+    def read(self, file: str) -> str:
+        """Returns the text of the QR code in the image, or None when no backend can read it"""
+        return self.read_many([file])[0]
+
+    def read_many(self, files: list) -> list:
+        """Returns the QR texts of the images, in order, with None for the ones no backend can read"""
+        if self._load_pyzbar():
+            texts = [self._read_pyzbar(file) for file in files]
+        else:
+            self._stats[BACKEND_PYZBAR]["unavailable"] += len(files)
+            texts = [None] * len(files)
+        unread = [index for index, text in enumerate(texts) if text is None]
+        if unread and self._use_zxing:
+            # zxing decodes all remaining images in a single JVM run
+            for index, text in zip(unread, self._read_zxing([files[index] for index in unread])):
+                texts[index] = text
+        return texts
+
+    def stats(self) -> dict:
+        """Returns the calls, failures, time spent and images skipped (backend unavailable) per backend"""
+        return {backend: dict(counters) for backend, counters in self._stats.items()}
+
+    def _preprocess(self, image):
+        """Converts to grayscale and scales down large scans; returns (image, was_scaled)"""
+        image = image.convert("L")
+        if max(image.size) <= self._max_dimension:
+            return image, False
+        scaled = image.copy()
+        scaled.thumbnail((self._max_dimension, self._max_dimension))
+        return scaled, True
+
+    def _load_pyzbar(self):
+        # QR libraries are imported on first use, they're slow to load
+        if self._pyzbar is None:
+            try:
+                from pyzbar.pyzbar import decode, ZBarSymbol
+                self._pyzbar = (decode, ZBarSymbol)
+            except ImportError:
+                # Also raised by pyzbar when the zbar shared library is missing
+                self._pyzbar = False
+        return self._pyzbar
+
+    def _read_pyzbar(self, file):
+        from PIL import Image
+        decode, ZBarSymbol = self._pyzbar
+        counters = self._stats[BACKEND_PYZBAR]
+        counters["calls"] += 1
+        start = time.perf_counter()
+        try:
+            with Image.open(file) as original:
+                image, scaled = self._preprocess(original)
+                barcodes = decode(image, symbols=[ZBarSymbol.QRCODE])
+                if not barcodes and scaled:
+                    # Dense codes can be lost by scaling, try once more at full resolution
+                    barcodes = decode(original.convert("L"), symbols=[ZBarSymbol.QRCODE])
+        except OSError:
+            barcodes = []
+        elapsed = time.perf_counter() - start
+        counters["seconds"] += elapsed
+        METRICS.record("qr.pyzbar", elapsed)
+        if not barcodes:
+            counters["failures"] += 1
+            return None
+        return barcodes[0].data.decode("utf-8")
+
+    def _read_zxing(self, files):
+        counters = self._stats[BACKEND_ZXING]
+        counters["calls"] += len(files)
+        start = time.perf_counter()
+        temporary_paths = []
+        try:
+            if self._zxing_reader is None:
+                import zxing
+                self._zxing_reader = zxing.BarCodeReader()
+            # zxing only reads paths, images in memory (file objects) are written to temporary files
+            paths = []
+            for file in files:
+                if hasattr(file, "read"):
+                    file.seek(0)
+                    with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as temporary_file:
+                        temporary_file.write(file.read())
+                    temporary_paths.append(temporary_file.name)
+                    paths.append(temporary_file.name)
+                else:
+                    paths.append(file)
+            barcodes = self._zxing_reader.decode(paths)
+        except ImportError:
+            counters["unavailable"] += len(files)
+            barcodes = [None] * len(files)
+        except Exception:
+            # No Java: the files stay unread
+            barcodes = [None] * len(files)
+        finally:
+            for path in temporary_paths:
+                os.remove(path)
+        elapsed = time.perf_counter() - start
+        counters["seconds"] += elapsed
+        METRICS.record("qr.zxing", elapsed)
+        texts = [barcode.raw if barcode is not None and barcode.raw else None for barcode in barcodes]
+        counters["failures"] += texts.count(None)
+        return texts
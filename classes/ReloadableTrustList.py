@@ -0,0 +1,114 @@
+"""This file contains the reloadable TrustList abstraction"""
+
+import os
+import sys
+import threading
+
+from classes.DigitalSigningCertificate import DigitalSigningCertificate
+from classes.TrustList import TrustList
+
+
+class ReloadableTrustList:
+    """TrustList holder that follows changes to the trust list file
+
+    Lookups always go to the current TrustList. A reload builds the new one next to it and swaps the
+    reference in one assignment, so validations that are in flight are never blocked.
+    """
+    def __init__(self, path: str, snapshot_dir: str = None, poll_interval: float = 5.0):
+        self._path = path
+        self._snapshot_dir = snapshot_dir
+        self._poll_interval = poll_interval
+        self._current = TrustList.load(path, snapshot_dir)
+        self._file_stat = self._stat()
+        self._listeners = list()
+        # Serializes reloads; lookups never take it
+        self._reload_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def add_listener(self, listener):
+        """Registers listener(changed_kids), called after each reload that changed something"""
+        self._listeners.append(listener)
+
+    def start(self):
+        """Starts watching the file in a background thread"""
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._watch, name="trust-list-reloader", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops watching the file"""
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+    def reload_if_changed(self) -> set:
+        """Reloads the trust list if the file changed, returns the KIDs that were added, removed or replaced"""
+        with self._reload_lock:
+            file_stat = self._stat()
+            if file_stat == self._file_stat:
+                return set()
+            loaded = TrustList.load(self._path, self._snapshot_dir)
+            self._file_stat = file_stat
+            if loaded.digest() == self._current.digest():
+                return set()
+            trust_list, changed = self._current.updated(loaded)
+            self._current = trust_list
+        for listener in self._listeners:
+            listener(changed)
+        return changed
+
+    def current(self) -> TrustList:
+        """Returns the current TrustList"""
+        return self._current
+
+    def digest(self) -> str:
+        """Returns the SHA-256 of the current trust list file"""
+        return self._current.digest()
+
+    def kids(self) -> list:
+        """Returns the KIDs in the current TL"""
+        return self._current.kids()
+
+    def countries(self) -> list:
+        """Returns the countries that have DSCs in the current TL"""
+        return self._current.countries()
+
+    def kids_of(self, country: str) -> list:
+        """Returns the KIDs of the country's DSCs in the current TL"""
+        return self._current.kids_of(country)
+
+    def validity(self, kid: str) -> tuple:
+        """Returns the validity window of the DSC in the current TL"""
+        return self._current.validity(kid)
+
+    def country_stats(self, at: float = None) -> dict:
+        """Returns the DSC counts per country of the current TL"""
+        return self._current.country_stats(at)
+
+    def find(self, kid: str) -> DigitalSigningCertificate:
+        """Finds the DSC in the current TL"""
+        return self._current.find(kid)
+
+    def _stat(self):
+        file_stat = os.stat(self._path)
+        return file_stat.st_mtime_ns, file_stat.st_size
+
+    def _watch(self):
+        last_error = None
+        while not self._stop_event.wait(self._poll_interval):
+            try:
+                self.reload_if_changed()
+                last_error = None
+            except Exception as error:
+                # A half-written or broken file; keep the current TL and try again on the next poll. Whatever
+                # went wrong, the thread must not end, or the TL is never reloaded again.
+                message = f"{type(error).__name__}: {error}"
+                if message != last_error:
+                    print(f"Trust list {self._path} not reloaded, keeping the current one: {message}",
+                          file=sys.stderr)
+                last_error = message
@@ -0,0 +1,138 @@
+"""This file contains the streaming QA report writer"""
+
+import json
+import shutil
+import tempfile
+from xml.sax.saxutils import escape, quoteattr
+
+from classes.CountryResult import CountryResult, TestCaseRecord, STATUS_FAILED, STATUS_SKIPPED
+
+
+class ReportWriter:
+    """Reports every QA verdict as soon as it's known: error details on the console, NDJSON and JUnit XML
+
+    Nothing but the output files is kept: a JUnit test suite is spooled to a temporary file until its country
+    is done, as the suite's counts come first.
+    """
+    def __init__(self, ndjson_path: str = None, junit_path: str = None, changed_only: bool = False):
+        self._changed_only = changed_only
+        self._ndjson = open(ndjson_path, mode='w', encoding='utf-8') if ndjson_path is not None else None
+        self._junit = None
+        self._suite = None
+        if junit_path is not None:
+            self._junit = open(junit_path, mode='w', encoding='utf-8')
+            self._junit.write('<?xml version="1.0" encoding="UTF-8"?>\n<testsuites name="dcc-quality-assurance">\n')
+
+    def add(self, result: CountryResult, file: str, status: str, entry, changed: bool) -> TestCaseRecord:
+        """Counts the verdict in the country's result and writes it to the reports"""
+        record = result.add(file, status, changed)
+        details = self.details(entry) if status == STATUS_FAILED else dict()
+        if status == STATUS_FAILED and (changed or not self._changed_only):
+            self._print_failure(result.country, file, details)
+        if self._ndjson is not None:
+            self._ndjson.write(json.dumps({
+                "country": result.country,
+                "file": file,
+                "status": status,
+                "changed": changed,
+                **details
+            }, ensure_ascii=False))
+            self._ndjson.write("\n")
+            self._ndjson.flush()
+        if self._junit is not None:
+            self._write_testcase(result.country, file, status, details)
+        return record
+
+    def end_country(self, result: CountryResult) -> None:
+        """Closes the JUnit test suite of the country"""
+        if self._ndjson is not None and result.exception is not None:
+            self._ndjson.write(json.dumps({"country": result.country, "exception": result.exception}))
+            self._ndjson.write("\n")
+            self._ndjson.flush()
+        if self._junit is None:
+            return
+        errors = 0
+        if result.exception is not None:
+            errors = 1
+            self._suite_file().write(f'    <testcase classname={quoteattr(result.country)} name="(test cases)">'
+                                     f'<error message={quoteattr(result.exception)}/></testcase>\n')
+        self._junit.write(f'  <testsuite name={quoteattr(result.country)} tests="{len(result.records) + errors}"'
+                          f' failures="{result.failed}" errors="{errors}" skipped="{result.skipped}">\n')
+        if self._suite is not None:
+            self._suite.seek(0)
+            shutil.copyfileobj(self._suite, self._junit)
+            self._suite.close()
+            self._suite = None
+        self._junit.write('  </testsuite>\n')
+        self._junit.flush()
+
+    def close(self) -> None:
+        """Finishes and closes the report files"""
+        if self._ndjson is not None:
+            self._ndjson.close()
+            self._ndjson = None
+        if self._junit is not None:
+            self._junit.write('</testsuites>\n')
+            self._junit.close()
+            self._junit = None
+
+    @staticmethod
+    def details(entry) -> dict:
+        """Returns the printable error details of a failed test case"""
+        details = dict()
+        if "exception" in entry:
+            details["exception"] = str(entry["exception"])
+        if "schema" in entry and not entry["schema"]["valid"]:
+            details["schema_errors"] = [str(error["error"]) for error in entry["schema"]["errors"]]
+        if "signature" in entry and not entry["signature"]["valid"]:
+            details["signature_error"] = str(entry["signature"]["error"]["message"])
+        for key in ("json", "cbor", "cose_msg"):
+            if key in entry:
+                details[key] = str(entry[key])
+        return details
+
+    @staticmethod
+    def _print_failure(country, file, details):
+        print(f"{ country }")
+        print(f"  {file}")
+        if "exception" in details:
+            print("    General error:")
+            print(f"      { details['exception'] }")
+        if "schema_errors" in details:
+            print("    Schema error:")
+            for error in details["schema_errors"]:
+                print(f'      { error }')
+        if "signature_error" in details:
+            print("    Signature error:")
+            print(f"      { details['signature_error'] }")
+        if "json" in details:
+            print("    JSON:")
+            print(f"      {details['json']}")
+        if "cbor" in details:
+            print("    CBOR:")
+            print(f"      {details['cbor']}")
+        if "cose_msg" in details:
+            print("    COSE message:")
+            print(f"      {details['cose_msg']}")
+
+    def _suite_file(self):
+        if self._suite is None:
+            self._suite = tempfile.TemporaryFile(mode='w+', encoding='utf-8')
+        return self._suite
+
+    def _write_testcase(self, country, file, status, details):
+        suite = self._suite_file()
+        suite.write(f'    <testcase classname={quoteattr(country)} name={quoteattr(file)}')
+        if status == STATUS_FAILED:
+            if "exception" in details:
+                message = details["exception"]
+            elif "schema_errors" in details:
+                message = "Schema error"
+            else:
+                message = details.get("signature_error", "Failed")
+            text = "\n".join(f"{key}: {value}" for key, value in details.items())
+            suite.write(f'><failure message={quoteattr(message)}>{escape(text)}</failure></testcase>\n')
+        elif status == STATUS_SKIPPED:
+            suite.write('><skipped/></testcase>\n')
+        else:
+            suite.write('/>\n')
@@ -0,0 +1,99 @@
+"""This file contains the QA result cache abstraction"""
+
+import hashlib
+import os
+import pickle
+
+# Bump when the layout of the cache file, or the meaning of the verdicts in it, changes
+CACHE_FORMAT = 2
+
+
+class ResultCache:
+    """Persistent verdicts of QA test cases, keyed by the content hash and schema version of the file
+
+    The cache belongs to one generation: the hash of the schemas and the trust list it was built with, the
+    schema engine and the version of the validation logic. When any of them changes, every verdict is evicted.
+    """
+    def __init__(self, path: str, generation: str, entries: dict = None):
+        self._path = path
+        self._generation = generation
+        self._entries = entries if entries is not None else dict()
+        self._hits = 0
+        self._misses = 0
+
+    @classmethod
+    def load(cls, path: str, generation: str):
+        """Loads the cache from path, starting empty when it's missing or from another generation"""
+        try:
+            with open(path, mode='rb') as file:
+                cache = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return cls(path, generation)
+        if cache.get("format") != CACHE_FORMAT or cache.get("generation") != generation:
+            return cls(path, generation)
+        return cls(path, generation, cache["entries"])
+
+    @staticmethod
+    def generation_of(paths: list) -> str:
+        """Returns the combined hash of the given files (the schemas and the trust list)"""
+        digest = hashlib.sha256()
+        for path in paths:
+            with open(path, mode='rb') as file:
+                digest.update(hashlib.sha256(file.read()).digest())
+        return digest.hexdigest()
+
+    @staticmethod
+    def content_hash(path: str) -> str:
+        """Returns the hash of the file's content"""
+        with open(path, mode='rb') as file:
+            return hashlib.sha256(file.read()).hexdigest()
+
+    def get(self, content_hash: str, version: str):
+        """Returns the cached (status, details) or None"""
+        verdict = self._entries.get((content_hash, version))
+        if verdict is None:
+            self._misses += 1
+        else:
+            self._hits += 1
+        return verdict
+
+    def put(self, content_hash: str, version: str, status: str, details) -> None:
+        """Stores the verdict; the details are reduced to what the report prints"""
+        self._entries[(content_hash, version)] = (status, self._printable(details, True))
+
+    def save(self) -> None:
+        """Writes the cache to disk"""
+        cache = {
+            "format": CACHE_FORMAT,
+            "generation": self._generation,
+            "entries": self._entries
+        }
+        os.makedirs(os.path.dirname(self._path) or '.', exist_ok=True)
+        temp_path = f"{self._path}.{os.getpid()}.tmp"
+        with open(temp_path, mode='wb') as file:
+            pickle.dump(cache, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self._path)
+
+    def cache_info(self):
+        """Returns the hit/miss counters"""
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "size": len(self._entries)
+        }
+
+    @classmethod
+    def _printable(cls, value, top_level=False):
+        """Turns exceptions, COSE messages etc. into the text the report would print for them"""
+        if isinstance(value, (str, int, float, bool)) or value is None:
+            return value
+        if isinstance(value, dict):
+            if top_level:
+                # schema/signature results are inspected by the report, everything else is printed as a whole
+                return {key: cls._printable(item) if key in ("schema", "signature") else
+                        (item if isinstance(item, str) else str(item))
+                        for key, item in value.items()}
+            return {key: cls._printable(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [cls._printable(item) for item in value]
+        return str(value)
@@ -0,0 +1,260 @@
+"""This file contains the revocation list abstraction"""
+
+import base64
+import bisect
+import csv
+import hashlib
+import json
+import math
+import mmap
+import os
+import struct
+
+from classes.Metrics import METRICS
+from classes.SignatureValidator import ALG_ES256
+
+# Revocation entries are the first 128 bits of a SHA-256 hash
+HASH_LENGTH = 16
+PREFIX_BITS = 16
+
+# File layout: header, prefix table (start of every 16 bit prefix in the sorted hashes, plus the count),
+# Bloom filter bits, sorted hashes
+MAGIC = b"DCCREVOC"
+INDEX_FORMAT = 1
+HEADER = struct.Struct("<8sIIQQI")
+HEADER_SIZE = 64
+PREFIX_TABLE = struct.Struct(f"<{(1 << PREFIX_BITS) + 1}Q")
+MASK64 = (1 << 64) - 1
+
+# NumPy is optional; it's imported on first use and without it the index is built in pure Python
+_NUMPY = None
+
+
+def _numpy():
+    """Returns the numpy module, or False when it isn't installed"""
+    global _NUMPY
+    if _NUMPY is None:
+        try:
+            import numpy
+            _NUMPY = numpy
+        except ImportError:
+            _NUMPY = False
+    return _NUMPY
+
+
+def revocation_hash(data: bytes) -> bytes:
+    """Returns the revocation hash of the data: the first 128 bits of its SHA-256"""
+    return hashlib.sha256(data).digest()[:HASH_LENGTH]
+
+
+def dcc_hashes(dcc: dict, issuer: str, signature: bytes, algorithm: int) -> list:
+    """Returns the UCI, COUNTRYCODEUCI and SIGNATURE revocation hashes of a DCC"""
+    hashes = []
+    for group in ("v", "t", "r"):
+        if group in dcc and len(dcc[group]) > 0:
+            uci = dcc[group][0].get("ci", "")
+            country = dcc[group][0].get("co", issuer or "")
+            hashes.append(revocation_hash(uci.encode("utf-8")))
+            hashes.append(revocation_hash(f"{country}{uci}".encode("utf-8")))
+            break
+    if signature is not None:
+        signature = bytes(signature)
+        # For ECDSA only r is hashed, as s can be changed without invalidating the signature
+        hashes.append(revocation_hash(signature[:len(signature) // 2] if algorithm == ALG_ES256 else signature))
+    return hashes
+
+
+class RevocationList:
+    """Memory-mapped, sorted index of revocation hashes with a Bloom filter in front
+
+    Opening maps the file, nothing is read up front; the pages a lookup touches are loaded by the OS and
+    shared by every process. A lookup checks the Bloom filter (most DCCs stop there), then does a binary
+    search in the range of hashes with the same 16 bit prefix.
+    """
+    def __init__(self, path: str):
+        self._path = path
+        with open(path, mode='rb') as file:
+            self._mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, index_format, hash_length, self._count, self._bloom_bits, self._bloom_hashes = \
+            HEADER.unpack_from(self._mapped, 0)
+        if magic != MAGIC or index_format != INDEX_FORMAT or hash_length != HASH_LENGTH:
+            raise ValueError(f"{path} is not a revocation index (format {INDEX_FORMAT})")
+        self._prefix_offset = HEADER_SIZE
+        self._bloom_offset = self._prefix_offset + PREFIX_TABLE.size
+        self._hash_offset = self._bloom_offset + self._bloom_bits // 8
+
+    @classmethod
+    def open(cls, path: str):
+        """Opens a revocation index written by compile()"""
+        return cls(path)
+
+    def __len__(self):
+        return self._count
+
+    def close(self) -> None:
+        """Unmaps the index"""
+        self._mapped.close()
+
+    def bloom_contains(self, revocation_hash: bytes) -> bool:
+        """Returns whether the 128 bit hash passes the Bloom filter (it may be revoked)"""
+        mapped = self._mapped
+        first = int.from_bytes(revocation_hash[:8], "little")
+        step = int.from_bytes(revocation_hash[8:16], "little") | 1
+        for index in range(self._bloom_hashes):
+            bit = ((first + index * step) & MASK64) % self._bloom_bits
+            if not mapped[self._bloom_offset + (bit >> 3)] & (1 << (bit & 7)):
+                return False
+        return True
+
+    def contains(self, revocation_hash: bytes) -> bool:
+        """Returns whether the 128 bit hash is revoked"""
+        if not self.bloom_contains(revocation_hash):
+            return False
+        mapped = self._mapped
+        prefix = int.from_bytes(revocation_hash[:PREFIX_BITS // 8], "big")
+        low, high = struct.unpack_from("<QQ", mapped, self._prefix_offset + prefix * 8)
+        while low < high:
+            middle = (low + high) // 2
+            offset = self._hash_offset + middle * HASH_LENGTH
+            candidate = mapped[offset:offset + HASH_LENGTH]
+            if candidate == revocation_hash:
+                return True
+            if candidate < revocation_hash:
+                low = middle + 1
+            else:
+                high = middle
+        return False
+
+    def is_revoked(self, dcc: dict, issuer: str, signature: bytes, algorithm: int) -> bool:
+        """Returns whether the UCI, country and UCI, or signature hash of the DCC is revoked"""
+        with METRICS.measure("revocation.lookup"):
+            return any(self.contains(revocation_hash) for revocation_hash in dcc_hashes(dcc, issuer, signature,
+                                                                                       algorithm))
+
+    @classmethod
+    def compile(cls, sources: list, path: str, false_positive_rate: float = 0.01) -> int:
+        """Reads the revocation dumps (JSON or CSV) and writes the index to path, returns the number of hashes"""
+        hashes = bytearray()
+        for source in sources:
+            for revocation_hash in read_dump(source):
+                hashes += revocation_hash
+        return cls.build(hashes, path, false_positive_rate)
+
+    @classmethod
+    def build(cls, hashes, path: str, false_positive_rate: float = 0.01) -> int:
+        """Writes the index of the concatenated 128 bit hashes to path, returns the number of distinct hashes"""
+        numpy = _numpy()
+        if numpy:
+            sorted_hashes, prefix_table = cls._sort_numpy(hashes)
+        else:
+            sorted_hashes, prefix_table = cls._sort_python(hashes)
+        count = len(sorted_hashes) // HASH_LENGTH
+        # Optimal Bloom filter size and number of hash functions for the false positive rate
+        bloom_bits = max(64, math.ceil(-count * math.log(false_positive_rate) / math.log(2) ** 2))
+        bloom_bits = (bloom_bits + 63) // 64 * 64
+        bloom_hashes = max(1, round(bloom_bits / count * math.log(2))) if count > 0 else 1
+        if numpy:
+            bloom = cls._bloom_numpy(sorted_hashes, bloom_bits, bloom_hashes)
+        else:
+            bloom = cls._bloom_python(sorted_hashes, bloom_bits, bloom_hashes)
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, mode='wb') as file:
+            file.write(HEADER.pack(MAGIC, INDEX_FORMAT, HASH_LENGTH, count, bloom_bits, bloom_hashes)
+                       .ljust(HEADER_SIZE, b"\0"))
+            file.write(PREFIX_TABLE.pack(*prefix_table))
+            file.write(bloom)
+            file.write(sorted_hashes)
+        os.replace(temp_path, path)
+        return count
+
+    @staticmethod
+    def _sort_python(hashes):
+        hashes = bytes(hashes)
+        unique = sorted({hashes[offset:offset + HASH_LENGTH] for offset in range(0, len(hashes), HASH_LENGTH)})
+        prefixes = [int.from_bytes(revocation_hash[:PREFIX_BITS // 8], "big") for revocation_hash in unique]
+        prefix_table = [bisect.bisect_left(prefixes, prefix) for prefix in range(1 << PREFIX_BITS)]
+        prefix_table.append(len(unique))
+        return b"".join(unique), prefix_table
+
+    @staticmethod
+    def _sort_numpy(hashes):
+        numpy = _NUMPY
+        rows = numpy.frombuffer(bytes(hashes), dtype=numpy.uint8).reshape(-1, HASH_LENGTH)
+        # Two big endian 64 bit words per hash sort like the bytes do
+        words = rows.view(">u8")
+        rows = rows[numpy.lexsort((words[:, 1], words[:, 0]))]
+        if len(rows) > 1:
+            words = rows.view(">u8")
+            distinct = numpy.ones(len(rows), dtype=bool)
+            distinct[1:] = (words[1:, 0] != words[:-1, 0]) | (words[1:, 1] != words[:-1, 1])
+            rows = rows[distinct]
+        prefixes = rows[:, 0].astype(numpy.int64) << 8 | rows[:, 1]
+        prefix_table = numpy.searchsorted(prefixes, numpy.arange((1 << PREFIX_BITS) + 1), side="left")
+        return rows.tobytes(), [int(start) for start in prefix_table]
+
+    @staticmethod
+    def _bloom_python(sorted_hashes, bloom_bits, bloom_hashes):
+        bloom = bytearray(bloom_bits // 8)
+        for offset in range(0, len(sorted_hashes), HASH_LENGTH):
+            first = int.from_bytes(sorted_hashes[offset:offset + 8], "little")
+            step = int.from_bytes(sorted_hashes[offset + 8:offset + 16], "little") | 1
+            for index in range(bloom_hashes):
+                bit = ((first + index * step) & MASK64) % bloom_bits
+                bloom[bit >> 3] |= 1 << (bit & 7)
+        return bytes(bloom)
+
+    @staticmethod
+    def _bloom_numpy(sorted_hashes, bloom_bits, bloom_hashes):
+        numpy = _NUMPY
+        words = numpy.frombuffer(sorted_hashes, dtype="<u8").reshape(-1, 2)
+        first = words[:, 0]
+        step = words[:, 1] | numpy.uint64(1)
+        bits = numpy.zeros(bloom_bits, dtype=bool)
+        for index in range(bloom_hashes):
+            # uint64 arithmetic wraps around, like the masked arithmetic of the lookup
+            bits[(first + step * numpy.uint64(index)) % numpy.uint64(bloom_bits)] = True
+        return numpy.packbits(bits, bitorder="little").tobytes()
+
+
+def read_dump(path: str):
+    """Yields the 128 bit hashes of a revocation dump
+
+    JSON: gateway batches ({"entries": [{"hash": ...}]}), a list of them, or a list of hashes.
+    CSV: one hash per row, from the "hash" column when there is a header. Hashes are base64 or hex.
+    """
+    if path.lower().endswith(".json"):
+        with open(path, mode='r', encoding='utf-8') as file:
+            dump = json.load(file)
+        batches = dump if isinstance(dump, list) else [dump]
+        for batch in batches:
+            if isinstance(batch, str):
+                yield decode_hash(batch)
+                continue
+            for entry in batch.get("entries", []):
+                yield decode_hash(entry["hash"] if isinstance(entry, dict) else entry)
+        return
+    with open(path, mode='r', encoding='utf-8', newline='') as file:
+        rows = csv.reader(file)
+        column = 0
+        for number, row in enumerate(rows):
+            if len(row) == 0 or row[0].strip() == "":
+                continue
+            lowered = [cell.strip().lower() for cell in row]
+            if number == 0 and "hash" in lowered:
+                column = lowered.index("hash")
+                continue
+            yield decode_hash(row[column])
+
+
+def decode_hash(text: str) -> bytes:
+    """Decodes a base64 or hex revocation hash; longer hashes (e.g. a full SHA-256) are truncated to 128 bits"""
+    text = text.strip()
+    if len(text) in (2 * HASH_LENGTH, 64) and all(character in "0123456789abcdefABCDEF" for character in text):
+        raw = bytes.fromhex(text)
+    else:
+        raw = base64.b64decode(text, validate=True)
+    if len(raw) < HASH_LENGTH:
+        raise ValueError(f"Revocation hash too short: {text}")
+    return raw[:HASH_LENGTH]
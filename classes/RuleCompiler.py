@@ -0,0 +1,324 @@
+"""This file contains the CertLogic business rule compiler"""
+
+import hashlib
+import json
+import os
+
+# Bump when the generated code changes, so cached rules are regenerated
+COMPILER_VERSION = 1
+
+# CertLogic date comparisons, and the Python comparison they become
+DATE_COMPARISONS = {
+    "before": "_lt",
+    "after": "_gt",
+    "not-after": "_le",
+    "not-before": "_ge"
+}
+
+INTEGER_COMPARISONS = {
+    "<": "_lt",
+    ">": "_gt",
+    "<=": "_le",
+    ">=": "_ge"
+}
+
+TIME_UNITS = ["year", "month", "day", "hour"]
+
+PREAMBLE = '''"""Generated by classes/RuleCompiler.py, do not edit"""
+
+import re
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from operator import lt as _lt, gt as _gt, le as _le, ge as _ge
+
+_DATE = re.compile(r"^(\\d{4})-(\\d{2})-(\\d{2})"
+                   r"(?:T(\\d{2}):(\\d{2}):(\\d{2})(\\.\\d+)?(Z|[+-]\\d{2}(?::?\\d{2})?)?)?$")
+_UVCI_SEPARATORS = re.compile("[/#:]")
+
+
+def _describe(value):
+    return f"{type(value).__name__} {value!r}"
+
+
+def _truthy(value):
+    """CertLogic truthiness: anything that is neither truthy nor falsy (e.g. a date) is an error"""
+    if value is True:
+        return True
+    if value is False or value is None:
+        return False
+    if isinstance(value, (str, list, dict)):
+        return len(value) > 0
+    if isinstance(value, (int, float)):
+        return value != 0
+    raise ValueError(f"{_describe(value)} is neither truthy nor falsy")
+
+
+def _var(data, path):
+    for key, index in path:
+        if isinstance(data, dict):
+            data = data.get(key)
+        elif isinstance(data, list) and index is not None and 0 <= index < len(data):
+            data = data[index]
+        else:
+            return None
+    return data
+
+
+def _equals(left, right):
+    if isinstance(left, bool) or isinstance(right, bool):
+        return left is right
+    return left == right
+
+
+def _in(value, values):
+    if not isinstance(values, list):
+        raise ValueError(f"The right operand of in must be an array, got {_describe(values)}")
+    return value in values
+
+
+def _is_integer(value):
+    if isinstance(value, float):
+        return value.is_integer()
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _integers(operation, values):
+    for value in values:
+        if not _is_integer(value):
+            raise ValueError(f"The operands of {operation} must be integers, got {_describe(value)}")
+    return values
+
+
+def _dates(operation, values):
+    for value in values:
+        if not isinstance(value, datetime):
+            raise ValueError(f"The operands of {operation} must be dates (plusTime), got {_describe(value)}")
+    return values
+
+
+def _compare(compare, values):
+    if len(values) == 2:
+        return compare(values[0], values[1])
+    return compare(values[0], values[1]) and compare(values[1], values[2])
+
+
+@lru_cache(maxsize=4096)
+def _parse_date(text):
+    """Parses a date or date-time like certlogic-js: no offset means UTC, fractions are cut to milliseconds"""
+    match = _DATE.match(text)
+    if match is None:
+        raise ValueError(f"Not a date: {text!r}")
+    year, month, day, hour, minute, second, fraction, offset = match.groups()
+    moment = datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0), int(second or 0),
+                      int((fraction or ".")[1:4].ljust(3, "0")) * 1000, timezone.utc)
+    if offset is not None and offset != "Z":
+        minutes = int(offset[1:3]) * 60 + int(offset[-2:] if len(offset) > 3 else 0)
+        moment -= timedelta(minutes=minutes if offset[0] == "+" else -minutes)
+    return moment
+
+
+def _plus_time(value, amount, unit):
+    if not isinstance(value, str):
+        raise ValueError(f"The date operand of plusTime must be a string, got {_describe(value)}")
+    moment = _parse_date(value)
+    if unit == "day":
+        return moment + timedelta(days=amount)
+    if unit == "hour":
+        return moment + timedelta(hours=amount)
+    month = moment.month - 1 + (amount * 12 if unit == "year" else amount)
+    # Like JavaScript's setUTCMonth, a day past the end of the month runs over into the next one
+    return moment.replace(year=moment.year + month // 12, month=month % 12 + 1, day=1) + \\
+        timedelta(days=moment.day - 1)
+
+
+def _reduce(values, function, initial):
+    if values is None:
+        return initial
+    if not isinstance(values, list):
+        raise ValueError(f"The operand of reduce must be an array or null, got {_describe(values)}")
+    accumulator = initial
+    for current in values:
+        accumulator = function({"accumulator": accumulator, "current": current})
+    return accumulator
+
+
+def _extract_from_uvci(uvci, index):
+    if uvci is None:
+        return None
+    if not isinstance(uvci, str):
+        raise ValueError(f"The operand of extractFromUVCI must be a string or null, got {_describe(uvci)}")
+    if uvci.startswith("URN:UVCI:"):
+        uvci = uvci[len("URN:UVCI:"):]
+    fragments = _UVCI_SEPARATORS.split(uvci)
+    return fragments[index] if index < len(fragments) else None
+
+
+def _plus(values):
+    return sum(_integers("+", values))
+'''
+
+
+class RuleCompiler:
+    """Turns CertLogic business rules into Python code
+
+    Every rule becomes one function of the data ({"payload": DCC, "external": parameters}) that returns
+    whether the rule passed. The lazy operations become conditional expressions (if, and) and nested
+    functions (the lambda of reduce), everything else calls the small runtime in the preamble.
+    """
+    def __init__(self, rules: list):
+        self._rules = rules
+        # Number -> source of the reduce lambdas
+        self._lambdas = dict()
+        self._lambda_count = 0
+        self._temporaries = 0
+
+    @classmethod
+    def load(cls, path: str, cache_dir: str = None) -> list:
+        """Returns (rule, compiled function) for every rule in the rule file at path
+
+        The file holds one rule or a list of them. The generated code is cached in cache_dir, keyed by the
+        file's content.
+        """
+        with open(path, mode='rb') as file:
+            rules_bytes = file.read()
+        rules = json.loads(rules_bytes)
+        if isinstance(rules, dict):
+            rules = [rules]
+        source = None
+        cache_path = None
+        if cache_dir is not None:
+            digest = hashlib.sha256(rules_bytes + str(COMPILER_VERSION).encode()).hexdigest()
+            name = os.path.splitext(os.path.basename(path))[0]
+            cache_path = os.path.join(cache_dir, f"{name}-{digest[:16]}.py")
+            if os.path.exists(cache_path):
+                with open(cache_path, mode='r', encoding='utf-8') as file:
+                    source = file.read()
+        if source is None:
+            source = cls(rules).compile()
+            if cache_path is not None:
+                os.makedirs(cache_dir, exist_ok=True)
+                temp_path = f"{cache_path}.{os.getpid()}.tmp"
+                with open(temp_path, mode='w', encoding='utf-8') as file:
+                    file.write(source)
+                os.replace(temp_path, cache_path)
+        namespace = dict()
+        exec(compile(source, cache_path or path, 'exec'), namespace)
+        return list(zip(rules, namespace["RULES"]))
+
+    def compile(self) -> str:
+        """Returns the source code of the rule module; RULES holds the function of every rule, in order"""
+        functions = [self._compile_rule(number, rule) for number, rule in enumerate(self._rules)]
+        names = ", ".join(f"_rule_{number}" for number in range(len(self._rules)))
+        return PREAMBLE + "".join(self._lambdas[number] for number in sorted(self._lambdas)) + \
+            "".join(functions) + f"\n\nRULES = [{names}]\n"
+
+    def _compile_rule(self, number, rule) -> str:
+        """A rule that can't be compiled (unknown operation, malformed operands) always raises, so it's OPEN"""
+        self._temporaries = 0
+        try:
+            if not isinstance(rule, dict) or "Logic" not in rule:
+                raise ValueError("The rule has no Logic")
+            body = f"    return _truthy({self._expression(rule['Logic'])})"
+        except ValueError as error:
+            body = f"    raise ValueError({f'The rule can not be compiled: {error}'!r})"
+        identifier = rule.get("Identifier") if isinstance(rule, dict) else None
+        return f"\n\n# {json.dumps(identifier)}\ndef _rule_{number}(data):\n{body}\n"
+
+    def _temporary(self) -> str:
+        self._temporaries += 1
+        return f"_v{self._temporaries}"
+
+    def _expression(self, logic) -> str:
+        """Returns the Python expression for the CertLogic expression"""
+        if isinstance(logic, list):
+            return "[" + ", ".join(self._expression(item) for item in logic) + "]"
+        if logic is None or isinstance(logic, (bool, int, float, str)):
+            return repr(logic)
+        if not isinstance(logic, dict) or len(logic) != 1:
+            raise ValueError(f"Expected an operation with a single operator, got {json.dumps(logic)}")
+        operation, operands = next(iter(logic.items()))
+        if operation == "var":
+            return self._var(operands)
+        if not isinstance(operands, list):
+            raise ValueError(f"The operands of {operation} must be an array")
+        if operation == "if":
+            self._expect(operation, operands, 3)
+            guard, then, otherwise = (self._expression(operand) for operand in operands)
+            return f"({then} if _truthy({guard}) else {otherwise})"
+        if operation == "and":
+            if len(operands) < 2:
+                raise ValueError("and needs at least 2 operands")
+            # The first falsy operand, or the last one; the operands after a falsy one aren't evaluated
+            expression = self._expression(operands[-1])
+            for operand in reversed(operands[:-1]):
+                temporary = self._temporary()
+                expression = f"({temporary} if not _truthy({temporary} := {self._expression(operand)}) " \
+                             f"else {expression})"
+            return expression
+        if operation == "!":
+            self._expect(operation, operands, 1)
+            return f"(not _truthy({self._expression(operands[0])}))"
+        if operation == "===":
+            self._expect(operation, operands, 2)
+            return f"_equals({self._expression(operands[0])}, {self._expression(operands[1])})"
+        if operation == "in":
+            self._expect(operation, operands, 2)
+            return f"_in({self._expression(operands[0])}, {self._expression(operands[1])})"
+        if operation == "+":
+            return f"_plus({self._operands(operands)})"
+        if operation in INTEGER_COMPARISONS or operation in DATE_COMPARISONS:
+            if len(operands) not in (2, 3):
+                raise ValueError(f"{operation} needs 2 or 3 operands")
+            if operation in INTEGER_COMPARISONS:
+                return f"_compare({INTEGER_COMPARISONS[operation]}, _integers({operation!r}, " \
+                       f"{self._operands(operands)}))"
+            return f"_compare({DATE_COMPARISONS[operation]}, _dates({operation!r}, {self._operands(operands)}))"
+        if operation == "plusTime":
+            self._expect(operation, operands, 3)
+            date, amount, unit = operands
+            if not isinstance(amount, int) or isinstance(amount, bool):
+                raise ValueError("The amount of plusTime must be an integer literal")
+            if unit not in TIME_UNITS:
+                raise ValueError(f"The unit of plusTime must be one of {TIME_UNITS}, got {json.dumps(unit)}")
+            return f"_plus_time({self._expression(date)}, {amount!r}, {unit!r})"
+        if operation == "reduce":
+            self._expect(operation, operands, 3)
+            values, function, initial = operands
+            return f"_reduce({self._expression(values)}, {self._lambda(function)}, {self._expression(initial)})"
+        if operation == "extractFromUVCI":
+            self._expect(operation, operands, 2)
+            if not isinstance(operands[1], int) or isinstance(operands[1], bool) or operands[1] < 0:
+                raise ValueError("The index of extractFromUVCI must be a non-negative integer literal")
+            return f"_extract_from_uvci({self._expression(operands[0])}, {operands[1]!r})"
+        raise ValueError(f"Unknown operation {operation}")
+
+    def _operands(self, operands) -> str:
+        return "(" + "".join(f"{self._expression(operand)}, " for operand in operands) + ")"
+
+    @staticmethod
+    def _expect(operation, operands, count):
+        if len(operands) != count:
+            raise ValueError(f"{operation} needs {count} operand{'s' if count > 1 else ''}, got {len(operands)}")
+
+    @staticmethod
+    def _var(operand) -> str:
+        """Paths are split up front; numeric fragments index arrays, missing values are None"""
+        if isinstance(operand, list) and len(operand) == 1:
+            operand = operand[0]
+        if not isinstance(operand, str):
+            raise ValueError(f"The operand of var must be a string, got {json.dumps(operand)}")
+        if operand == "":
+            return "data"
+        path = tuple((fragment, int(fragment) if fragment.isdigit() else None) for fragment in operand.split("."))
+        return f"_var(data, {path!r})"
+
+    def _lambda(self, logic) -> str:
+        """Compiles the lambda of reduce into a function of its own data (accumulator and current)"""
+        number = self._lambda_count
+        self._lambda_count += 1
+        temporaries = self._temporaries
+        self._temporaries = 0
+        body = self._expression(logic)
+        self._temporaries = temporaries
+        self._lambdas[number] = f"\n\ndef _lambda_{number}(data):\n    return {body}\n"
+        return f"_lambda_{number}"
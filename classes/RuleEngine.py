@@ -0,0 +1,182 @@
+"""This file contains the business rule engine abstraction"""
+
+import json
+import os
+import re
+import time
+from datetime import datetime, timezone
+
+from classes.Metrics import METRICS
+from classes.RuleCompiler import RuleCompiler
+
+# Where the generated code of the rules is kept
+COMPILED_RULE_CACHE = ".cache/rules"
+
+# Acceptance rules come from the country that checks the DCC, invalidation rules from the issuing country
+RULE_TYPE_ACCEPTANCE = "Acceptance"
+RULE_TYPE_INVALIDATION = "Invalidation"
+
+CERTIFICATE_TYPE_GENERAL = "General"
+CERTIFICATE_TYPES = {
+    "v": "Vaccination",
+    "t": "Test",
+    "r": "Recovery"
+}
+
+RESULT_PASSED = "PASSED"
+RESULT_FAILED = "FAILED"
+RESULT_OPEN = "OPEN"
+
+
+def _version(text) -> tuple:
+    """Returns the numbers of a version string as a tuple, or None"""
+    numbers = tuple(int(number) for number in re.findall("\\d+", text or ""))
+    return numbers or None
+
+
+def _timestamp(text, default) -> float:
+    if text is None:
+        return default
+    moment = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def _iso(timestamp) -> str:
+    """Formats a unix timestamp like the external parameters of the EU apps, None stays None"""
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def json_files(path: str) -> list:
+    """Returns the JSON file at path, or every JSON file in the directory tree at path, in name order"""
+    if not os.path.isdir(path):
+        return [path]
+    files = []
+    for directory, subdirectories, names in os.walk(path):
+        subdirectories[:] = sorted(name for name in subdirectories if not name.startswith("."))
+        files.extend(os.path.join(directory, name) for name in sorted(names) if name.upper().endswith(".JSON"))
+    return files
+
+
+class BusinessRule:
+    """A compiled CertLogic rule with the metadata used to select it"""
+    __slots__ = ("identifier", "type", "country", "version", "schema_version", "certificate_type", "valid_from",
+                 "valid_to", "evaluate")
+
+    def __init__(self, rule: dict, function):
+        self.identifier = rule.get("Identifier")
+        self.type = rule.get("Type", RULE_TYPE_ACCEPTANCE).capitalize()
+        self.country = rule.get("Country", "").upper()
+        self.version = _version(rule.get("Version")) or (0,)
+        self.schema_version = _version(rule.get("SchemaVersion"))
+        self.certificate_type = rule.get("CertificateType", CERTIFICATE_TYPE_GENERAL).capitalize()
+        self.valid_from = _timestamp(rule.get("ValidFrom"), float("-inf"))
+        self.valid_to = _timestamp(rule.get("ValidTo"), float("inf"))
+        # Returns whether the rule passed for the data, raises when it can't be evaluated
+        self.evaluate = function
+
+    def applies_to(self, certificate_type: str, version: tuple) -> bool:
+        """Returns whether the rule is for this type of certificate and schema version (same major, not newer)"""
+        if self.certificate_type not in (CERTIFICATE_TYPE_GENERAL, certificate_type):
+            return False
+        if self.schema_version is None or version is None:
+            return True
+        return self.schema_version[0] == version[0] and self.schema_version <= version
+
+
+class RuleEngine:
+    """Evaluates the CertLogic business rules that apply to a DCC
+
+    The rules are compiled to Python once (see RuleCompiler) and the generated code is cached, so a run
+    only pays for compiling the rule files that changed. The rules for an acceptor and issuer country,
+    certificate type and schema version are selected once and kept; per DCC only their validity window
+    is checked.
+    """
+    def __init__(self, rules: list, value_sets: dict = None):
+        self._rules = rules
+        # Value set id -> codes, as passed to the rules in external.valueSets
+        self._value_sets = value_sets if value_sets is not None else dict()
+        self._selected = dict()
+
+    @classmethod
+    def load(cls, rules_path: str, value_sets_path: str = None, cache_dir: str = COMPILED_RULE_CACHE):
+        """factory, compiles (or loads from cache_dir) every rule file at rules_path, a file or a directory"""
+        rules = []
+        for path in json_files(rules_path):
+            rules.extend(BusinessRule(rule, function) for rule, function in RuleCompiler.load(path, cache_dir))
+        value_sets = load_value_sets(value_sets_path) if value_sets_path is not None else None
+        return cls(rules, value_sets)
+
+    def __len__(self):
+        return len(self._rules)
+
+    def rules_for(self, acceptor: str, issuer: str, certificate_type: str, version: str) -> list:
+        """Returns the candidate rules, by identifier and newest version first, whatever their validity"""
+        key = (acceptor, issuer, certificate_type, version)
+        selected = self._selected.get(key)
+        if selected is None:
+            version_numbers = _version(version)
+            selected = [rule for rule in self._rules
+                        if ((rule.type == RULE_TYPE_ACCEPTANCE and rule.country == acceptor) or
+                            (rule.type == RULE_TYPE_INVALIDATION and rule.country == issuer))
+                        and rule.applies_to(certificate_type, version_numbers)]
+            selected.sort(key=lambda rule: (rule.type, rule.identifier or "", tuple(-part for part in rule.version)))
+            self._selected[key] = selected
+        return selected
+
+    def evaluate(self, dcc: dict, issuer: str, acceptor: str, clock: float = None, issued_at: int = None,
+                 expires_at: int = None) -> list:
+        """Evaluates the rules for the DCC, returns the result of each: PASSED, FAILED or OPEN (with the error)
+
+        The clock (a unix timestamp, default now) picks the version of every rule that is valid at that time.
+        """
+        with METRICS.measure("rules.evaluate"):
+            if clock is None:
+                clock = time.time()
+            certificate_type = next((CERTIFICATE_TYPES[group] for group in CERTIFICATE_TYPES if group in dcc),
+                                    CERTIFICATE_TYPE_GENERAL)
+            data = {
+                "payload": dcc,
+                "external": {
+                    "validationClock": _iso(clock),
+                    "valueSets": self._value_sets,
+                    "countryCode": acceptor,
+                    "exp": _iso(expires_at),
+                    "iat": _iso(issued_at)
+                }
+            }
+            results = []
+            last_identifier = None
+            for rule in self.rules_for(acceptor, (issuer or "").upper(), certificate_type, dcc.get("ver")):
+                if rule.identifier == last_identifier or not rule.valid_from <= clock < rule.valid_to:
+                    continue
+                last_identifier = rule.identifier
+                try:
+                    result = RESULT_PASSED if rule.evaluate(data) else RESULT_FAILED
+                    error = None
+                except Exception as exception:
+                    result = RESULT_OPEN
+                    error = f"{type(exception).__name__}: {exception}"
+                results.append({"rule": rule.identifier, "result": result, "error": error})
+            return results
+
+
+def load_value_sets(path: str) -> dict:
+    """Reads the value sets at path (a file or a directory) into value set id -> codes
+
+    A file holds a value set ({"valueSetId": ..., "valueSetValues": {...}}), a list of them, or a mapping
+    of value set id to codes.
+    """
+    value_sets = dict()
+    for file_path in json_files(path):
+        with open(file_path, mode='r', encoding='utf-8') as file:
+            document = json.load(file)
+        for value_set in (document if isinstance(document, list) else [document]):
+            if "valueSetId" in value_set:
+                value_sets[value_set["valueSetId"]] = list(value_set.get("valueSetValues", dict()))
+            else:
+                value_sets.update((identifier, list(codes)) for identifier, codes in value_set.items())
+    return value_sets
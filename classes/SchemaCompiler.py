@@ -0,0 +1,311 @@
+"""This file contains the JSON schema compiler, the fast path next to jschon"""
+
+import hashlib
+import json
+import os
+
+# Bump when the generated code changes, so cached validators are regenerated
+COMPILER_VERSION = 1
+
+# Keywords of the 2020-12 vocabularies this compiler doesn't implement; schemas using them are refused.
+# Everything else that isn't compiled only annotates (like jschon, "format" isn't asserted).
+UNSUPPORTED_KEYWORDS = {
+    "$dynamicRef", "$dynamicAnchor", "$recursiveRef", "$recursiveAnchor",
+    "allOf", "anyOf", "not", "if", "then", "else", "dependentSchemas",
+    "prefixItems", "contains", "patternProperties", "additionalProperties", "propertyNames",
+    "unevaluatedItems", "unevaluatedProperties",
+    "const", "enum", "multipleOf", "exclusiveMaximum", "exclusiveMinimum", "minLength",
+    "uniqueItems", "maxContains", "minContains", "maxProperties", "minProperties", "dependentRequired"
+}
+
+TYPE_CHECKS = {
+    "object": "isinstance({0}, dict)",
+    "array": "isinstance({0}, list)",
+    "string": "isinstance({0}, str)",
+    "boolean": "isinstance({0}, bool)",
+    "null": "{0} is None",
+    "number": "_is_number({0})",
+    "integer": "_is_integer({0})"
+}
+
+PREAMBLE = '''"""Generated by classes/SchemaCompiler.py, do not edit"""
+
+import re
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _is_integer(value):
+    if isinstance(value, float):
+        return value.is_integer()
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _error(instance_location, keyword_location, absolute_location, message):
+    return {
+        'instanceLocation': instance_location,
+        'keywordLocation': keyword_location,
+        'absoluteKeywordLocation': absolute_location,
+        'error': message
+    }
+'''
+
+ENTRY_POINT = '''
+
+def validate(instance):
+    """Validates the instance, returns {valid, errors} like jschon's basic output"""
+    if _check_0(instance):
+        return {'valid': True, 'errors': []}
+    errors = []
+    _detail_0(instance, '', '', errors)
+    return {'valid': False, 'errors': errors}
+'''
+
+
+class SchemaCompiler:
+    """Turns a JSON schema (draft 2020-12) into specialized Python validation code
+
+    Every schema node becomes two functions: _check_N, which only answers valid/invalid and is used
+    first, and _detail_N, which collects jschon style errors and is only used for invalid instances.
+    """
+    def __init__(self, schema: dict):
+        self._schema = schema
+        self._base_uri = schema.get("$id", "") if isinstance(schema, dict) else ""
+        self._function_ids = dict()
+        self._pending = list()
+        self._regexes = list()
+
+    @classmethod
+    def load(cls, path: str, cache_dir: str = None):
+        """Returns the compiled validate(instance) function for the schema file at path
+
+        The generated code is cached in cache_dir, keyed by the schema's content.
+        """
+        with open(path, mode='rb') as file:
+            schema_bytes = file.read()
+        source = None
+        cache_path = None
+        if cache_dir is not None:
+            digest = hashlib.sha256(schema_bytes + str(COMPILER_VERSION).encode()).hexdigest()
+            name = os.path.splitext(os.path.basename(path))[0]
+            cache_path = os.path.join(cache_dir, f"{name}-{digest[:16]}.py")
+            if os.path.exists(cache_path):
+                with open(cache_path, mode='r', encoding='utf-8') as file:
+                    source = file.read()
+        if source is None:
+            source = cls(json.loads(schema_bytes)).compile()
+            if cache_path is not None:
+                os.makedirs(cache_dir, exist_ok=True)
+                temp_path = f"{cache_path}.{os.getpid()}.tmp"
+                with open(temp_path, mode='w', encoding='utf-8') as file:
+                    file.write(source)
+                os.replace(temp_path, cache_path)
+        namespace = dict()
+        exec(compile(source, cache_path or path, 'exec'), namespace)
+        return namespace["validate"]
+
+    def compile(self) -> str:
+        """Returns the source code of the validation module"""
+        functions = list()
+        self._function_for("")
+        while self._pending:
+            pointer = self._pending.pop(0)
+            functions.append(self._compile_node(pointer))
+        regexes = "".join(f"_RE_{index} = re.compile({pattern!r})\n" for index, pattern in enumerate(self._regexes))
+        return PREAMBLE + "\n" + regexes + "".join(functions) + ENTRY_POINT
+
+    def _function_for(self, pointer: str) -> int:
+        """Returns the number of the functions for the node at pointer, queueing it for compilation"""
+        if pointer not in self._function_ids:
+            self._function_ids[pointer] = len(self._function_ids)
+            self._pending.append(pointer)
+        return self._function_ids[pointer]
+
+    def _resolve(self, pointer: str):
+        node = self._schema
+        for token in pointer.split("/")[1:]:
+            token = token.replace("~1", "/").replace("~0", "~")
+            node = node[int(token)] if isinstance(node, list) else node[token]
+        return node
+
+    def _regex(self, pattern: str) -> str:
+        if pattern not in self._regexes:
+            self._regexes.append(pattern)
+        return f"_RE_{self._regexes.index(pattern)}"
+
+    @staticmethod
+    def _escape(token: str) -> str:
+        return str(token).replace("~", "~0").replace("/", "~1")
+
+    def _ref_pointer(self, ref: str) -> str:
+        if ref == "#":
+            return ""
+        if not ref.startswith("#/"):
+            raise ValueError(f"Only local $ref values are supported, got {ref}")
+        return ref[1:]
+
+    def _compile_node(self, pointer: str) -> str:
+        node = self._resolve(pointer)
+        number = self._function_ids[pointer]
+        if isinstance(node, bool):
+            return self._compile_boolean(number, pointer, node)
+        for keyword in node:
+            if keyword in UNSUPPORTED_KEYWORDS:
+                raise ValueError(f"Keyword {keyword} at {pointer or '/'} is not supported by the schema compiler")
+        return self._compile_check(number, pointer, node) + self._compile_detail(number, pointer, node)
+
+    def _compile_boolean(self, number, pointer, node) -> str:
+        absolute = f"{self._base_uri}#{pointer}"
+        if node:
+            return (f"\n\ndef _check_{number}(x):\n    return True\n"
+                    f"\n\ndef _detail_{number}(x, loc, kloc, errors):\n    return True\n")
+        return (f"\n\ndef _check_{number}(x):\n    return False\n"
+                f"\n\ndef _detail_{number}(x, loc, kloc, errors):\n"
+                f"    errors.append(_error(loc, kloc, {absolute!r}, 'The instance is disallowed by a boolean false schema'))\n"
+                f"    return False\n")
+
+    @staticmethod
+    def _type_check(types, variable="x") -> str:
+        if isinstance(types, str):
+            types = [types]
+        return " or ".join(TYPE_CHECKS[name].format(variable) for name in types)
+
+    def _compile_check(self, number, pointer, node) -> str:
+        """Fast path: returns False at the first failing keyword"""
+        lines = [f"\n\ndef _check_{number}(x):"]
+        types = node.get("type")
+        # Once the type is asserted, keywords for that type don't need their own guard
+        known = types if isinstance(types, str) else None
+        if types is not None:
+            lines.append(f"    if not ({self._type_check(types)}):")
+            lines.append("        return False")
+
+        def guard(name):
+            if name == known or (name == "number" and known == "integer"):
+                return ""
+            return TYPE_CHECKS[name].format("x") + " and "
+
+        for keyword, value in node.items():
+            if keyword == "required" and value:
+                missing = " or ".join(f"{name!r} not in x" for name in value)
+                lines.append(f"    if {guard('object')}({missing}):")
+                lines.append("        return False")
+            elif keyword == "properties":
+                for name in value:
+                    child = self._function_for(f"{pointer}/properties/{self._escape(name)}")
+                    lines.append(f"    if {guard('object')}{name!r} in x and not _check_{child}(x[{name!r}]):")
+                    lines.append("        return False")
+            elif keyword == "items":
+                child = self._function_for(f"{pointer}/items")
+                lines.append(f"    if {guard('array')}not all(_check_{child}(item) for item in x):")
+                lines.append("        return False")
+            elif keyword == "minItems":
+                lines.append(f"    if {guard('array')}len(x) < {value!r}:")
+                lines.append("        return False")
+            elif keyword == "maxItems":
+                lines.append(f"    if {guard('array')}len(x) > {value!r}:")
+                lines.append("        return False")
+            elif keyword == "pattern":
+                lines.append(f"    if {guard('string')}{self._regex(value)}.search(x) is None:")
+                lines.append("        return False")
+            elif keyword == "maxLength":
+                lines.append(f"    if {guard('string')}len(x) > {value!r}:")
+                lines.append("        return False")
+            elif keyword == "minimum":
+                lines.append(f"    if {guard('number')}x < {value!r}:")
+                lines.append("        return False")
+            elif keyword == "maximum":
+                lines.append(f"    if {guard('number')}x > {value!r}:")
+                lines.append("        return False")
+            elif keyword == "$ref":
+                child = self._function_for(self._ref_pointer(value))
+                lines.append(f"    if not _check_{child}(x):")
+                lines.append("        return False")
+            elif keyword == "oneOf":
+                children = [self._function_for(f"{pointer}/oneOf/{index}") for index in range(len(value))]
+                calls = ", ".join(f"_check_{child}(x)" for child in children)
+                lines.append(f"    if [{calls}].count(True) != 1:")
+                lines.append("        return False")
+        lines.append("    return True")
+        return "\n".join(lines) + "\n"
+
+    def _compile_detail(self, number, pointer, node) -> str:
+        """Slow path: evaluates every keyword and records the errors, in schema order"""
+        absolute = f"{self._base_uri}#{pointer}"
+        lines = [
+            f"\n\ndef _detail_{number}(x, loc, kloc, errors):",
+            "    start = len(errors)",
+            "    valid = True"
+        ]
+
+        def fail(keyword, message, indent="        "):
+            lines.append(f"{indent}valid = False")
+            lines.append(f"{indent}errors.append(_error(loc, kloc + {'/' + keyword!r}, "
+                         f"{absolute + '/' + keyword!r}, {message}))")
+
+        for keyword, value in node.items():
+            if keyword == "type":
+                lines.append(f"    if not ({self._type_check(value)}):")
+                fail(keyword, repr(f"The instance must be of type {json.dumps(value)}"))
+            elif keyword == "required" and value:
+                lines.append("    if isinstance(x, dict):")
+                lines.append(f"        missing = [name for name in {tuple(value)!r} if name not in x]")
+                lines.append("        if missing:")
+                fail(keyword, "f'The object is missing required properties {missing}'", "            ")
+            elif keyword == "properties":
+                lines.append("    if isinstance(x, dict):")
+                lines.append("        failed = []")
+                for name in value:
+                    escaped = self._escape(name)
+                    child = self._function_for(f"{pointer}/properties/{escaped}")
+                    lines.append(f"        if {name!r} in x and not _detail_{child}(x[{name!r}], "
+                                 f"loc + {'/' + escaped!r}, kloc + {'/properties/' + escaped!r}, errors):")
+                    lines.append(f"            failed.append({name!r})")
+                lines.append("        if failed:")
+                fail(keyword, "f'Properties {failed} are invalid'", "            ")
+            elif keyword == "items":
+                child = self._function_for(f"{pointer}/items")
+                lines.append("    if isinstance(x, list):")
+                lines.append("        for index, item in enumerate(x):")
+                lines.append(f"            if not _detail_{child}(item, f'{{loc}}/{{index}}', kloc + '/items', errors):")
+                lines.append("                valid = False")
+            elif keyword in ("minItems", "maxItems"):
+                operator, message = ("<", "too few elements (minimum") if keyword == "minItems" \
+                    else (">", "too many elements (maximum")
+                lines.append(f"    if isinstance(x, list) and len(x) {operator} {value!r}:")
+                fail(keyword, repr(f"The array has {message} {value})"))
+            elif keyword == "pattern":
+                lines.append(f"    if isinstance(x, str) and {self._regex(value)}.search(x) is None:")
+                fail(keyword, repr(f"The text must match the regular expression {json.dumps(value)}"))
+            elif keyword == "maxLength":
+                lines.append(f"    if isinstance(x, str) and len(x) > {value!r}:")
+                fail(keyword, repr(f"The text is too long (maximum {value} characters)"))
+            elif keyword in ("minimum", "maximum"):
+                operator, message = ("<", "less") if keyword == "minimum" else (">", "greater")
+                lines.append(f"    if _is_number(x) and x {operator} {value!r}:")
+                fail(keyword, repr(f"The value may not be {message} than {value}"))
+            elif keyword == "$ref":
+                child = self._function_for(self._ref_pointer(value))
+                lines.append(f"    if not _detail_{child}(x, loc, kloc + '/$ref', errors):")
+                lines.append("        valid = False")
+            elif keyword == "oneOf":
+                lines.append("    valid_indices = []")
+                lines.append("    err_indices = []")
+                lines.append("    sub_errors = []")
+                for index in range(len(value)):
+                    child = self._function_for(f"{pointer}/oneOf/{index}")
+                    lines.append(f"    if _detail_{child}(x, loc, kloc + '/oneOf/{index}', sub_errors):")
+                    lines.append(f"        valid_indices.append({index})")
+                    lines.append("    else:")
+                    lines.append(f"        err_indices.append({index})")
+                lines.append("    if len(valid_indices) != 1:")
+                fail(keyword, "'The instance must be valid against exactly one subschema; '"
+                              " f'it is valid against {valid_indices} and invalid against {err_indices}'")
+                lines.append("        errors.extend(sub_errors)")
+        lines.append("    if not valid:")
+        lines.append(f"        errors.insert(start, _error(loc, kloc, {absolute!r}, "
+                     "'The instance failed validation against the schema'))")
+        lines.append("    return valid")
+        return "\n".join(lines) + "\n"
@@ -3,25 +3,50 @@
 import json
 from datetime import datetime
 
-from jschon import JSONSchema, Evaluator, Catalogue, OutputFormat, JSON
-
-# initializing the json schema catalogue
-Catalogue.create_default_catalogue('2020-12')
+from classes.Metrics import METRICS
+from classes.SchemaCompiler import SchemaCompiler
 
 SCHEMAS = ["1.0.0", "1.0.1", "1.1.0", "1.2.0", "1.2.1", "1.3.0"]
 
+# jschon is the reference engine, "compiled" runs the code generated by SchemaCompiler
+ENGINE_JSCHON = "jschon"
+ENGINE_COMPILED = "compiled"
+ENGINES = [ENGINE_JSCHON, ENGINE_COMPILED]
+
+# Where the compiled engine keeps the generated code
+COMPILED_SCHEMA_CACHE = ".cache/schemas"
+
+# jschon is imported, and its catalogue initialized, when the first schema is loaded with it
+_JSCHON = None
+
+
+def _jschon():
+    """Returns the jschon module, initializing the json schema catalogue on first use"""
+    global _JSCHON
+    if _JSCHON is None:
+        import jschon
+        jschon.Catalogue.create_default_catalogue('2020-12')
+        _JSCHON = jschon
+    return _JSCHON
+
 
 class SchemaValidator:
     """Schema validator"""
-    def __init__(self):
+    def __init__(self, engine: str = ENGINE_JSCHON, cache_dir: str = COMPILED_SCHEMA_CACHE):
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown schema engine {engine}, expected one of {ENGINES}")
         self._schemas = dict()
+        # Schemas registered by create(), loaded when a DCC of that version is first validated
+        self._schema_paths = dict()
+        self._engine = engine
+        self._cache_dir = cache_dir
 
     @classmethod
-    def create(cls):
-        """factory"""
-        instance = cls()
+    def create(cls, engine: str = ENGINE_JSCHON, cache_dir: str = COMPILED_SCHEMA_CACHE):
+        """factory, the schemas are loaded on first use"""
+        instance = cls(engine, cache_dir)
         for schema_key in SCHEMAS:
-            instance.load_schema(schema_key, f"schemas/{schema_key}.json")
+            instance._schema_paths[schema_key] = f"schemas/{schema_key}.json"
         return instance
 
     @staticmethod
@@ -40,9 +65,31 @@ class SchemaValidator:
 
     def load_schema(self, version: str, path: str) -> None:
         """Loads the given schema from the given path"""
+        if self._engine == ENGINE_COMPILED:
+            self._schemas[version] = SchemaCompiler.load(path, self._cache_dir)
+            return
+        jschon = _jschon()
         with open(path, 'r') as file:
-            schema = JSONSchema(json.load(file)).validate()
-            self._schemas[version] = Evaluator(schema)
+            schema = jschon.JSONSchema(json.load(file)).validate()
+            self._schemas[version] = jschon.Evaluator(schema)
+
+    def _schema(self, version: str):
+        """Returns the loaded schema of the given version, loading it on first use"""
+        schema = self._schemas.get(version)
+        if schema is None:
+            with METRICS.measure("schema.load"):
+                self.load_schema(version, self._schema_paths[version])
+            schema = self._schemas[version]
+        return schema
+
+    def _evaluate(self, version: str, dcc: object):
+        """Evaluates the dcc with the schema of the given version, using the configured engine"""
+        schema = self._schema(version)
+        with METRICS.measure("schema.validate"):
+            if self._engine == ENGINE_COMPILED:
+                return schema(dcc)
+            jschon = _jschon()
+            return schema.evaluate_instance(jschon.JSON(dcc), jschon.OutputFormat.BASIC)
 
     # Validates <json> against the schema with version <version>
     # returns:
@@ -59,8 +106,7 @@ class SchemaValidator:
         """Validates the dcc against the given schema version in the json"""
         # version is in json["ver"], but will be passed in as you
         # might wanna validate against multiple versions
-        schema: Evaluator = self._schemas[dgc_json["ver"]]
-        return schema.evaluate_instance(JSON(dgc_json), OutputFormat.BASIC)
+        return self._evaluate(dgc_json["ver"], dgc_json)
 
     # Validates <json> against the schema with version <version>
     # returns:
@@ -77,12 +123,11 @@ class SchemaValidator:
         """Validates the dcc against the given schema version"""
         # version is in json["ver"], but will be passed in as you
         # might wanna validate against multiple versions
-        schema: Evaluator = self._schemas[version]
         # NOTE: JSON Schema doesn't support datetime objects,
         # so convert 't' -> 'sc' into a date/time string
         dcc = self._fix_python_dates(dcc)
         try:
-            return schema.evaluate_instance(JSON(dcc), OutputFormat.BASIC)
+            return self._evaluate(version, dcc)
         except TypeError as error:
             raise error
 
@@ -101,6 +146,5 @@ class SchemaValidator:
         """Validates the dcc against all schema versions"""
         result = dict()
         for schema_key in SCHEMAS:
-            schema: Evaluator = self._schemas[schema_key]
-            result[schema_key] = schema.evaluate_instance(JSON(dgc_json), OutputFormat.BASIC)
+            result[schema_key] = self._evaluate(schema_key, dgc_json)
         return result
@@ -2,8 +2,10 @@
 
 import base64
 import json
+from datetime import datetime, timezone
 
-from cose.headers import KID
+import cbor2
+from cose.headers import Algorithm, KID
 from cose.keys.keyops import VerifyOp
 from cose.messages import Sign1Message
 from cose.keys import CoseKey
@@ -13,47 +15,177 @@ from cose.keys.keyparam import KpKty, KpKeyOps
 from cose.keys.keyparam import KpAlg, EC2KpX, EC2KpY, EC2KpCurve, RSAKpE, RSAKpN
 from cose.keys.curves import P256
 from cose.exceptions import CoseException
-from cryptography import x509
-from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+from cryptography.hazmat.primitives.asymmetric.utils import encode_dss_signature
 from cryptography.utils import int_to_bytes
 
-from classes.TrustList import TrustList
+from classes.DigitalSigningCertificate import DigitalSigningCertificate
+from classes.Metrics import METRICS
+from classes.TrustList import TrustList, UnknownKidError
+
+# "direct" verifies ES256/PS256 with cryptography, "cose" goes through the cose library for everything
+VERIFIER_DIRECT = "direct"
+VERIFIER_COSE = "cose"
+VERIFIERS = [VERIFIER_DIRECT, VERIFIER_COSE]
+
+# COSE header labels and algorithm identifiers
+COSE_HEADER_ALG = Algorithm.identifier
+COSE_HEADER_KID = KID.identifier
+COSE_SIGN1_TAG = 18
+ALG_ES256 = Es256.identifier
+ALG_PS256 = Ps256.identifier
 
 
 class SignatureValidator:
-    """Validate COSE signatures"""
-    def __init__(self, trust_list: TrustList):
+    """Validate COSE signatures
+
+    The direct verifier builds the Sig_structure itself and verifies it with the DSC's cryptography key.
+    Algorithms other than ES256 and PS256 fall back to the cose library.
+    """
+    def __init__(self, trust_list: TrustList, verifier: str = VERIFIER_DIRECT):
+        if verifier not in VERIFIERS:
+            raise ValueError(f"Unknown signature verifier {verifier}, expected one of {VERIFIERS}")
+        self._trust_list = trust_list
+        self._verifier = verifier
+        # (DSC, verification key) by KID, built from the DSC on first use
+        self._key_cache = dict()
+        self._cache_hits = 0
+        self._cache_misses = 0
+
+    def trust_list(self) -> TrustList:
+        """Returns the trust list the signatures are validated against"""
+        return self._trust_list
+
+    def set_trust_list(self, trust_list: TrustList):
+        """Replaces the trust list, dropping all cached keys"""
         self._trust_list = trust_list
+        self.clear_key_cache()
+
+    def preload_keys(self):
+        """Builds the verification keys for every DSC in the trust list"""
+        for kid in self._trust_list.kids():
+            if kid in self._key_cache:
+                continue
+            try:
+                dsc = self._trust_list.find(kid)
+                self._key_cache[kid] = (dsc, self._build_key(dsc))
+            except Exception:
+                # Unsupported keys are reported when a DCC actually uses them
+                continue
+
+    def clear_key_cache(self):
+        """Drops all cached verification keys and resets the counters"""
+        self._key_cache.clear()
+        self._cache_hits = 0
+        self._cache_misses = 0
+
+    def invalidate_keys(self, kids):
+        """Drops the cached verification keys of the given KIDs"""
+        for kid in kids:
+            self._key_cache.pop(kid, None)
+
+    def cache_info(self):
+        """Returns the key cache hit/miss counters"""
+        return {
+            "hits": self._cache_hits,
+            "misses": self._cache_misses,
+            "size": len(self._key_cache)
+        }
 
-    def validate(self, payload: bytes):
-        """Validates the signature, or returns the errors"""
+    def validate(self, payload, issuer: str = None, issued_at: int = None):
+        """Validates the signature of the COSE bytes or decoded Sign1Message, or returns the errors
+
+        With the issuer (iss claim) and/or the issuing time (iat claim), the DSC must also be of the issuing
+        country and valid at the time the DCC was issued (see check_dsc).
+        """
+        with METRICS.measure("signature.validate"):
+            return self._validate(payload, issuer, issued_at)
+
+    def check_dsc(self, kid: str, issuer: str = None, issued_at: int = None) -> dict:
+        """Returns the error when the DSC doesn't fit the DCC, None when it does
+
+        Only the trust list's country index and the DSC's validity window are used, no X.509 parsing.
+        """
+        dsc = self._trust_list.find(kid)
+        if issuer is not None and dsc.country() != issuer.upper():
+            return {
+                "type": "COUNTRY",
+                "message": f"DSC {kid} is from {dsc.country()}, the DCC is issued by {issuer}"
+            }
+        if issued_at is not None:
+            validity = self._trust_list.validity(kid)
+            if validity is not None and not validity[0] <= issued_at <= validity[1]:
+                return {
+                    "type": "DSC-VALIDITY",
+                    "message": f"DSC {kid} is valid from {self._iso(validity[0])} to {self._iso(validity[1])}," +
+                    f" the DCC was issued at {self._iso(issued_at)}"
+                }
+        return None
+
+    @staticmethod
+    def _iso(timestamp) -> str:
+        return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+    def _validate(self, payload, issuer=None, issued_at=None):
+        kid = None
         try:
-            message = Sign1Message.decode(payload)
-            kid = self._get_kid(message)
-            print(f"KID = {kid}")
-            dsc = self._trust_list.find(kid)
-            cert: x509.base = dsc.certificate()
-            if cert is None:
+            if self._verifier == VERIFIER_DIRECT:
+                protected, headers, content, signature = self._sign1_parts(payload)
+                kid = headers.get(COSE_HEADER_KID)
+                kid = None if kid is None else base64.b64encode(kid).decode("UTF-8")
+            else:
+                message = self._sign1_message(payload)
+                kid = self._get_kid(message)
+            key = self._find_key(kid) if kid is not None else None
+            if key is None:
                 return {
                     "valid": False,
+                    "kid": kid,
                     "error": {
                         "type": "TRUST-LIST",
-                        "message": f"KID {kid} not found in the trust-list"
+                        "message": "No KID in the COSE headers" if kid is None else
+                        f"KID {kid} not found in the trust-list"
                     }
                 }
-            message.key = self._get_key(cert)
-            if message.verify_signature():
+            if issuer is not None or issued_at is not None:
+                # Cheap, so before the signature is verified
+                error = self.check_dsc(kid, issuer, issued_at)
+                if error is not None:
+                    return {
+                        "valid": False,
+                        "kid": kid,
+                        "error": error
+                    }
+            if self._verifier == VERIFIER_DIRECT:
+                valid = self._verify_direct(key, headers.get(COSE_HEADER_ALG), protected, content, signature)
+                if valid is None:
+                    # Not ES256/PS256 with a matching key: the cose library decides
+                    message = self._sign1_message(payload)
+                    message.key = self._get_key(self._trust_list.find(kid))
+                    valid = message.verify_signature()
+            else:
+                message.key = key
+                valid = message.verify_signature()
+            if valid:
                 return {
                     "valid": True,
+                    "kid": kid,
                     "error": None
                 }
             return {
                 "valid": False,
-                "error": "Invalid signature! Reason: unknown."
+                "kid": kid,
+                "error": {
+                    "type": "SIGNATURE",
+                    "message": "Invalid signature! Reason: unknown."
+                }
             }
         except UnicodeDecodeError as err:
             return {
                 "valid": False,
+                "kid": kid,
                 "error": {
                     "type": "UNICODE",
                     "message": err
@@ -62,50 +194,143 @@ class SignatureValidator:
         except json.decoder.JSONDecodeError as err:
             return {
                 "valid": False,
+                "kid": kid,
                 "error": {
                     "type": "JSON",
                     "message": err
                 }
             }
-        except (CoseException, AttributeError, TypeError) as err:
+        except (CoseException, cbor2.CBORDecodeError, AttributeError, TypeError) as err:
             return {
                 "valid": False,
+                "kid": kid,
                 "error": {
                     "type": "COSE",
                     "message": err
                 }
             }
 
+    def _find_key(self, kid: str):
+        """Returns the cached CoseKey for the KID, building it on a miss; None when the KID isn't in the TL"""
+        try:
+            dsc = self._trust_list.find(kid)
+        except UnknownKidError:
+            return None
+        cached = self._key_cache.get(kid)
+        # A key built from a DSC that has since been replaced in the trust list is a miss
+        if cached is not None and cached[0] is dsc:
+            self._cache_hits += 1
+            return cached[1]
+        self._cache_misses += 1
+        with METRICS.measure("signature.key"):
+            key = self._build_key(dsc)
+        self._key_cache[kid] = (dsc, key)
+        return key
+
+    def _build_key(self, dsc: DigitalSigningCertificate):
+        """Returns the key the configured verifier works with: a cryptography public key or a CoseKey"""
+        if self._verifier == VERIFIER_DIRECT:
+            return dsc.public_key()
+        return self._get_key(dsc)
+
+    @staticmethod
+    def _sign1_message(payload) -> Sign1Message:
+        """Returns the payload as Sign1Message, decoding COSE bytes"""
+        if isinstance(payload, Sign1Message):
+            return payload
+        try:
+            return Sign1Message.decode(payload)
+        except IndexError:
+            # The cose library pops the parts of the array, a truncated one runs out
+            raise CoseException("Malformed COSE_Sign1, expected [protected, unprotected, payload, signature]")
+
+    @staticmethod
+    def _sign1_parts(payload):
+        """Returns (protected header bytes, headers by label, payload, signature) of a COSE_Sign1
+
+        From COSE bytes the protected header is used as received. A Sign1Message only has its decoded
+        headers, so they're encoded again, like the cose library does.
+        """
+        if isinstance(payload, Sign1Message):
+            protected = payload.phdr_encoded
+            headers = {attribute.identifier: value for attribute, value in payload.uhdr.items()}
+            headers.update({attribute.identifier: value for attribute, value in payload.phdr.items()})
+            if COSE_HEADER_ALG in headers:
+                headers[COSE_HEADER_ALG] = headers[COSE_HEADER_ALG].identifier
+            return protected, headers, payload.payload, payload.signature
+        message = cbor2.loads(payload)
+        if not isinstance(message, cbor2.CBORTag) or message.tag != COSE_SIGN1_TAG:
+            raise CoseException("Not a tagged COSE_Sign1 message")
+        if not isinstance(message.value, list) or len(message.value) != 4 \
+                or [type(part) for part in message.value] != [bytes, dict, bytes, bytes]:
+            raise CoseException("Malformed COSE_Sign1, expected [protected, unprotected, payload, signature]")
+        protected, unprotected, content, signature = message.value
+        headers = dict(unprotected)
+        if len(protected) > 0:
+            protected_headers = cbor2.loads(protected)
+            if not isinstance(protected_headers, dict):
+                raise CoseException("Malformed COSE_Sign1, the protected header is not a map")
+            headers.update(protected_headers)
+        return protected, headers, content, signature
+
+    @staticmethod
+    def _verify_direct(public_key, algorithm, protected, content, signature):
+        """Verifies an ES256 or PS256 signature; returns None for other algorithms or mismatching keys"""
+        sig_structure = cbor2.dumps(["Signature1", protected, b"", content])
+        try:
+            if algorithm == ALG_ES256 and isinstance(public_key, ec.EllipticCurvePublicKey) \
+                    and isinstance(public_key.curve, ec.SECP256R1):
+                if len(signature) != 64:
+                    return False
+                # COSE carries r || s, cryptography wants a DER encoded signature
+                der_signature = encode_dss_signature(int.from_bytes(signature[:32], "big"),
+                                                     int.from_bytes(signature[32:], "big"))
+                public_key.verify(der_signature, sig_structure, ec.ECDSA(hashes.SHA256()))
+                return True
+            if algorithm == ALG_PS256 and isinstance(public_key, rsa.RSAPublicKey):
+                public_key.verify(signature, sig_structure,
+                                  padding.PSS(mgf=padding.MGF1(hashes.SHA256()), salt_length=32),
+                                  hashes.SHA256())
+                return True
+        except InvalidSignature:
+            return False
+        return None
+
     @staticmethod
     def _get_kid(message) -> str:
-        """Returns the KID from the message"""
+        """Returns the KID from the message, None when it has none"""
         if KID in message.phdr.keys():
             return base64.b64encode(message.phdr[KID]).decode("UTF-8")
-        return base64.b64encode(message.uhdr[KID]).decode("UTF-8")
+        if KID in message.uhdr.keys():
+            return base64.b64encode(message.uhdr[KID]).decode("UTF-8")
+        return None
 
     @staticmethod
-    def _get_key(cert: x509.base) -> CoseKey:
+    def _get_key(dsc: DigitalSigningCertificate) -> CoseKey:
         """Returns the CoseKey"""
-        if isinstance(cert.public_key(), rsa.RSAPublicKey):
+        public_key = dsc.public_key()
+        if isinstance(public_key, rsa.RSAPublicKey):
+            public_numbers = public_key.public_numbers()
             return CoseKey.from_dict(
                 {
                     KpKeyOps: [VerifyOp],
                     KpKty: KtyRSA,
                     KpAlg: Ps256,  # RSSASSA-PSS-with-SHA-256-and-MFG1
-                    RSAKpE: int_to_bytes(cert.public_key().public_numbers().e),
-                    RSAKpN: int_to_bytes(cert.public_key().public_numbers().n)
+                    RSAKpE: int_to_bytes(public_numbers.e),
+                    RSAKpN: int_to_bytes(public_numbers.n)
                 }
             )
-        elif isinstance(cert.public_key(), ec.EllipticCurvePublicKey):
+        elif isinstance(public_key, ec.EllipticCurvePublicKey):
+            public_numbers = public_key.public_numbers()
             return CoseKey.from_dict(
                 {
                     KpKeyOps: [VerifyOp],
                     KpKty: KtyEC2,
                     EC2KpCurve: P256,  # Ought o be pk.curve - but the two libs clash
                     KpAlg: Es256,  # ecdsa-with-SHA256
-                    EC2KpX: int_to_bytes(cert.public_key().public_numbers().x),
-                    EC2KpY: int_to_bytes(cert.public_key().public_numbers().y)
+                    EC2KpX: int_to_bytes(public_numbers.x),
+                    EC2KpY: int_to_bytes(public_numbers.y)
                 }
             )
         else:
-            raise Exception(f"Algorithm unsupported: { cert.signature_algorithm_oid }")
+            raise Exception(f"Algorithm unsupported: { dsc.certificate().signature_algorithm_oid }")
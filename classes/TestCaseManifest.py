@@ -0,0 +1,134 @@
+"""This file contains the QA repository manifest abstraction"""
+
+import os
+import pickle
+import re
+
+# Bump when the layout of the manifest file changes
+MANIFEST_FORMAT = 2
+
+# Sub-directories that are never test cases (hidden, drafts, ...)
+EXCLUDED_PREFIXES = ('.', '_', '@')
+VERSION_PATTERN = re.compile("\\d\\.\\d\\.\\d")
+
+
+class TestCase:
+    """A test case file: its country, path and schema version (None when the path has none)"""
+    __slots__ = ("country", "path", "version")
+
+    def __init__(self, country: str, path: str, version: str):
+        self.country = country
+        self.path = path
+        self.version = version
+
+
+class TestCaseManifest:
+    """Index of every test case in a dcc-quality-assurance repository, built in a single scandir pass
+
+    The manifest is kept on disk with the mtime of every directory. A refresh only lists the directories
+    whose mtime changed (files added, removed or renamed); the others cost a single stat. Only the listing
+    is kept: a file edited in place is picked up by the content hash of the result cache.
+    """
+    def __init__(self, root: str, extensions: tuple, directories: dict = None):
+        self._root = root
+        self._extensions = extensions
+        # Directory path -> (mtime_ns, test cases, sub-directory paths)
+        self._directories = directories if directories is not None else dict()
+        self._countries = dict()
+        self._listed = 0
+
+    @classmethod
+    def load(cls, root: str, path: str = None, extensions: tuple = ('.PNG',)):
+        """Loads the manifest of the repository from path (if given) and brings it up to date"""
+        manifest = None
+        if path is not None:
+            try:
+                with open(path, mode='rb') as file:
+                    stored = pickle.load(file)
+                if stored.get("format") == MANIFEST_FORMAT and stored.get("root") == root \
+                        and stored.get("extensions") == extensions:
+                    manifest = cls(root, extensions, stored["directories"])
+            except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+                # Missing, broken, or written with an older layout of TestCase
+                pass
+        if manifest is None:
+            manifest = cls(root, extensions)
+        manifest.refresh()
+        if path is not None and manifest._listed > 0:
+            manifest.save(path)
+        return manifest
+
+    @staticmethod
+    def get_version(path: str) -> str:
+        """Returns the schema version in the path, or None"""
+        match = VERSION_PATTERN.search(path)
+        return match.group(0) if match is not None else None
+
+    def refresh(self) -> int:
+        """Rescans the directories that changed since the last refresh, returns how many were listed"""
+        self._listed = 0
+        directories = dict()
+        self._countries = dict()
+        with os.scandir(self._root) as entries:
+            # Like the repository's layout: every two letter directory is a country
+            countries = [entry.name for entry in entries if entry.is_dir() and len(entry.name) == 2]
+        for country in countries:
+            test_cases = []
+            self._scan(country, os.path.join(self._root, country), directories, test_cases)
+            self._countries[country] = test_cases
+        self._directories = directories
+        return self._listed
+
+    def save(self, path: str) -> None:
+        """Writes the manifest to disk"""
+        manifest = {
+            "format": MANIFEST_FORMAT,
+            "root": self._root,
+            "extensions": self._extensions,
+            "directories": self._directories
+        }
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, mode='wb') as file:
+            pickle.dump(manifest, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+
+    def countries(self) -> list:
+        """Returns the country directories"""
+        return list(self._countries.keys())
+
+    def test_cases(self, country: str) -> list:
+        """Returns the TestCases of the country, in directory walk order"""
+        return self._countries.get(country, [])
+
+    def _scan(self, country, directory, directories, test_cases):
+        try:
+            mtime_ns = os.stat(directory).st_mtime_ns
+        except OSError:
+            return
+        cached = self._directories.get(directory)
+        if cached is not None and cached[0] == mtime_ns:
+            _, files, subdirectories = cached
+        else:
+            files, subdirectories = self._list(country, directory)
+            self._listed += 1
+        directories[directory] = (mtime_ns, files, subdirectories)
+        test_cases.extend(files)
+        for subdirectory in subdirectories:
+            self._scan(country, subdirectory, directories, test_cases)
+
+    def _list(self, country, directory):
+        files = []
+        subdirectories = []
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            return files, subdirectories
+        for entry in entries:
+            if entry.is_dir():
+                # Symlinked directories aren't followed, as with os.walk
+                if not entry.name.startswith(EXCLUDED_PREFIXES) and not entry.is_symlink():
+                    subdirectories.append(entry.path)
+            elif os.path.splitext(entry.name)[1].upper() in self._extensions:
+                files.append(TestCase(country, entry.path, self.get_version(entry.path)))
+        return files, subdirectories
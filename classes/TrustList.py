@@ -1,31 +1,174 @@
 """This file contains the TrustList abstraction"""
 
+import hashlib
 import json
+import os
+import pickle
+import time
 
 from classes.DigitalSigningCertificate import DigitalSigningCertificate
+from classes.Metrics import METRICS
+
+# Bump when the layout of the snapshot changes
+SNAPSHOT_FORMAT = 2
 
 
 class TrustList:
-    """DCC TrustList"""
-    def __init__(self, dsc_dict: dict):
+    """DCC TrustList
+
+    Next to the KID index, the KIDs are indexed by country and the validity window of every DSC is read
+    when the TL is built. The validity windows are part of the snapshot, so a TL loaded from it (or carried
+    over by updated()) doesn't parse the certificates again.
+    """
+    def __init__(self, dsc_dict: dict, digest: str = None):
         self._store = dsc_dict
+        self._digest = digest
+        self._by_country = dict()
+        # KID -> (notBefore, notAfter), None when the certificate is unparseable
+        self._validity = dict()
+        for kid, dsc in dsc_dict.items():
+            self._by_country.setdefault(dsc.country(), []).append(kid)
+            try:
+                self._validity[kid] = dsc.validity()
+            except (ValueError, TypeError):
+                # Unparseable certificates are reported when a DCC actually uses them
+                self._validity[kid] = None
+
+    @classmethod
+    def load(cls, path, snapshot_dir: str = None):
+        """Loads the trustlist from path
+
+        The validity windows are read from the certificates right away, the keys on first use. With a
+        snapshot_dir, the KID index, the validity windows and the public keys are stored in a snapshot keyed
+        by the hash of the file, and later loads of the same file skip the JSON and X.509 parsing entirely.
+        """
+        with METRICS.measure("trustlist.load"):
+            return cls._load(path, snapshot_dir)
+
+    @classmethod
+    def _load(cls, path, snapshot_dir):
+        with open(path, mode='rb') as file:
+            file_bytes = file.read()
+        digest = hashlib.sha256(file_bytes).hexdigest()
+        snapshot_path = None
+        if snapshot_dir is not None:
+            snapshot_path = os.path.join(snapshot_dir, f"trustlist-{digest}.snapshot")
+            instance = cls._load_snapshot(snapshot_path, digest)
+            if instance is not None:
+                return instance
+        trust_list_json = json.loads(file_bytes.decode('utf-8'))
+        # The gateway returns a list, the German trust list wraps it in an object
+        if isinstance(trust_list_json, dict):
+            trust_list_json = trust_list_json["certificates"]
+        dsc_dict = dict()
+        for item in trust_list_json:
+            dsc = DigitalSigningCertificate.parse(item)
+            dsc_dict[dsc.kid()] = dsc
+        instance = cls(dsc_dict, digest)
+        if snapshot_path is not None:
+            instance._write_snapshot(snapshot_path)
+        return instance
 
     @classmethod
-    def load(cls, path):
-        """Loads the trustlist from path"""
-        with open(path, mode='r', encoding='utf-8') as file:
-            file_text = file.read()
-            trust_list_json = json.loads(file_text)
-            dsc_dict = dict()
-            for item in trust_list_json:
-                dsc = DigitalSigningCertificate.parse(item)
-                dsc_dict[dsc.kid()] = dsc
-            return cls(dsc_dict)
+    def _load_snapshot(cls, snapshot_path, digest):
+        """Loads the snapshot, returns None when it's missing or unusable"""
+        try:
+            with open(snapshot_path, mode='rb') as file:
+                snapshot = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        if snapshot.get("format") != SNAPSHOT_FORMAT or snapshot.get("digest") != digest:
+            return None
+        dsc_dict = dict()
+        for country, kid, raw_data, public_key_der, validity in snapshot["entries"]:
+            dsc_dict[kid] = DigitalSigningCertificate(country, kid, raw_data, public_key_der, validity)
+        return cls(dsc_dict, digest)
+
+    def _write_snapshot(self, snapshot_path):
+        """Writes the KID index, the pre-extracted public keys and the validity windows"""
+        entries = list()
+        for kid, dsc in self._store.items():
+            try:
+                public_key_der = dsc.public_key_der() if self._validity[kid] is not None else None
+            except ValueError:
+                public_key_der = None
+            entries.append((dsc.country(), kid, dsc.raw_data(), public_key_der, self._validity[kid]))
+        snapshot = {
+            "format": SNAPSHOT_FORMAT,
+            "digest": self._digest,
+            "entries": entries
+        }
+        os.makedirs(os.path.dirname(snapshot_path) or '.', exist_ok=True)
+        temp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+        with open(temp_path, mode='wb') as file:
+            pickle.dump(snapshot, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, snapshot_path)
+
+    def updated(self, other: 'TrustList'):
+        """Returns a TL with the contents of other and the set of KIDs that changed
+
+        DSCs that are unchanged are carried over from this TL, so whatever they have parsed already is kept.
+        """
+        dsc_dict = dict(self._store)
+        changed = set()
+        for kid in self._store:
+            if kid not in other._store:
+                del dsc_dict[kid]
+                changed.add(kid)
+        for kid, dsc in other._store.items():
+            current = self._store.get(kid)
+            if current is None or current.raw_data() != dsc.raw_data() or current.country() != dsc.country():
+                dsc_dict[kid] = dsc
+                changed.add(kid)
+        return TrustList(dsc_dict, other._digest), changed
+
+    def digest(self) -> str:
+        """Returns the SHA-256 of the file the TL was loaded from"""
+        return self._digest
+
+    def kids(self) -> list:
+        """Returns the KIDs in the TL"""
+        return list(self._store.keys())
+
+    def countries(self) -> list:
+        """Returns the countries that have DSCs in the TL"""
+        return sorted(self._by_country.keys())
+
+    def kids_of(self, country: str) -> list:
+        """Returns the KIDs of the country's DSCs"""
+        return self._by_country.get(country, [])
+
+    def validity(self, kid: str) -> tuple:
+        """Returns (notBefore, notAfter) of the DSC as unix timestamps, None when its certificate is unparseable"""
+        if kid not in self._validity:
+            self.find(kid)
+        return self._validity[kid]
+
+    def country_stats(self, at: float = None) -> dict:
+        """Returns the number of DSCs per country, and how many of them are valid, expired or not yet valid at
+        the unix timestamp (default: now)"""
+        at = time.time() if at is None else at
+        stats = dict()
+        for country, kids in self._by_country.items():
+            counts = stats[country] = {"dscs": len(kids), "valid": 0, "expired": 0, "not_yet_valid": 0,
+                                       "unparseable": 0}
+            for kid in kids:
+                validity = self._validity[kid]
+                if validity is None:
+                    counts["unparseable"] += 1
+                elif at < validity[0]:
+                    counts["not_yet_valid"] += 1
+                elif at > validity[1]:
+                    counts["expired"] += 1
+                else:
+                    counts["valid"] += 1
+        return stats
 
     def find(self, kid: str) -> DigitalSigningCertificate:
         """Finds the DSC in the TL"""
-        if kid in self._store:
-            return self._store[kid]
+        with METRICS.measure("trustlist.find"):
+            if kid in self._store:
+                return self._store[kid]
         raise UnknownKidError(f"KID `{ kid }` is not in the TrustList")
 
 
@@ -33,4 +176,4 @@ class UnknownKidError(Exception):
     """KID not found in TrustList error"""
     def __init__(self, message):
         self.message = message
-        super().__init__()
+        super().__init__(message)
@@ -0,0 +1,89 @@
+"""This file contains the in-memory verdict cache abstraction"""
+
+import hashlib
+import threading
+import time
+
+from collections import OrderedDict
+
+
+class VerdictCache:
+    """Bounded LRU cache of hcert verdicts, keyed by the hash of the hcert and the generation
+
+    The generation identifies the schemas and the trust list the verdicts were made with; a new generation
+    (e.g. after the trust list was reloaded) drops every verdict. Entries can also expire after a TTL, as
+    the validity of a certificate depends on the time it's validated at.
+    """
+    def __init__(self, max_size: int, ttl: float = None, generation: str = ""):
+        self._max_size = max(1, max_size)
+        self._ttl = ttl
+        self._generation = generation
+        self._entries = OrderedDict()
+        # The trust list listener invalidates from its own thread
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    @staticmethod
+    def key(qr_text: str) -> bytes:
+        """Returns the cache key of the hcert"""
+        return hashlib.sha256(qr_text.encode("utf-8")).digest()
+
+    def get(self, key: bytes):
+        """Returns the cached verdict or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, verdict = entry
+                if expires_at is not None and expires_at <= time.monotonic():
+                    del self._entries[key]
+                    self._expirations += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return verdict
+            self._misses += 1
+            return None
+
+    def put(self, key: bytes, verdict, generation: str = None) -> None:
+        """Stores the verdict, evicting the least recently used ones beyond the size limit
+
+        A verdict made with another generation than the current one (the trust list changed while it was
+        being validated) is dropped.
+        """
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            expires_at = None if self._ttl is None else time.monotonic() + self._ttl
+            self._entries[key] = (expires_at, verdict)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def generation(self) -> str:
+        """Returns the current generation"""
+        return self._generation
+
+    def invalidate(self, generation: str = None) -> None:
+        """Drops every verdict, and moves on to the new generation if one is given"""
+        with self._lock:
+            self._entries.clear()
+            if generation is not None:
+                self._generation = generation
+
+    def cache_info(self):
+        """Returns the counters and the hit rate"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "size": len(self._entries),
+                "max_size": self._max_size,
+                "hit_rate": round(self._hits / lookups, 4) if lookups > 0 else 0.0
+            }
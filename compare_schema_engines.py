@@ -0,0 +1,88 @@
+#!/bin/env python3.9
+
+import argparse
+import sys
+
+import hcert
+from classes.QrReader import QrReader
+from classes.SchemaValidator import SchemaValidator, SCHEMAS, ENGINE_JSCHON, ENGINE_COMPILED
+
+# Initialize components
+CLI_PARSER = argparse.ArgumentParser(
+    description='Checks that the compiled schema engine gives the same verdicts as jschon')
+
+
+def read_qa_corpus(root_directory, countries):
+    """Yields (name, qr text) for every QR in the dcc-quality-assurance repository"""
+    from validate_quality_assurance import list_country_files
+    reader = QrReader()
+    for country in countries:
+        files = list_country_files(root_directory, country)
+        for file, qr_text in zip(files, reader.read_many(files)):
+            if qr_text is None:
+                print(f"Skipped {file}: unable to read QR")
+                continue
+            yield file, qr_text
+
+
+def read_stdin():
+    """Yields (name, hcert) for every line on std-in"""
+    sys.stdin.reconfigure(encoding='utf-8')
+    for number, line in enumerate(sys.stdin, start=1):
+        yield f"line {number}", line.rstrip("\r\n")
+
+
+def compare(cases, reference, compiled):
+    """Validates every DCC against every schema version with both engines, returns the number of mismatches"""
+    total = 0
+    skipped = 0
+    mismatches = 0
+    for name, qr_text in cases:
+        try:
+            dcc = hcert.unpack_qr(qr_text)["JSON"]
+        except Exception as error:
+            print(f"Skipped {name}: unable to decode ({error})")
+            skipped += 1
+            continue
+        for version in SCHEMAS:
+            total += 1
+            expected = reference.validate_dcc(dcc, version)
+            actual = compiled.validate_dcc(dcc, version)
+            if expected["valid"] != actual["valid"]:
+                mismatches += 1
+                print(f"Mismatch {name} (schema {version}): jschon valid={expected['valid']}, "
+                      f"compiled valid={actual['valid']}")
+                for error in expected.get("errors", []):
+                    print(f"    jschon: {error['keywordLocation']} {error['error']}")
+                for error in actual.get("errors", []):
+                    print(f"    compiled: {error['keywordLocation']} {error['error']}")
+    print(f"Compared {total} validations, {mismatches} mismatches, {skipped} skipped.")
+    return mismatches
+
+
+if __name__ == '__main__':
+    CLI_PARSER.add_argument(
+        '--repo',
+        type=str,
+        help='Path to the dcc-quality-assurance repository; without it, hcerts are read from std-in')
+    CLI_PARSER.add_argument(
+        '--countries',
+        type=str,
+        nargs="?",
+        help='Optional string containing a comma-separated list of countries,' +
+        ' e.g. "NL,DE,ES"')
+
+    args = CLI_PARSER.parse_args()
+
+    if args.repo is None:
+        corpus = read_stdin()
+    else:
+        if args.countries is None:
+            from validate_quality_assurance import load_manifest
+            countries = load_manifest(args.repo).countries()
+        else:
+            countries = args.countries.split(",")
+        corpus = read_qa_corpus(args.repo, countries)
+
+    result = compare(corpus, SchemaValidator.create(ENGINE_JSCHON), SchemaValidator.create(ENGINE_COMPILED))
+    sys.exit(1 if result > 0 else 0)
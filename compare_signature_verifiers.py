@@ -0,0 +1,96 @@
+#!/bin/env python3.9
+
+import argparse
+import sys
+
+import cbor2
+
+import hcert
+from classes.SignatureValidator import SignatureValidator, VERIFIER_COSE, VERIFIER_DIRECT
+from classes.TrustList import TrustList
+from compare_schema_engines import read_qa_corpus, read_stdin
+
+# Initialize components
+CLI_PARSER = argparse.ArgumentParser(
+    description='Checks that the direct signature verifier gives the same verdicts as the cose library')
+
+
+def tampered(cose_bytes):
+    """Returns the COSE message with one bit of the signature flipped"""
+    message = cbor2.loads(cose_bytes)
+    signature = bytearray(message.value[3])
+    signature[len(signature) // 2] ^= 1
+    message.value[3] = bytes(signature)
+    return cbor2.dumps(message)
+
+
+def verdict(result):
+    error = result["error"]
+    return result["valid"], result["kid"], None if error is None else error["type"]
+
+
+def compare(cases, reference, direct, with_tampered):
+    """Validates every signature with both verifiers, returns the number of mismatches"""
+    total = 0
+    skipped = 0
+    mismatches = 0
+    for name, qr_text in cases:
+        try:
+            cose_bytes = hcert.unpack_qr(qr_text)["COSE"]
+        except Exception as error:
+            print(f"Skipped {name}: unable to decode ({error})")
+            skipped += 1
+            continue
+        variants = [(name, cose_bytes)]
+        if with_tampered:
+            variants.append((f"{name} (tampered)", tampered(cose_bytes)))
+        for variant, payload in variants:
+            total += 1
+            expected = verdict(reference.validate(payload))
+            # The direct verifier is checked with the raw bytes and with the decoded message
+            message = hcert.unpack_cose(payload)["COSE_MESSAGE"]
+            actual = [verdict(direct.validate(payload)), verdict(direct.validate(message))]
+            if any(result != expected for result in actual):
+                mismatches += 1
+                print(f"Mismatch {variant}: cose {expected}, direct {actual[0]}, direct (message) {actual[1]}")
+    print(f"Compared {total} signatures, {mismatches} mismatches, {skipped} skipped.")
+    return mismatches
+
+
+if __name__ == '__main__':
+    CLI_PARSER.add_argument(
+        '--repo',
+        type=str,
+        help='Path to the dcc-quality-assurance repository; without it, hcerts are read from std-in')
+    CLI_PARSER.add_argument(
+        '--countries',
+        type=str,
+        nargs="?",
+        help='Optional string containing a comma-separated list of countries,' +
+        ' e.g. "NL,DE,ES"')
+    CLI_PARSER.add_argument(
+        '--trustlist',
+        type=str,
+        default="trustlist.json",
+        help='Trust list to verify with (default: trustlist.json)')
+    CLI_PARSER.add_argument(
+        '--tampered',
+        action='store_true',
+        help='Also compare a copy of every signature with one bit flipped')
+
+    args = CLI_PARSER.parse_args()
+
+    if args.repo is None:
+        corpus = read_stdin()
+    else:
+        if args.countries is None:
+            from validate_quality_assurance import load_manifest
+            countries = load_manifest(args.repo).countries()
+        else:
+            countries = args.countries.split(",")
+        corpus = read_qa_corpus(args.repo, countries)
+
+    trust_list = TrustList.load(args.trustlist)
+    result = compare(corpus, SignatureValidator(trust_list, VERIFIER_COSE),
+                     SignatureValidator(trust_list, VERIFIER_DIRECT), args.tampered)
+    sys.exit(1 if result > 0 else 0)
@@ -0,0 +1,43 @@
+#!/bin/env python3.9
+
+import argparse
+import os
+import sys
+import time
+
+from classes.RevocationList import RevocationList
+
+# Initialize components
+CLI_PARSER = argparse.ArgumentParser(
+    description='Compiles revocation list dumps (JSON or CSV) into the memory-mapped index used by --revocation')
+
+
+if __name__ == '__main__':
+    CLI_PARSER.add_argument(
+        'dumps',
+        type=str,
+        nargs='*',
+        help='Revocation dumps: gateway JSON batches, JSON lists of hashes, or CSV files (one hash per row)')
+    CLI_PARSER.add_argument(
+        '--output',
+        type=str,
+        default="revocation.idx",
+        help='Index file to write (default: revocation.idx)')
+    CLI_PARSER.add_argument(
+        '--false-positive-rate',
+        type=float,
+        default=0.01,
+        help='False positive rate of the Bloom filter in front of the sorted hashes (default: 0.01)')
+
+    args = CLI_PARSER.parse_args()
+
+    if len(args.dumps) == 0:
+        CLI_PARSER.print_help()
+        sys.exit()
+    if not 0 < args.false_positive_rate < 1:
+        CLI_PARSER.error("--false-positive-rate must be between 0 and 1")
+
+    start = time.perf_counter()
+    count = RevocationList.compile(args.dumps, args.output, args.false_positive_rate)
+    elapsed = time.perf_counter() - start
+    print(f"{count} revoked hashes written to {args.output} ({os.path.getsize(args.output)} bytes) in {elapsed:.2f}s")
@@ -0,0 +1,269 @@
+#!/bin/env python3.9
+
+import argparse
+import base64
+import datetime
+import hashlib
+import io
+import json
+import os
+import random
+import sys
+import zlib
+
+import cbor2
+from base45 import b45encode
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+from cryptography.hazmat.primitives.asymmetric.utils import decode_dss_signature
+from cryptography.x509.oid import NameOID
+
+import hcert
+from classes.SchemaValidator import SCHEMAS
+
+# Initialize components
+CLI_PARSER = argparse.ArgumentParser(
+    description='Generates an offline corpus of signed DCCs, with test signers and a matching trust list')
+
+# COSE algorithm identifiers
+ALG_ES256 = -7
+ALG_PS256 = -37
+COSE_HEADER_ALG = 1
+COSE_HEADER_KID = 4
+COSE_SIGN1_TAG = 18
+
+# CWT claims
+CLAIM_ISSUER = 1
+CLAIM_EXPIRES = 4
+CLAIM_ISSUED_AT = 6
+
+CERTIFICATE_TYPES = {"v": "VAC", "t": "TEST", "r": "REC"}
+ISSUED_AT = datetime.datetime(2021, 6, 1, tzinfo=datetime.timezone.utc)
+FAMILY_NAMES = ["Jansen", "Müller", "García", "Rossi", "Dupont", "Novák", "Nowak", "Andersson"]
+GIVEN_NAMES = ["Anna", "Jan", "María", "Luca", "Sophie", "Petr", "Zofia", "Erik"]
+
+
+class TestSigner:
+    """A self-signed DSC with its private key, signing COSE_Sign1 messages"""
+    def __init__(self, country: str, algorithm: int):
+        self.country = country
+        self.algorithm = algorithm
+        if algorithm == ALG_ES256:
+            self._key = ec.generate_private_key(ec.SECP256R1())
+        else:
+            self._key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        name = x509.Name([
+            x509.NameAttribute(NameOID.COMMON_NAME, f"DSC {country} synthetic test signer"),
+            x509.NameAttribute(NameOID.COUNTRY_NAME, country)
+        ])
+        self.certificate = x509.CertificateBuilder() \
+            .subject_name(name) \
+            .issuer_name(name) \
+            .public_key(self._key.public_key()) \
+            .serial_number(x509.random_serial_number()) \
+            .not_valid_before(ISSUED_AT - datetime.timedelta(days=30)) \
+            .not_valid_after(ISSUED_AT + datetime.timedelta(days=3650)) \
+            .sign(self._key, hashes.SHA256())
+        self.raw_data = self.certificate.public_bytes(serialization.Encoding.DER)
+        # The KID is the first 8 bytes of the SHA-256 of the DER encoded DSC
+        self.kid = hashlib.sha256(self.raw_data).digest()[:8]
+
+    def trust_list_entry(self):
+        return {
+            "certificateType": "DSC",
+            "country": self.country,
+            "kid": base64.b64encode(self.kid).decode("utf-8"),
+            "rawData": base64.b64encode(self.raw_data).decode("utf-8")
+        }
+
+    def sign(self, payload: bytes) -> bytes:
+        """Returns the tagged COSE_Sign1 message with the payload"""
+        protected = cbor2.dumps({COSE_HEADER_ALG: self.algorithm, COSE_HEADER_KID: self.kid})
+        sig_structure = cbor2.dumps(["Signature1", protected, b"", payload])
+        if self.algorithm == ALG_ES256:
+            # COSE carries ECDSA signatures as r || s instead of DER
+            r, s = decode_dss_signature(self._key.sign(sig_structure, ec.ECDSA(hashes.SHA256())))
+            signature = r.to_bytes(32, "big") + s.to_bytes(32, "big")
+        else:
+            signature = self._key.sign(
+                sig_structure,
+                padding.PSS(mgf=padding.MGF1(hashes.SHA256()), salt_length=32),
+                hashes.SHA256())
+        return cbor2.dumps(cbor2.CBORTag(COSE_SIGN1_TAG, [protected, {}, payload, signature]))
+
+
+def person(rng):
+    family_name = rng.choice(FAMILY_NAMES)
+    given_name = rng.choice(GIVEN_NAMES)
+    return {
+        "fn": family_name,
+        "fnt": transliterate(family_name),
+        "gn": given_name,
+        "gnt": transliterate(given_name)
+    }
+
+
+def transliterate(name):
+    """Returns the ICAO 9303 style machine readable name (good enough for the synthetic names)"""
+    table = str.maketrans({"ü": "UE", "í": "I", "á": "A", "ö": "OE"})
+    return name.translate(table).upper().replace(" ", "<")
+
+
+def certificate_entry(certificate_type, country, rng, number):
+    """Returns the v, t or r entry of a DCC"""
+    day = ISSUED_AT.date() - datetime.timedelta(days=rng.randint(1, 150))
+    entry = {
+        "tg": "840539006",
+        "co": country,
+        "is": f"Ministry of Health {country}",
+        "ci": f"URN:UVCI:01:{country}:SYNTHETIC{number:08d}#{rng.randint(0, 9)}"
+    }
+    if certificate_type == "v":
+        entry.update({
+            "vp": "1119349007",
+            "mp": "EU/1/20/1528",
+            "ma": "ORG-100030215",
+            "dn": 2,
+            "sd": 2,
+            "dt": day.isoformat()
+        })
+    elif certificate_type == "t":
+        entry.update({
+            "tt": "LP6464-4",
+            "nm": "Roche LightCycler qPCR",
+            "sc": f"{day.isoformat()}T{rng.randint(7, 19):02d}:00:00Z",
+            "tr": "260415000",
+            "tc": "Synthetic test centre"
+        })
+    else:
+        entry.update({
+            "fr": day.isoformat(),
+            "df": (day + datetime.timedelta(days=11)).isoformat(),
+            "du": (day + datetime.timedelta(days=180)).isoformat()
+        })
+    return entry
+
+
+def dcc(version, certificate_type, country, rng, number):
+    return {
+        "ver": version,
+        "nam": person(rng),
+        "dob": f"{rng.randint(1940, 2005)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        certificate_type: [certificate_entry(certificate_type, country, rng, number)]
+    }
+
+
+def qr_png(qr_text):
+    """Renders the QR the way hcert_to_qr.py does, returns the PNG bytes"""
+    import qrcode
+    qr_code = qrcode.QRCode(
+        error_correction=qrcode.constants.ERROR_CORRECT_Q,
+        box_size=3,
+        border=2,
+    )
+    qr_code.add_data(qr_text)
+    qr_image_buffer = io.BytesIO()
+    qr_code.make_image().save(qr_image_buffer, format="PNG")
+    return qr_image_buffer.getvalue()
+
+
+def test_case(signer, version, name, payload, cbor_bytes, cose_bytes, compressed, qr_text, png):
+    """Returns the test case in the format of the T-Systems dgc-testdata repository"""
+    return {
+        "JSON": payload,
+        "CBOR": cbor_bytes.hex(),
+        "COSE": cose_bytes.hex(),
+        "COMPRESSED": compressed.hex(),
+        "BASE45": hcert.strip_prefix(qr_text),
+        "PREFIX": qr_text,
+        "2DCODE": base64.b64encode(png).decode("utf-8") if png is not None else None,
+        "TESTCTX": {
+            "VERSION": 1,
+            "SCHEMA": version,
+            "CERTIFICATE": base64.b64encode(signer.raw_data).decode("utf-8"),
+            "VALIDATIONCLOCK": (ISSUED_AT + datetime.timedelta(days=1)).isoformat(),
+            "DESCRIPTION": f"Synthetic {name} certificate, schema {version}, signed by {signer.country}"
+        },
+        "EXPECTEDRESULTS": {
+            "EXPECTEDVALIDOBJECT": True,
+            "EXPECTEDSCHEMAVALIDATION": True,
+            "EXPECTEDDECODE": True,
+            "EXPECTEDVERIFY": True,
+            "EXPECTEDB45DECODE": True,
+            "EXPECTEDCOMPRESSION": True,
+            "EXPECTEDPICTUREDECODE": png is not None
+        }
+    }
+
+
+def generate(output, count, seed, with_png):
+    """Writes the trust list, the hcerts and per country/version the PNGs and test JSON; returns the total"""
+    rng = random.Random(seed)
+    signers = [TestSigner("NL", ALG_ES256), TestSigner("DE", ALG_PS256)]
+    os.makedirs(output, exist_ok=True)
+    with open(os.path.join(output, "trustlist.json"), mode='w', encoding='utf-8') as file:
+        json.dump({"certificates": [signer.trust_list_entry() for signer in signers]}, file, indent=2)
+
+    total = 0
+    with open(os.path.join(output, "hcerts.txt"), mode='w', encoding='utf-8') as hcerts:
+        for signer in signers:
+            for version in SCHEMAS:
+                directory = os.path.join(output, signer.country, version)
+                os.makedirs(directory, exist_ok=True)
+                for certificate_type, name in CERTIFICATE_TYPES.items():
+                    for number in range(1, count + 1):
+                        total += 1
+                        payload = dcc(version, certificate_type, signer.country, rng, total)
+                        issued_at = int(ISSUED_AT.timestamp())
+                        claims = {
+                            CLAIM_ISSUER: signer.country,
+                            CLAIM_ISSUED_AT: issued_at,
+                            CLAIM_EXPIRES: issued_at + 365 * 24 * 3600,
+                            hcert.CLAIM_HCERT: {hcert.HCERT_DCC: payload}
+                        }
+                        cbor_bytes = cbor2.dumps(claims)
+                        cose_bytes = signer.sign(cbor_bytes)
+                        compressed = zlib.compress(cose_bytes, 9)
+                        qr_text = hcert.HCERT_PREFIX + b45encode(compressed).decode("utf-8")
+                        hcerts.write(qr_text + "\n")
+                        png = qr_png(qr_text) if with_png else None
+                        base_name = os.path.join(directory, f"{name}{number}")
+                        if png is not None:
+                            with open(base_name + ".png", mode='wb') as file:
+                                file.write(png)
+                        with open(base_name + ".json", mode='w', encoding='utf-8') as file:
+                            json.dump(test_case(signer, version, name, payload, cbor_bytes, cose_bytes, compressed,
+                                                qr_text, png), file, indent=2, ensure_ascii=False)
+    return total
+
+
+if __name__ == '__main__':
+    CLI_PARSER.add_argument(
+        '--output',
+        type=str,
+        default="corpus",
+        help='Directory to write the corpus to (default: corpus)')
+    CLI_PARSER.add_argument(
+        '--count',
+        type=int,
+        default=10,
+        help='Number of certificates per type (v/t/r), schema version and signer (default: 10)')
+    CLI_PARSER.add_argument(
+        '--seed',
+        type=int,
+        default=2021,
+        help='Seed for the certificate contents; the signing keys are new on every run')
+    CLI_PARSER.add_argument(
+        '--no-png',
+        action='store_true',
+        help='Skip rendering the QR PNGs, which is the slowest part of the generation')
+
+    args = CLI_PARSER.parse_args()
+
+    if args.count < 1:
+        CLI_PARSER.print_help()
+        sys.exit()
+
+    generated = generate(args.output, args.count, args.seed, not args.no_png)
+    print(f"Generated {generated} certificates in {args.output}")
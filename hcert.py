@@ -0,0 +1,66 @@
+"""Shared hcert decoding: prefix -> base45 -> zlib -> COSE -> CBOR, each step runs exactly once"""
+
+import zlib
+
+from base45 import b45decode
+from cbor2 import loads
+from cose.messages import Sign1Message
+
+from classes.Base45Decoder import Base45Decoder
+from classes.Metrics import METRICS
+
+HCERT_PREFIX = "HC1:"
+
+# CWT claim holding the hcert map, and the key of the DCC inside that map
+CLAIM_HCERT = -260
+HCERT_DCC = 1
+
+BASE45_DECODER = Base45Decoder()
+
+
+def strip_prefix(qr_text: str) -> str:
+    """Removes the context identifier (HC1:) from the QR text"""
+    if qr_text.startswith(HCERT_PREFIX):
+        return qr_text[len(HCERT_PREFIX):]
+    return qr_text
+
+
+def unpack_qr(qr_text: str) -> dict:
+    """Decodes the QR text (hcert string) into its COSE, CBOR and JSON layers"""
+    with METRICS.measure("decode.base45"):
+        compressed_bytes = b45decode(strip_prefix(qr_text))
+    with METRICS.measure("decode.inflate"):
+        cose_bytes = zlib.decompress(compressed_bytes)
+    return unpack_cose(cose_bytes)
+
+
+def unpack_qr_many(qr_texts: list) -> list:
+    """Decodes many QR texts, base45 in one batch; returns per text the unpacked dict or the exception"""
+    with METRICS.measure("decode.base45_batch"):
+        decoded = BASE45_DECODER.decode_many([strip_prefix(qr_text) for qr_text in qr_texts])
+    unpacked = []
+    for compressed_bytes in decoded:
+        if isinstance(compressed_bytes, Exception):
+            unpacked.append(compressed_bytes)
+            continue
+        try:
+            with METRICS.measure("decode.inflate"):
+                cose_bytes = zlib.decompress(compressed_bytes)
+            unpacked.append(unpack_cose(cose_bytes))
+        except Exception as error:
+            unpacked.append(error)
+    return unpacked
+
+
+def unpack_cose(cose_bytes: bytes) -> dict:
+    """Decodes the COSE bytes into the Sign1Message, the CWT claims and the DCC payload"""
+    with METRICS.measure("decode.cose"):
+        cose_message = Sign1Message.decode(cose_bytes)
+    with METRICS.measure("decode.cbor"):
+        cbor_message = loads(cose_message.payload)
+    return {
+        "COSE": cose_bytes,
+        "COSE_MESSAGE": cose_message,
+        "CBOR": cbor_message,
+        "JSON": cbor_message[CLAIM_HCERT][HCERT_DCC]
+    }
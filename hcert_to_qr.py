@@ -1,9 +1,23 @@
 #!/bin/env python3.9
+import argparse
 import base64
 import io
-import qrcode
+import itertools
+import os
 import sys
 
+from collections import deque
+
+# Initialize components
+CLI_PARSER = argparse.ArgumentParser()
+
+# Global state
+FORMATS = ["png", "svg"]
+ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz")
+
+# One QRCode per process, reused for every payload (see qr_code)
+QR_CODE = None
+
 
 def qr_png_base64(payload_str):
     """
@@ -11,6 +25,7 @@ def qr_png_base64(payload_str):
     :param payload_str: QR payload
     :return: QR rendered as a PNG and encoded in an utf-8 base64 string
     """
+    import qrcode
     qr_code = qrcode.QRCode(
         error_correction=qrcode.constants.ERROR_CORRECT_Q,
         box_size=3,
@@ -27,7 +42,206 @@ def qr_png_base64(payload_str):
     return base64.b64encode(mybytes).decode("utf-8")
 
 
-for line in sys.stdin:
-    data = line.rstrip("\r\n").rstrip("\n")
-    qr = qr_png_base64(data)
-    print(qr)
+def qr_code(version, box_size, border):
+    """Returns the process' QRCode, cleared for the next payload"""
+    global QR_CODE
+    import qrcode
+    if QR_CODE is None:
+        QR_CODE = qrcode.QRCode(
+            version=version,
+            error_correction=qrcode.constants.ERROR_CORRECT_Q,
+            box_size=box_size,
+            border=border,
+        )
+    QR_CODE.clear()
+    return QR_CODE
+
+
+def qr_matrix(payload_str, version, box_size, border):
+    """Returns the modules of the QR, border included; with a version the fitting is skipped"""
+    code = qr_code(version, box_size, border)
+    # Fitting leaves the fitted version behind, reset it for the next payload
+    code.version = version
+    code.add_data(payload_str)
+    code.make(fit=version is None)
+    return code.get_matrix()
+
+
+def render_png(matrix, box_size, optimize):
+    """Renders the modules as a 1-bit PNG"""
+    from PIL import Image
+    modules = len(matrix)
+    pixels = bytes(0 if dark else 255 for row in matrix for dark in row)
+    image = Image.frombytes("L", (modules, modules), pixels).convert("1")
+    image = image.resize((modules * box_size, modules * box_size), Image.NEAREST)
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", optimize=optimize)
+    return buffer.getvalue()
+
+
+def render_svg(matrix, box_size):
+    """Renders the modules as an SVG with one path of horizontal runs"""
+    modules = len(matrix)
+    runs = []
+    for y, row in enumerate(matrix):
+        x = 0
+        for dark, group in itertools.groupby(row):
+            length = len(list(group))
+            if dark:
+                runs.append(f"M{x},{y}h{length}v1h-{length}z")
+            x += length
+    size = modules * box_size
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{size}" height="{size}" '
+            f'viewBox="0 0 {modules} {modules}" shape-rendering="crispEdges">'
+            f'<rect width="{modules}" height="{modules}" fill="#fff"/>'
+            f'<path d="{"".join(runs)}" fill="#000"/></svg>').encode("utf-8")
+
+
+def encode_chunk(chunk, version, box_size, border, image_format, optimize):
+    """Encodes a chunk of (line number, hcert) pairs; returns (line number, image bytes or error) pairs"""
+    images = []
+    for line_number, payload in chunk:
+        try:
+            matrix = qr_matrix(payload, version, box_size, border)
+            if image_format == "svg":
+                images.append((line_number, render_svg(matrix, box_size)))
+            else:
+                images.append((line_number, render_png(matrix, box_size, optimize)))
+        except Exception as error:
+            images.append((line_number, error))
+    return images
+
+
+def read_chunks(stream, chunk_size):
+    """Lazily splits the non-empty input lines into chunks of (line number, hcert) pairs"""
+    lines = ((number, line.rstrip("\r\n")) for number, line in enumerate(stream, start=1) if line.strip() != "")
+    while True:
+        chunk = list(itertools.islice(lines, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class ImageSink:
+    """Writes the images to a directory, or a zip or tar archive, named after their input line"""
+    def __init__(self, output, image_format):
+        self._format = image_format
+        self._zip = None
+        self._tar = None
+        self._directory = None
+        if output.endswith(".zip"):
+            import zipfile
+            # PNGs are already compressed
+            self._zip = zipfile.ZipFile(output, mode='w', compression=zipfile.ZIP_STORED
+                                        if image_format == "png" else zipfile.ZIP_DEFLATED)
+        elif output.endswith(ARCHIVE_EXTENSIONS):
+            import tarfile
+            self._tar = tarfile.open(output, mode='w:gz' if output.endswith(("gz", "tgz")) else 'w')
+        else:
+            os.makedirs(output, exist_ok=True)
+            self._directory = output
+
+    def write(self, line_number, image):
+        name = f"{line_number:08d}.{self._format}"
+        if self._zip is not None:
+            self._zip.writestr(name, image)
+        elif self._tar is not None:
+            import tarfile
+            info = tarfile.TarInfo(name)
+            info.size = len(image)
+            self._tar.addfile(info, io.BytesIO(image))
+        else:
+            with open(os.path.join(self._directory, name), mode='wb') as file:
+                file.write(image)
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+        if self._tar is not None:
+            self._tar.close()
+
+
+def encode_batch(stream, sink, workers, chunk_size, version, box_size, border, image_format, optimize):
+    """Encodes the hcerts in a process pool, returns (written, failed)"""
+    from concurrent.futures import ProcessPoolExecutor
+    written = 0
+    failed = 0
+    # Only a bounded number of chunks are in flight, so memory use doesn't grow with the input
+    max_in_flight = workers * 2
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        chunks = read_chunks(stream, chunk_size)
+        while True:
+            for chunk in itertools.islice(chunks, max_in_flight - len(pending)):
+                pending.append(executor.submit(encode_chunk, chunk, version, box_size, border, image_format,
+                                               optimize))
+            if not pending:
+                return written, failed
+            for line_number, image in pending.popleft().result():
+                if isinstance(image, Exception):
+                    failed += 1
+                    print(f"Line {line_number}: {type(image).__name__}: {image}", file=sys.stderr)
+                    continue
+                sink.write(line_number, image)
+                written += 1
+
+
+if __name__ == '__main__':
+    CLI_PARSER.add_argument(
+        '--output',
+        type=str,
+        help='Batch mode: directory, or .zip/.tar/.tar.gz archive, to write one image per input line to')
+    CLI_PARSER.add_argument(
+        '--workers',
+        type=int,
+        default=os.cpu_count(),
+        help='Number of worker processes in batch mode (default: number of cores)')
+    CLI_PARSER.add_argument(
+        '--chunk-size',
+        type=int,
+        default=64,
+        help='Number of hcerts handed to a worker at once in batch mode (default: 64)')
+    CLI_PARSER.add_argument(
+        '--version',
+        type=int,
+        choices=range(1, 41),
+        metavar='1-40',
+        help='Fixed QR version, skips fitting the version to every payload (too long payloads fail)')
+    CLI_PARSER.add_argument(
+        '--box-size',
+        type=int,
+        default=3,
+        help='Pixels per module in batch mode (default: 3)')
+    CLI_PARSER.add_argument(
+        '--border',
+        type=int,
+        default=2,
+        help='Border in modules in batch mode (default: 2)')
+    CLI_PARSER.add_argument(
+        '--format',
+        choices=FORMATS,
+        default="png",
+        help='Image format in batch mode (default: png)')
+    CLI_PARSER.add_argument(
+        '--optimize',
+        action='store_true',
+        help='Spend more time compressing the PNGs for smaller files')
+
+    args = CLI_PARSER.parse_args()
+    sys.stdin.reconfigure(encoding='utf-8')
+
+    if args.output is None:
+        for line in sys.stdin:
+            data = line.rstrip("\r\n").rstrip("\n")
+            qr = qr_png_base64(data)
+            print(qr)
+        sys.exit()
+
+    image_sink = ImageSink(args.output, args.format)
+    try:
+        total_written, total_failed = encode_batch(sys.stdin, image_sink, max(1, args.workers),
+                                                   max(1, args.chunk_size), args.version, args.box_size,
+                                                   args.border, args.format, args.optimize)
+    finally:
+        image_sink.close()
+    print(f"Wrote {total_written} QRs to {args.output}, {total_failed} failed.", file=sys.stderr)
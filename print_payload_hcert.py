@@ -1,41 +1,54 @@
 #!/bin/env python3.9
 
+import argparse
 import sys
-from base45 import b45decode
-import zlib
-from cbor2 import loads
-from cose.messages import Sign1Message
+
+from classes.DigitalCovidCertificate import DigitalCovidCertificate
+from classes.LineIndex import LineIndex, parse_shard
 
 # Initialize components
+CLI_PARSER = argparse.ArgumentParser()
 sys.stdin.reconfigure(encoding='utf-8')
 
+CLI_PARSER.add_argument(
+    '--input',
+    type=str,
+    help='Read the hcerts from this file instead of std-in; it is memory-mapped and its line index cached')
+CLI_PARSER.add_argument(
+    '--shard',
+    type=parse_shard,
+    default=(0, 1),
+    metavar='i/N',
+    help='With --input: only print the i-th of N contiguous slices of the lines (0 <= i < N)')
+CLI_PARSER.add_argument(
+    '--resume-from',
+    type=int,
+    metavar='LINE',
+    help='With --input: skip the lines before line number LINE')
 
-def unpack_qr(qr_text):
-    compressed_bytes = b45decode(qr_text[4:])
-    cose_bytes = zlib.decompress(compressed_bytes)
-    cose_message = Sign1Message.decode(cose_bytes)
-    cbor_message = loads(cose_message.payload)
-    return {
-        "COSE": cose_message,
-        "JSON": cbor_message[-260][1],
-        "CBOR": cbor_message
-    }
+args = CLI_PARSER.parse_args()
+if args.input is None:
+    if args.shard != (0, 1) or args.resume_from is not None:
+        CLI_PARSER.error("--shard and --resume-from need --input")
+    lines = (line.rstrip("\r\n").rstrip("\n") for line in sys.stdin)
+else:
+    lines = (line for _, line in LineIndex.open(args.input).shard(*args.shard, args.resume_from))
 
 
-for line in sys.stdin:
-    data = line.rstrip("\r\n").rstrip("\n")
-    json = unpack_qr(data)
+for data in lines:
+    dcc = DigitalCovidCertificate.from_hcert(data)
+    payload = dcc.dcc()
     print()
     print()
     print("Hcert")
     print(data)
     print()
     print("JSON")
-    print(json["JSON"])
+    print(payload)
     print()
     print("COSE")
-    print(json["COSE"])
+    print(dcc.cose_message())
     print()
     print("CBOR")
-    print(json["COSE"])
+    print(dcc.claims())
     print()
@@ -1,34 +1,14 @@
 #!/bin/env python3.9
 
 import sys
-from base45 import b45decode
-import zlib
-from cbor2 import loads
-from cose.messages import Sign1Message
-from pyzbar.pyzbar import decode
-from PIL import Image
+from hcert import unpack_qr
 import argparse
+from classes.QrReader import QrReader
 
 # Initialize components
 CLI_PARSER = argparse.ArgumentParser()
 
 
-def unpack_qr(qr_text):
-    compressed_bytes = b45decode(qr_text[4:])
-    cose_bytes = zlib.decompress(compressed_bytes)
-    cose_message = Sign1Message.decode(cose_bytes)
-    cbor_message = loads(cose_message.payload)
-    return {
-        "COSE": cose_message,
-        "JSON": cbor_message[-260][1]
-    }
-
-
-def read_qr_pyzbar(file):
-    barcode = decode(Image.open(file))[0]
-    return barcode.data.decode("utf-8")
-
-
 CLI_PARSER.add_argument(
     '--file',
     type=str,
@@ -43,7 +23,10 @@ if args.file is None:
 
 print()
 print()
-data = read_qr_pyzbar(args.file)
+data = QrReader().read(args.file)
+if data is None:
+    print(f"Unable to read QR: {args.file}")
+    sys.exit(1)
 print("Raw QR data")
 print(data)
 json = unpack_qr(data)
@@ -55,5 +38,5 @@ print("JSON")
 print(json["JSON"])
 print()
 print("COSE")
-print(json["COSE"])
+print(json["COSE_MESSAGE"])
 print()
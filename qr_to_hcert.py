@@ -1,20 +1,14 @@
 import sys
-import pyzbar.pyzbar
 
-from PIL import Image
+from classes.QrReader import QrReader
 
-
-def read_qr_code(qr_file):
-    # https://www.codershubb.com/generate-or-read-qr-code-using-python/
-    # https://stackoverflow.com/questions/32908639/open-pil-image-from-byte-file
-    image = Image.open(qr_file)
-    decoded_image = pyzbar.pyzbar.decode(image)
-    return decoded_image[0].data.decode()
-
-
-if len(sys.argv) != 2:
+if len(sys.argv) < 2:
     raise ValueError('File missing!')
 
-file = sys.argv[1]
-h_cert = read_qr_code(file)
-print(h_cert)
+# One reader for all files: unreadable images go to zxing in a single run
+files = sys.argv[1:]
+for file, h_cert in zip(files, QrReader().read_many(files)):
+    if h_cert is None:
+        print(f"Unable to read QR: {file}", file=sys.stderr)
+        continue
+    print(h_cert)
@@ -0,0 +1,35 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY)
+
+import generate_corpus
+
+
+def sections(output):
+    """Returns the printed sections of one hcert by heading"""
+    lines = output.strip("\n").split("\n")
+    return {lines[index]: lines[index + 1] for index in range(len(lines) - 1)
+            if lines[index] in ("Hcert", "JSON", "COSE", "CBOR")}
+
+
+class PrintPayloadHcertTest(unittest.TestCase):
+    def test_cbor_section_is_the_claims(self):
+        with tempfile.TemporaryDirectory() as corpus:
+            generate_corpus.generate(corpus, 1, 1, False)
+            with open(os.path.join(corpus, "hcerts.txt"), encoding='utf-8') as hcerts:
+                qr_text = hcerts.readline()
+        output = subprocess.run([sys.executable, os.path.join(REPOSITORY, "print_payload_hcert.py")], input=qr_text,
+                                capture_output=True, text=True, check=True, cwd=REPOSITORY).stdout
+        printed = sections(output)
+        self.assertNotEqual(printed["COSE"], printed["CBOR"])
+        # The CWT claims, with the DCC under -260
+        self.assertIn("-260: {1: {", printed["CBOR"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY)
+
+import generate_corpus
+from classes.ReloadableTrustList import ReloadableTrustList
+
+
+class ReloadableTrustListTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        generate_corpus.generate(self._directory, 1, 1, False)
+        self._path = os.path.join(self._directory, "trustlist.json")
+        with open(self._path, encoding='utf-8') as file:
+            self._certificates = json.load(file)["certificates"]
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def write(self, certificates):
+        with open(self._path, mode='w', encoding='utf-8') as file:
+            json.dump({"certificates": certificates}, file)
+
+    def wait_for(self, condition, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return condition()
+
+    def test_malformed_update_keeps_the_watcher_running(self):
+        trust_list = ReloadableTrustList(self._path, poll_interval=0.01)
+        kids = sorted(trust_list.kids())
+        trust_list.start()
+        try:
+            # A null entry: the JSON parses, the DSC can't be built from it
+            self.write(self._certificates + [None])
+            time.sleep(0.2)
+            self.assertTrue(trust_list._thread.is_alive())
+            self.assertEqual(kids, sorted(trust_list.kids()))
+            # A later, valid update is still picked up
+            self.write(self._certificates[:1])
+            self.assertTrue(self.wait_for(lambda: len(trust_list.kids()) == 1))
+        finally:
+            trust_list.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY)
+
+import generate_corpus
+from classes.DigitalSigningCertificate import DigitalSigningCertificate
+from classes.TrustList import TrustList
+
+
+class TrustListTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        generate_corpus.generate(self._directory.name, 1, 1, False)
+        self._path = os.path.join(self._directory.name, "trustlist.json")
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def test_validity_is_read_when_built(self):
+        trust_list = TrustList.load(self._path)
+        with mock.patch.object(DigitalSigningCertificate, "certificate", side_effect=AssertionError("X.509 parsed")):
+            stats = trust_list.country_stats()
+            for kid in trust_list.kids():
+                self.assertIsNotNone(trust_list.validity(kid))
+        self.assertEqual({"NL", "DE"}, set(stats))
+        self.assertEqual(1, stats["NL"]["dscs"])
+
+    def test_snapshot_keeps_validity(self):
+        snapshot_dir = os.path.join(self._directory.name, "snapshot")
+        built = TrustList.load(self._path, snapshot_dir)
+        with mock.patch.object(DigitalSigningCertificate, "certificate", side_effect=AssertionError("X.509 parsed")):
+            loaded = TrustList.load(self._path, snapshot_dir)
+            self.assertEqual(built.country_stats(at=0), loaded.country_stats(at=0))
+            self.assertEqual([built.validity(kid) for kid in built.kids()],
+                             [loaded.validity(kid) for kid in built.kids()])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import os
+import sys
+import tempfile
+import unittest
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY)
+
+import generate_corpus
+import validate_test_cases
+
+
+class ValidateTestCasesTest(unittest.TestCase):
+    def setUp(self):
+        # The schemas are read relative to the repository
+        self._cwd = os.getcwd()
+        os.chdir(REPOSITORY)
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+
+    def test_generated_corpus_passes(self):
+        with tempfile.TemporaryDirectory() as corpus:
+            generated = generate_corpus.generate(corpus, 1, 1, False)
+            records = list(validate_test_cases.validate_tree(corpus, 1, 16))
+        self.assertEqual(generated, len(records))
+        self.assertEqual([], [record["file"] for record in records if not record["passed"]])
+        self.assertNotIn("trustlist.json", [os.path.basename(record["file"]) for record in records])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,60 +1,492 @@
 #!/bin/env python3.9
 
+import argparse
+import itertools
+import json
+import os
 import sys
-from base45 import b45decode
 import zlib
-from cbor2 import loads
-from cose.messages import Sign1Message
 
-from classes.SchemaValidator import SchemaValidator
+from collections import deque
+
+from cose.headers import Algorithm
+
+import hcert
+from classes.DigitalCovidCertificate import DigitalCovidCertificate, CLAIM_ISSUER, CLAIM_ISSUED_AT, CLAIM_EXPIRES_AT
+from classes.LineIndex import LineIndex, parse_shard
+from classes.Metrics import METRICS
+from classes.ResultCache import ResultCache
+from classes.RevocationList import RevocationList
+from classes.RuleEngine import RuleEngine, RESULT_PASSED, RESULT_FAILED, RESULT_OPEN, json_files
+from classes.SchemaValidator import SchemaValidator, SCHEMAS, ENGINES, ENGINE_JSCHON
 from classes.SignatureValidator import SignatureValidator
+from classes.ReloadableTrustList import ReloadableTrustList
 from classes.TrustList import TrustList, UnknownKidError
+from classes.VerdictCache import VerdictCache
+
+# Initialize components (see init_components)
+SCHEMA_VALIDATOR: SchemaValidator = None
+SIGNATURE_VALIDATOR: SignatureValidator = None
+REVOCATION_LIST: RevocationList = None
+RULE_ENGINE: RuleEngine = None
+# Country code of the country that accepts (checks) the DCCs, for the business rules
+RULE_ACCEPTOR: str = None
+CLI_PARSER = argparse.ArgumentParser()
+METRICS_PATH = 'metrics.json'
 
-# Initialize components
-SCHEMA_VALIDATOR = SchemaValidator.create()
-SIGNATURE_VALIDATOR = SignatureValidator(TrustList.load("trustlist.json"))
-sys.stdin.reconfigure(encoding='utf-8')
+
+def init_components(snapshot_dir=None, watch_interval=None, schema_engine=ENGINE_JSCHON, metrics=False,
+                    revocation_path=None, rules_path=None, value_sets_path=None, acceptor=None):
+    """Loads the validators, once per process (also used as the worker initializer)"""
+    global SCHEMA_VALIDATOR, SIGNATURE_VALIDATOR, REVOCATION_LIST, RULE_ENGINE, RULE_ACCEPTOR
+    METRICS.enable(metrics)
+    if RULE_ENGINE is None and rules_path is not None:
+        RULE_ENGINE = RuleEngine.load(rules_path, value_sets_path)
+        RULE_ACCEPTOR = acceptor.upper()
+    if REVOCATION_LIST is None and revocation_path is not None:
+        # Memory-mapped, so the workers share the pages of the index
+        REVOCATION_LIST = RevocationList.open(revocation_path)
+    if SCHEMA_VALIDATOR is None:
+        SCHEMA_VALIDATOR = SchemaValidator.create(schema_engine)
+    if SIGNATURE_VALIDATOR is None:
+        if watch_interval is None:
+            SIGNATURE_VALIDATOR = SignatureValidator(TrustList.load("trustlist.json", snapshot_dir))
+        else:
+            trust_list = ReloadableTrustList("trustlist.json", snapshot_dir, watch_interval)
+            SIGNATURE_VALIDATOR = SignatureValidator(trust_list)
+            trust_list.add_listener(SIGNATURE_VALIDATOR.invalidate_keys)
+            trust_list.start()
 
 
 def unpack_qr(qr_text):
-    compressed_bytes = b45decode(qr_text[4:])
-    print("..b45-decode OK")
-    cose_bytes = zlib.decompress(compressed_bytes)
-    print("..zlib.decompress OK")
-    cose_message = Sign1Message.decode(cose_bytes)
-    print("..cose.decode OK")
-    cbor_message = loads(cose_message.payload)
-    print("..cbor.load OK")
-    print(cbor_message)
-    return {
-        "COSE": cose_bytes.hex(),
-        "JSON": cbor_message[-260][1]
-    }
+    unpacked = hcert.unpack_qr(qr_text)
+    print("..decode OK")
+    print(unpacked["CBOR"])
+    return unpacked
 
 
-for line in sys.stdin:
-    data = line.rstrip("\r\n").rstrip("\n")
-    print()
-    print(f"Validating: [{data}]")
+def is_revoked(unpacked):
+    """Checks the DCC against the revocation list, with the signature and alg of the decoded COSE message"""
+    message = unpacked["COSE_MESSAGE"]
+    algorithm = message.get_attr(Algorithm)
+    return REVOCATION_LIST.is_revoked(unpacked["JSON"], unpacked["CBOR"].get(CLAIM_ISSUER), message.signature,
+                                      None if algorithm is None else algorithm.identifier)
+
+
+def validate_serial(stream):
+    """Validates the hcerts one by one, printing a readable report for each"""
+    for line in stream:
+        data = line.rstrip("\r\n").rstrip("\n")
+        print()
+        print(f"Validating: [{data}]")
+        try:
+            unpacked = unpack_qr(data)
+            # Signature, and the DSC's country and validity against the iss and iat claims
+            result = SIGNATURE_VALIDATOR.validate(unpacked["COSE"], unpacked["CBOR"].get(CLAIM_ISSUER),
+                                                  unpacked["CBOR"].get(CLAIM_ISSUED_AT))
+            print(f"KID = {result['kid']}")
+            if result["valid"]:
+                print("Successfully validated signature!")
+            else:
+                print("Signature validation failed!")
+                if result["error"] is not None:
+                    print(f"{result['error']['type']}: {result['error']['message']}")
+            # Schema
+            json_payload = unpacked["JSON"]
+            schema_ver = json_payload['ver']
+            result = SCHEMA_VALIDATOR.validate(json_payload)
+            if result["valid"]:
+                print(f"Successfully validated schema! The file conforms to schema { schema_ver }")
+            else:
+                print(f"Schema validation failed! The file does not conform to schema { schema_ver }")
+            # Revocation
+            if REVOCATION_LIST is not None:
+                if is_revoked(unpacked):
+                    print("Revoked! The UCI or signature is on the revocation list")
+                else:
+                    print("Not revoked")
+            # Business rules
+            if RULE_ENGINE is not None:
+                claims = unpacked["CBOR"]
+                results = RULE_ENGINE.evaluate(json_payload, claims.get(CLAIM_ISSUER), RULE_ACCEPTOR,
+                                               issued_at=claims.get(CLAIM_ISSUED_AT),
+                                               expires_at=claims.get(CLAIM_EXPIRES_AT))
+                print(f"Business rules of {RULE_ACCEPTOR}: {len(results)} evaluated")
+                for result in results:
+                    error = f" ({result['error']})" if result["error"] is not None else ""
+                    print(f"  {result['rule']}: {result['result']}{error}")
+        except UnknownKidError as error:
+            print("Error! KID not found")
+            print(error)
+        except Exception as error:
+            print("Error! Something went very wrong!")
+            print(error)
+
+
+def validate_record(line_number, unpacked):
+    """Validates an unpacked hcert (or the error unpacking it), returns a compact, JSON-serializable result"""
+    record = {
+        "line": line_number,
+        "valid": False,
+        "kid": None,
+        "schema": None,
+        "signature": None,
+        "error": None
+    }
     try:
-        json = unpack_qr(data)
-        # Signature
-        result = SIGNATURE_VALIDATOR.validate(bytes.fromhex(json["COSE"]))
-        if result["valid"]:
-            print("Successfully validated signature!")
-        else:
-            print("Signature validation failed!")
-        # Schema
-        json_payload = json["JSON"]
-        schema_ver = json_payload['ver']
-        result = SCHEMA_VALIDATOR.validate(json_payload)
-        if result["valid"]:
-            print(f"Successfully validated schema! The file conforms to schema { schema_ver }")
-        else:
-            print(f"Schema validation failed! The file does not conform to schema { schema_ver }")
+        if isinstance(unpacked, Exception):
+            raise unpacked
+        result = SIGNATURE_VALIDATOR.validate(unpacked["COSE"], unpacked["CBOR"].get(CLAIM_ISSUER),
+                                              unpacked["CBOR"].get(CLAIM_ISSUED_AT))
+        record["kid"] = result["kid"]
+        record["signature"] = {
+            "valid": result["valid"],
+            "error": None if result["error"] is None else f"{result['error']['type']}: {result['error']['message']}"
+        }
+        result = SCHEMA_VALIDATOR.validate(unpacked["JSON"])
+        record["schema"] = {
+            "valid": result["valid"],
+            "version": unpacked["JSON"].get("ver"),
+            "errors": [error["error"] for error in result.get("errors", [])]
+        }
+        record["valid"] = record["signature"]["valid"] and record["schema"]["valid"]
+        if REVOCATION_LIST is not None:
+            record["revoked"] = is_revoked(unpacked)
+            record["valid"] = record["valid"] and not record["revoked"]
+        if RULE_ENGINE is not None:
+            claims = unpacked["CBOR"]
+            results = RULE_ENGINE.evaluate(unpacked["JSON"], claims.get(CLAIM_ISSUER), RULE_ACCEPTOR,
+                                           issued_at=claims.get(CLAIM_ISSUED_AT),
+                                           expires_at=claims.get(CLAIM_EXPIRES_AT))
+            record["rules"] = {
+                "evaluated": len(results),
+                "failed": [result["rule"] for result in results if result["result"] == RESULT_FAILED],
+                "open": {result["rule"]: result["error"] for result in results if result["result"] == RESULT_OPEN}
+            }
+            # Like the EU apps, a rule that can't be evaluated (OPEN) doesn't pass either
+            record["valid"] = record["valid"] and all(result["result"] == RESULT_PASSED for result in results)
     except UnknownKidError as error:
-        print("Error! KID not found")
-        print(error)
+        record["error"] = f"TRUST-LIST: {error}"
     except Exception as error:
-        print("Error! Something went very wrong!")
-        print(error)
+        record["error"] = f"{type(error).__name__}: {error}"
+    return record
+
+
+def validate_chunk(chunk):
+    """Validates a chunk of (line number, hcert) pairs, returns the NDJSON lines and the worker's metrics"""
+    lines = []
+    # The whole chunk is base45 decoded at once
+    unpacked_chunk = hcert.unpack_qr_many([data for _, data in chunk])
+    for (line_number, _), unpacked in zip(chunk, unpacked_chunk):
+        with METRICS.measure("hcert.record"):
+            lines.append(json.dumps(validate_record(line_number, unpacked), default=str))
+    return lines, METRICS.drain()
+
+
+def validate_chunk_for_cache(chunk):
+    """Validates the chunk like validate_chunk, also returns the digest of the trust list the verdicts were
+    made with; None when the trust list was reloaded in the meantime"""
+    digest = SIGNATURE_VALIDATOR.trust_list().digest()
+    lines, worker_metrics = validate_chunk(chunk)
+    if SIGNATURE_VALIDATOR.trust_list().digest() != digest:
+        digest = None
+    return lines, worker_metrics, digest
+
+
+def triage_chunk(chunk):
+    """Decodes only the COSE headers and CWT claims of a chunk of (line number, hcert) pairs; returns records"""
+    records = []
+    decoded = hcert.BASE45_DECODER.decode_many([hcert.strip_prefix(data) for _, data in chunk])
+    for (line_number, _), compressed_bytes in zip(chunk, decoded):
+        record = {
+            "line": line_number,
+            "kid": None,
+            "alg": None,
+            "iss": None,
+            "iat": None,
+            "exp": None,
+            "ver": None,
+            "error": None
+        }
+        try:
+            if isinstance(compressed_bytes, Exception):
+                raise compressed_bytes
+            record.update(DigitalCovidCertificate.from_cose(zlib.decompress(compressed_bytes)).triage())
+        except Exception as error:
+            record["error"] = f"{type(error).__name__}: {error}"
+        records.append(record)
+    return records
+
+
+def triage(lines, output, chunk_size):
+    """Writes one compact NDJSON record per input line with the KID, issuer, iat/exp and schema version only"""
+    for chunk in read_chunks(lines, chunk_size):
+        output.write("\n".join(json.dumps(record) for record in triage_chunk(chunk)))
+        output.write("\n")
+        output.flush()
+
+
+def numbered_lines(stream):
+    """Yields the (line number, hcert) pairs of the stream"""
+    return ((number, line.rstrip("\r\n")) for number, line in enumerate(stream, start=1))
+
+
+def read_input(input_path, shard=(0, 1), resume_from=None):
+    """Returns the (line number, hcert) pairs to work on: std-in, or a slice of the memory-mapped input file"""
+    if input_path is None:
+        return numbered_lines(sys.stdin)
+    return LineIndex.open(input_path).shard(*shard, resume_from)
+
+
+def read_chunks(lines, chunk_size):
+    """Lazily splits the (line number, hcert) pairs into chunks"""
+    while True:
+        chunk = list(itertools.islice(lines, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def verdict_generation(schema_engine, revocation_path=None, rules_path=None, value_sets_path=None, acceptor=None):
+    """Returns the generation of the verdicts but for the trust list: the hash of the schemas and the business
+    rules, and the schema engine
+
+    The trust list can be reloaded while validating, so its digest is added per chunk, as reported by the
+    worker that validated it. The revocation index can be large, so it's identified by its size and mtime
+    instead of its hash.
+    """
+    files = [f"schemas/{version}.json" for version in SCHEMAS]
+    if rules_path is not None:
+        files += json_files(rules_path) + (json_files(value_sets_path) if value_sets_path is not None else [])
+    generation = f"{ResultCache.generation_of(files)}:{schema_engine}"
+    if rules_path is not None:
+        generation += f":{acceptor}"
+    if revocation_path is not None:
+        revocation_stat = os.stat(revocation_path)
+        generation += f":{revocation_stat.st_size}-{revocation_stat.st_mtime_ns}"
+    return generation
+
+
+def validate_batch(lines, output, workers, chunk_size, snapshot_dir=None, watch_interval=None,
+                   schema_engine=ENGINE_JSCHON, metrics=False, verdict_cache=None, revocation_path=None,
+                   rules_path=None, value_sets_path=None, acceptor=None):
+    """Validates the hcerts in a process pool, writing one NDJSON line per input line, in input order
+
+    With a verdict cache, hcerts that were validated before are answered from the cache and only the
+    others are handed to the workers, each distinct hcert once.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    trust_list = None
+    generation = None
+    # Key -> (future, index in its chunk) of the hcerts that are being validated
+    in_flight = dict()
+    if verdict_cache is not None:
+        generation = verdict_generation(schema_engine, revocation_path, rules_path, value_sets_path, acceptor)
+        if watch_interval is None:
+            digest = ResultCache.content_hash("trustlist.json")
+        else:
+            # The workers reload the trust list themselves; this one only tells the cache to move on
+            trust_list = ReloadableTrustList("trustlist.json", snapshot_dir, watch_interval)
+            trust_list.add_listener(lambda changed: verdict_cache.invalidate(f"{generation}:{trust_list.digest()}"))
+            trust_list.start()
+            digest = trust_list.digest()
+        verdict_cache.invalidate(f"{generation}:{digest}")
+    # Only a bounded number of chunks are in flight, so memory use doesn't grow with the input
+    max_in_flight = workers * 2
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_components,
+                                 initargs=(snapshot_dir, watch_interval, schema_engine, metrics,
+                                           revocation_path, rules_path, value_sets_path, acceptor)) as executor:
+            pending = deque()
+            for chunk in read_chunks(lines, chunk_size):
+                if verdict_cache is None:
+                    pending.append((None, executor.submit(validate_chunk, chunk)))
+                else:
+                    pending.append(submit_uncached(executor, chunk, verdict_cache, in_flight))
+                if len(pending) >= max_in_flight:
+                    write_results(*pending.popleft(), output, verdict_cache, in_flight, generation)
+            while pending:
+                write_results(*pending.popleft(), output, verdict_cache, in_flight, generation)
+    finally:
+        if trust_list is not None:
+            trust_list.stop()
+
+
+def submit_uncached(executor, chunk, verdict_cache, in_flight):
+    """Looks the chunk up in the verdict cache and submits the misses; returns (plan, future or None)
+
+    A miss that is already being validated (earlier in the chunk, or in a chunk still in flight) isn't
+    submitted again, its line takes the result of that validation. The plan holds per line the cached
+    verdict, or the (future, index) of its result; a future of None is the chunk's own.
+    """
+    plan = []
+    misses = []
+    submitted = dict()
+    for line_number, data in chunk:
+        key = VerdictCache.key(data)
+        verdict = verdict_cache.get(key)
+        if verdict is not None:
+            plan.append((line_number, key, verdict, None))
+        elif key in in_flight:
+            plan.append((line_number, key, None, in_flight[key]))
+        else:
+            if key not in submitted:
+                submitted[key] = len(misses)
+                misses.append((line_number, data))
+            plan.append((line_number, key, None, (None, submitted[key])))
+    future = executor.submit(validate_chunk_for_cache, misses) if len(misses) > 0 else None
+    for key, index in submitted.items():
+        in_flight[key] = (future, index)
+    return plan, future
+
+
+def write_results(plan, future, output, verdict_cache=None, in_flight=None, generation=None):
+    """Writes the NDJSON lines of a chunk: the cached verdicts and the results of the workers, in input order
+
+    The verdicts of the chunk's own validations are cached under the generation of the trust list the worker
+    used; the cache drops them when that's no longer the current one.
+    """
+    lines = []
+    if future is not None:
+        lines, worker_metrics = future.result()[:2]
+        METRICS.merge(worker_metrics)
+    if plan is not None:
+        digest = future.result()[2] if future is not None else None
+        lines = []
+        for line_number, key, verdict, source in plan:
+            if verdict is None:
+                owner, index = source
+                # Earlier chunks were written before this one, so their futures are done
+                verdict = json.loads((owner or future).result()[0][index])
+                del verdict["line"]
+                if owner is None and in_flight.get(key) == (future, index):
+                    del in_flight[key]
+                    if digest is not None:
+                        verdict_cache.put(key, verdict, f"{generation}:{digest}")
+            lines.append(json.dumps({"line": line_number, **verdict}))
+    output.write("\n".join(lines))
+    output.write("\n")
+    output.flush()
+
+
+if __name__ == '__main__':
+    CLI_PARSER.add_argument(
+        '--batch',
+        action='store_true',
+        help='Validate in a process pool and write one NDJSON result per input line')
+    CLI_PARSER.add_argument(
+        '--triage',
+        action='store_true',
+        help='Only decode the headers and claims (KID, issuer, iat, exp, schema version), one NDJSON record per' +
+        ' input line; no schema or signature validation')
+    CLI_PARSER.add_argument(
+        '--workers',
+        type=int,
+        default=os.cpu_count(),
+        help='Number of worker processes in batch mode (default: number of cores)')
+    CLI_PARSER.add_argument(
+        '--chunk-size',
+        type=int,
+        default=256,
+        help='Number of hcerts handed to a worker at once in batch mode (default: 256)')
+    CLI_PARSER.add_argument(
+        '--trustlist-snapshot',
+        type=str,
+        help='Optional directory for a binary snapshot of the trust list, reused while trustlist.json is unchanged')
+    CLI_PARSER.add_argument(
+        '--watch-trustlist',
+        type=float,
+        metavar='SECONDS',
+        help='Check trustlist.json for changes every SECONDS and reload it in the background')
+    CLI_PARSER.add_argument(
+        '--schema-engine',
+        choices=ENGINES,
+        default=ENGINE_JSCHON,
+        help='Schema validation engine: jschon (reference) or compiled (generated code, much faster)')
+    CLI_PARSER.add_argument(
+        '--metrics',
+        type=str,
+        nargs='?',
+        const=METRICS_PATH,
+        help='Record the time spent per stage and write a JSON summary (p50/p95/p99) at the end' +
+        f' (default file: {METRICS_PATH})')
+    CLI_PARSER.add_argument(
+        '--verdict-cache',
+        type=int,
+        metavar='SIZE',
+        help='Batch mode: keep the verdicts of up to SIZE distinct hcerts in memory and answer repeated hcerts' +
+        ' from it; dropped when the schemas or the trust list change')
+    CLI_PARSER.add_argument(
+        '--verdict-ttl',
+        type=float,
+        metavar='SECONDS',
+        help='Expire cached verdicts after SECONDS (default: never)')
+    CLI_PARSER.add_argument(
+        '--revocation',
+        type=str,
+        metavar='FILE',
+        help='Also check the UCI and signature hashes against this revocation index (see' +
+        ' compile_revocation_list.py); revoked hcerts are not valid')
+    CLI_PARSER.add_argument(
+        '--rules',
+        type=str,
+        metavar='PATH',
+        help='Also evaluate the CertLogic business rules in this JSON file or directory for --acceptor; a DCC' +
+        ' that fails a rule, or for which a rule can not be evaluated, is not valid')
+    CLI_PARSER.add_argument(
+        '--value-sets',
+        type=str,
+        metavar='PATH',
+        help='JSON file or directory with the value sets the business rules refer to (external.valueSets)')
+    CLI_PARSER.add_argument(
+        '--acceptor',
+        type=str,
+        metavar='COUNTRY',
+        help='Country code of the accepting country: its acceptance rules and the invalidation rules of the' +
+        ' issuing country are evaluated')
+    CLI_PARSER.add_argument(
+        '--input',
+        type=str,
+        help='Read the hcerts from this file instead of std-in; it is memory-mapped and its line index cached')
+    CLI_PARSER.add_argument(
+        '--shard',
+        type=parse_shard,
+        default=(0, 1),
+        metavar='i/N',
+        help='With --input: only handle the i-th of N contiguous slices of the lines (0 <= i < N)')
+    CLI_PARSER.add_argument(
+        '--resume-from',
+        type=int,
+        metavar='LINE',
+        help='With --input: skip the lines before line number LINE, e.g. to resume an interrupted run')
+
+    args = CLI_PARSER.parse_args()
+    sys.stdin.reconfigure(encoding='utf-8')
+    if args.input is None and (args.shard != (0, 1) or args.resume_from is not None):
+        CLI_PARSER.error("--shard and --resume-from need --input")
+    if args.rules is not None and args.acceptor is None:
+        CLI_PARSER.error("--rules needs --acceptor")
+    if args.rules is not None and args.verdict_cache is not None and args.verdict_ttl is None:
+        # The rules are evaluated at the time of validation, a cached verdict goes stale
+        CLI_PARSER.error("--verdict-cache with --rules needs --verdict-ttl")
+    input_lines = read_input(args.input, args.shard, args.resume_from)
+
+    if args.triage:
+        triage(input_lines, sys.stdout, max(1, args.chunk_size))
+    elif args.batch:
+        cache = None
+        if args.verdict_cache is not None:
+            cache = VerdictCache(args.verdict_cache, args.verdict_ttl)
+        validate_batch(input_lines, sys.stdout, max(1, args.workers), max(1, args.chunk_size),
+                       args.trustlist_snapshot, args.watch_trustlist, args.schema_engine,
+                       args.metrics is not None, cache, args.revocation, args.rules, args.value_sets,
+                       args.acceptor)
+        if cache is not None:
+            print(f"Verdict cache: {json.dumps(cache.cache_info())}", file=sys.stderr)
+    else:
+        init_components(args.trustlist_snapshot, args.watch_trustlist, args.schema_engine,
+                        args.metrics is not None, args.revocation, args.rules, args.value_sets, args.acceptor)
+        validate_serial(line for _, line in input_lines)
+
+    if args.metrics is not None:
+        METRICS.write(args.metrics)
@@ -1,33 +1,37 @@
 #!/bin/env python3.9
 
-import os
-import util
 import argparse
 import sys
-import zlib
-import re
-import zxing
 import json
+import hcert
 
 from datetime import datetime
-from pyzbar.pyzbar import decode
-from PIL import Image
-from base45 import b45decode
-from cbor2 import loads
-from cose.messages import Sign1Message
-from classes.SchemaValidator import SchemaValidator
+from classes.CountryResult import CountryResult
+from classes.DigitalCovidCertificate import CLAIM_ISSUER, CLAIM_ISSUED_AT
+from classes.Metrics import METRICS
+from classes.QrReader import QrReader
+from classes.ReportWriter import ReportWriter
+from classes.ResultCache import ResultCache
+from classes.SchemaValidator import SchemaValidator, SCHEMAS, ENGINES, ENGINE_JSCHON
 from classes.SignatureValidator import SignatureValidator
+from classes.TestCaseManifest import TestCaseManifest, VERSION_PATTERN
 from classes.TrustList import TrustList, UnknownKidError
 
-# Initialize components
-SCHEMA_VALIDATOR = SchemaValidator.create()
-SIGNATURE_VALIDATOR = SignatureValidator(TrustList.load("trustlist.json"))
+# Initialize components (see init_components)
+SCHEMA_VALIDATOR: SchemaValidator = None
+SIGNATURE_VALIDATOR: SignatureValidator = None
+QR_READER = QrReader()
 CLI_PARSER = argparse.ArgumentParser()
 
 # Global state
 SCRIPT_NAME = 'validate_quality_assurance.py'
 ALLOWED_EXT = ['.PNG']
 SCHEMA_FILE_PATH = 'DGC.combined-schema.json'
+RESULT_CACHE_PATH = '.cache/qa-results.pickle'
+MANIFEST_PATH = '.cache/qa-manifest.pickle'
+# Bump when the checks change, so cached verdicts of unchanged files are made again
+VALIDATION_VERSION = 2
+METRICS_PATH = 'metrics.json'
 
 # Various flags which need to be turned into
 VERBOSE = True
@@ -35,11 +39,111 @@ VALID_IF_ANY_VALID_CASE_FOUND = True
 
 EXPECTED_FAILURES = 0
 
+# Repository root -> TestCaseManifest, scanned once per process (see load_manifest)
+MANIFESTS = dict()
 
-def validate(path):
+
+def init_components(snapshot_dir=None, schema_engine=ENGINE_JSCHON, metrics=False):
+    """Loads the validators, once per process (also used as the worker initializer)"""
+    global SCHEMA_VALIDATOR, SIGNATURE_VALIDATOR
+    METRICS.enable(metrics)
+    if SCHEMA_VALIDATOR is None:
+        SCHEMA_VALIDATOR = SchemaValidator.create(schema_engine)
+    if SIGNATURE_VALIDATOR is None:
+        SIGNATURE_VALIDATOR = SignatureValidator(TrustList.load("trustlist.json", snapshot_dir))
+
+
+def validate(path, countries, workers=1, snapshot_dir=None, schema_engine=ENGINE_JSCHON, cache=None,
+             report=None):
+    """Validates the countries, returns a CountryResult per country; each verdict is reported as it comes"""
+    report = report if report is not None else ReportWriter()
+    # Also in the parent with workers: forked workers inherit the loaded trust list
+    init_components(snapshot_dir, schema_engine, METRICS.enabled())
+    if workers > 1:
+        return validate_parallel(path, countries, workers, snapshot_dir, schema_engine, cache, report)
+    results = dict()
+    for country in countries:
+        validate_country(path, country, results, cache, report)
+    return results
+
+
+def load_result_cache(path, schema_engine=ENGINE_JSCHON):
+    """Loads the QA result cache, evicted when the schemas, the trust list, the engine or the checks changed"""
+    generation = ResultCache.generation_of([f"schemas/{version}.json" for version in SCHEMAS] + ["trustlist.json"])
+    return ResultCache.load(path, f"{generation}:{schema_engine}:{VALIDATION_VERSION}")
+
+
+def load_manifest(path, manifest_path=MANIFEST_PATH):
+    """Returns the test case manifest of the repository, refreshed from disk on the first call"""
+    if path not in MANIFESTS:
+        MANIFESTS[path] = TestCaseManifest.load(path, manifest_path, tuple(ALLOWED_EXT))
+    return MANIFESTS[path]
+
+
+def cache_key(file):
+    """Returns the (content hash, schema version) the verdict of the file is cached under"""
+    try:
+        version = get_version(file)
+    except AttributeError:
+        version = None
+    return ResultCache.content_hash(file), version
+
+
+def cached_verdict(file, key, cache):
+    """Returns the cached (status, details) of the file, or None"""
+    if cache is None:
+        return None
+    verdict = cache.get(*key)
+    if verdict is None:
+        return None
+    status, details = verdict
+    # The same content may have been cached under another path
+    if isinstance(details, dict):
+        return status, dict(details, file=file)
+    return status, file
+
+
+def validate_parallel(path, countries, workers, snapshot_dir=None, schema_engine=ENGINE_JSCHON, cache=None,
+                      report=None):
+    """Validates all countries, spreading the files over a pool of worker processes"""
+    from concurrent.futures import ProcessPoolExecutor
     results = dict()
+    country_files = dict()
     for country in countries:
-        validate_country(path, country, results)
+        country_files[country] = list_country_files(path, country)
+    files = [file for country in countries for file in country_files[country]]
+    # Unchanged files are answered from the cache and never reach the pool
+    keys = dict()
+    verdicts = dict()
+    if cache is not None:
+        for file in files:
+            keys[file] = cache_key(file)
+            verdict = cached_verdict(file, keys[file], cache)
+            if verdict is not None:
+                verdicts[file] = verdict
+    changed_files = [file for file in files if file not in verdicts]
+    chunk_size = max(1, len(changed_files) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_components,
+                             initargs=(snapshot_dir, schema_engine, METRICS.enabled())) as executor:
+        # map() yields in submission order, so the merge matches a serial run
+        outcomes = executor.map(validate_file_in_worker, changed_files, chunksize=chunk_size)
+        for country in countries:
+            print(f"Validating {country}..")
+            result = results[country] = CountryResult(country)
+            if len(country_files[country]) == 0:
+                result.exception = "No test cases found."
+            for file in country_files[country]:
+                print(f"  File: {file}")
+                if file in verdicts:
+                    status, entry = verdicts[file]
+                    report.add(result, file, status, entry, False)
+                    continue
+                status, entry, worker_metrics = next(outcomes)
+                METRICS.merge(worker_metrics)
+                if cache is not None:
+                    cache.put(*keys[file], status, entry)
+                report.add(result, file, status, entry, True)
+            report.end_country(result)
     return results
 
 
@@ -51,94 +155,83 @@ def date_time_serializer(obj):
 
 
 def unpack_qr_text(qr_text):
-    compressed_bytes = b45decode(qr_text[4:])
-    cose_bytes = zlib.decompress(compressed_bytes)
-    cose_message = Sign1Message.decode(cose_bytes)
-    cbor_message = loads(cose_message.payload)
-    print(cbor_message)
-    payload_object = cbor_message[-260][1]
-    return {
-        "COSE": cose_bytes.hex(),
-        "CBOR": cbor_message,
-        "COSE_MESSAGE": cose_message,
-        "PAYLOAD_OBJECT": payload_object,
-        "PAYLOAD_JSON": json.dumps(payload_object, default=date_time_serializer)
-    }
-
-
-def validate_country(path, country, results):
+    unpacked = hcert.unpack_qr(qr_text)
+    unpacked["PAYLOAD_JSON"] = json.dumps(unpacked["JSON"], default=date_time_serializer)
+    return unpacked
+
+
+def list_country_files(path, country):
+    return [test_case.path for test_case in load_manifest(path).test_cases(country)]
+
+
+def validate_country(path, country, results, cache=None, report=None):
     print(f"Validating {country}..")
-    results[country] = dict()
-    results[country]["passed"] = list()
-    results[country]["failed"] = list()
-    results[country]["skipped"] = list()
+    result = results[country] = CountryResult(country)
     # try:
-    files = [f for f in util.walk_path(path, country)
-             if os.path.splitext(f)[1].upper() in ALLOWED_EXT]
+    files = list_country_files(path, country)
     if len(files) == 0:
-        results[country]["valid"] = False
-        results[country]["exception"] = "No test cases found."
-        return
+        result.exception = "No test cases found."
     for file in files:
-        validate_png(country, file, results)
-    if len(results[country]["failed"]) > 0:
-        results[country]["valid"] = False
-    else:
-        results[country]["valid"] = True
+        validate_png(result, file, cache, report)
+    report.end_country(result)
 
 
 def get_version(file):
-    pattern = re.compile("\\d\\.\\d\\.\\d")
-    result = pattern.search(file)
-    return result.group(0)
-
+    return VERSION_PATTERN.search(file).group(0)
 
-def read_qr_zxing(file):
-    reader = zxing.BarCodeReader()
-    barcode = reader.decode(file)
-    return barcode.raw
 
-
-def read_qr_pyzbar(file):
-    barcode = decode(Image.open(file))[0]
-    return barcode.data.decode("utf-8")
-
-
-def validate_png(country, file, results):
+def validate_png(result, file, cache=None, report=None):
     print(f"  File: {file}")
+    key = cache_key(file) if cache is not None else None
+    verdict = cached_verdict(file, key, cache)
+    changed = verdict is None
+    if changed:
+        with METRICS.measure("qa.file"):
+            verdict = validate_file(file)
+        if cache is not None:
+            cache.put(*key, *verdict)
+    status, entry = verdict
+    report.add(result, file, status, entry, changed)
+
+
+def validate_file_in_worker(file):
+    """Validates a single QR file in a pool worker, returns the verdict and the worker's metrics"""
+    with METRICS.measure("qa.file"):
+        status, entry = validate_file(file)
+    return status, entry, METRICS.drain()
+
+
+def validate_file(file):
+    """Validates a single QR file, returns ("passed", file) or ("failed", details)"""
     unpacked = dict()
     try:
         version = get_version(file)
-        qr_data = read_qr_pyzbar(file)
+        qr_data = QR_READER.read(file)
         if qr_data is None or qr_data == '':
-            results[country]["failed"].append({
+            return "failed", {
                 "file": file,
                 "exception": "Unable to read QR",
                 "json": "",
                 "cbor": "",
                 "cose_msg": ""
-            })
-            return
-        compressed_bytes = b45decode(qr_data[4:])
-        cose_payload = zlib.decompress(compressed_bytes)
+            }
         unpacked = unpack_qr_text(qr_data)
-        result_schema_val = SCHEMA_VALIDATOR.validate_dcc(unpacked["PAYLOAD_OBJECT"], version)
-        result_sig_val = SIGNATURE_VALIDATOR.validate(cose_payload)
+        result_schema_val = SCHEMA_VALIDATOR.validate_dcc(unpacked["JSON"], version)
+        result_sig_val = SIGNATURE_VALIDATOR.validate(unpacked["COSE"], unpacked["CBOR"].get(CLAIM_ISSUER),
+                                                      unpacked["CBOR"].get(CLAIM_ISSUED_AT))
         if result_schema_val["valid"] and result_sig_val["valid"]:
-            results[country]["passed"].append(file)
-        else:
-            results[country]["failed"].append({
-                "file": file,
-                "schema": result_schema_val,
-                "signature": result_sig_val,
-                "json": unpacked["PAYLOAD_JSON"]
-            })
+            return "passed", file
+        return "failed", {
+            "file": file,
+            "schema": result_schema_val,
+            "signature": result_sig_val,
+            "json": unpacked["PAYLOAD_JSON"]
+        }
     except UnknownKidError as e:
-        result = {
+        return "failed", {
             "file": file,
             "exception": e
         }
-        results[country]["failed"].append(result)
     except Exception as e:
         #
         result = {
@@ -151,7 +244,7 @@ def validate_png(country, file, results):
             result["cbor"] = unpacked["CBOR"]
         if "CBOR" in unpacked:
             result["cose_msg"] = unpacked["COSE_MESSAGE"]
-        results[country]["failed"].append(result)
+        return "failed", result
 
 
 def info(message):
@@ -159,79 +252,151 @@ def info(message):
         print(message)
 
 
-CLI_PARSER.add_argument(
-    '--repo',
-    type=str,
-    help='Path to the repository containing the test cases',
-    default="..\\dcc-quality-assurance")
-CLI_PARSER.add_argument(
-    '--countries',
-    type=str,
-    nargs="?",
-    help='Optional string containing a comma-separated list of countries,' +
-    ' e.g. "NL,DE,ES"')
-
-args = CLI_PARSER.parse_args()
-
-if args.repo is None:
-    CLI_PARSER.print_help()
-    sys.exit()
-
-root_directory = args.repo
-if args.countries is None:
-    print(root_directory)
-    countries = util.list_country_directories(root_directory)
-else:
-    countries = args.countries.split(",")
-
-print(f"Starting validation of the following countries: {countries}")
-validation_results = validate(root_directory)
-print("Validation complete.")
-print("Validation results:")
-for c in sorted(validation_results.keys()):
-    total_passed = len(validation_results[c]["passed"])
-    total_skipped = len(validation_results[c]["skipped"])
-    TOTAL_FAILED = len(validation_results[c]["failed"])
-    if validation_results[c]["valid"]:
-        print(
-            f"  {c} ✅ | passed {total_passed} failed {TOTAL_FAILED} skipped" +
-            " {total_skipped}.")
+if __name__ == '__main__':
+    CLI_PARSER.add_argument(
+        '--repo',
+        type=str,
+        help='Path to the repository containing the test cases',
+        default="..\\dcc-quality-assurance")
+    CLI_PARSER.add_argument(
+        '--countries',
+        type=str,
+        nargs="?",
+        help='Optional string containing a comma-separated list of countries,' +
+        ' e.g. "NL,DE,ES"')
+    CLI_PARSER.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='Number of worker processes used to validate the files (default: 1, serial)')
+    CLI_PARSER.add_argument(
+        '--trustlist-snapshot',
+        type=str,
+        help='Optional directory for a binary snapshot of the trust list, reused while trustlist.json is unchanged')
+    CLI_PARSER.add_argument(
+        '--schema-engine',
+        choices=ENGINES,
+        default=ENGINE_JSCHON,
+        help='Schema validation engine: jschon (reference) or compiled (generated code, much faster)')
+    CLI_PARSER.add_argument(
+        '--cache',
+        type=str,
+        nargs='?',
+        const=RESULT_CACHE_PATH,
+        help='Reuse the verdicts of unchanged test cases from a result cache' +
+        f' (default file: {RESULT_CACHE_PATH})')
+    CLI_PARSER.add_argument(
+        '--changed-only',
+        action='store_true',
+        help='Only report the details of test cases validated in this run; implies --cache')
+    CLI_PARSER.add_argument(
+        '--report-ndjson',
+        type=str,
+        help='Optional file to stream every verdict to, one JSON object per line')
+    CLI_PARSER.add_argument(
+        '--report-junit',
+        type=str,
+        help='Optional file to write a JUnit XML report to, one test suite per country')
+    CLI_PARSER.add_argument(
+        '--manifest',
+        type=str,
+        default=MANIFEST_PATH,
+        help='Index of the test cases in the repository; only directories that changed since the last run are' +
+        f' listed again (default: {MANIFEST_PATH})')
+    CLI_PARSER.add_argument(
+        '--metrics',
+        type=str,
+        nargs='?',
+        const=METRICS_PATH,
+        help='Record the time spent per stage and write a JSON summary (p50/p95/p99) at the end' +
+        f' (default file: {METRICS_PATH})')
+
+    args = CLI_PARSER.parse_args()
+    METRICS.enable(args.metrics is not None)
+
+    if args.repo is None:
+        CLI_PARSER.print_help()
+        sys.exit()
+
+    root_directory = args.repo
+    # Every listing of test cases below comes from the manifest
+    manifest = load_manifest(root_directory, args.manifest)
+    if args.countries is None:
+        print(root_directory)
+        countries = manifest.countries()
     else:
-        print(
-            f"  {c} ❌ | passed {total_passed} failed {TOTAL_FAILED} skipped" +
-            " {total_skipped}.")
-
-print()
-
-TOTAL_FAILED = 0
-
-for c in sorted(validation_results.keys()):
-    TOTAL_FAILED = TOTAL_FAILED + len(validation_results[c]["failed"])
-    if not validation_results[c]["valid"]:
-        print("Error details")
-        print()
-        for e in validation_results[c]["failed"]:
-            print(f"{ c }")
-            print(f"  {e['file']}")
-            if "exception" in e:
-                print("    General error:")
-                print(f"      { e['exception'] }")
-            if "schema" in e and not e["schema"]["valid"]:
-                print("    Schema error:")
-                for se in e["schema"]["errors"]:
-                    print(f'      { se["error"] }')
-            if "signature" in e and not e["signature"]["valid"]:
-                print("    Signature error:")
-                print(f"      { e['signature']['error']['message'] }")
-            if "json" in e:
-                print("    JSON:")
-                print(f"      {e['json']}")
-            if "cbor" in e:
-                print("    CBOR:")
-                print(f"      {e['cbor']}")
-            if "cose_msg" in e:
-                print("    COSE message:")
-                print(f"      {e['cose_msg']}")
-
-if TOTAL_FAILED == 0:
-    print("Everything succeeded!")
+        countries = args.countries.split(",")
+
+    result_cache = None
+    if args.cache is not None or args.changed_only:
+        result_cache = load_result_cache(args.cache or RESULT_CACHE_PATH, args.schema_engine)
+
+    print(f"Starting validation of the following countries: {countries}")
+    reports = ReportWriter(args.report_ndjson, args.report_junit, args.changed_only)
+    try:
+        validation_results = validate(root_directory, countries, args.workers, args.trustlist_snapshot,
+                                      args.schema_engine, result_cache, reports)
+    finally:
+        reports.close()
+    print("Validation complete.")
+    if args.metrics is not None:
+        METRICS.write(args.metrics)
+        print(f"Metrics written to {args.metrics}")
+    if result_cache is not None:
+        result_cache.save()
+        cache_info = result_cache.cache_info()
+        print(f"Result cache: {cache_info['hits']} unchanged, {cache_info['misses']} validated.")
+    if args.workers <= 1:
+        # With workers, every process has its own reader
+        for backend, counters in QR_READER.stats().items():
+            if counters["calls"] > 0:
+                print(f"QR reader {backend}: {counters['calls']} images, {counters['failures']} unreadable," +
+                      f" {counters['seconds']:.2f}s")
+            if counters["unavailable"] > 0:
+                print(f"QR reader {backend}: not available, {counters['unavailable']} images skipped")
+    print("Validation results:")
+    for c in sorted(validation_results.keys()):
+        total_passed = validation_results[c].passed
+        total_skipped = validation_results[c].skipped
+        TOTAL_FAILED = validation_results[c].failed
+        changed = f" changed {validation_results[c].changed}" if args.changed_only else ""
+        if validation_results[c].valid():
+            print(
+                f"  {c} ✅ | passed {total_passed} failed {TOTAL_FAILED} skipped" +
+                " {total_skipped}." + changed)
+        else:
+            print(
+                f"  {c} ❌ | passed {total_passed} failed {TOTAL_FAILED} skipped" +
+                " {total_skipped}." + changed)
+
+    print()
+    # From the trust list the signatures were validated against, loaded once by init_components
+    trust_list_stats = SIGNATURE_VALIDATOR.trust_list().country_stats()
+    print("Trust list DSCs (valid now / expired / not yet valid):")
+    for c in sorted(validation_results.keys()):
+        counts = trust_list_stats.get(c)
+        if counts is None:
+            print(f"  {c}: none")
+            continue
+        unparseable = f", {counts['unparseable']} unparseable" if counts["unparseable"] > 0 else ""
+        print(f"  {c}: {counts['dscs']} ({counts['valid']} / {counts['expired']} / {counts['not_yet_valid']}" +
+              f"{unparseable})")
+
+    print()
+
+    TOTAL_FAILED = 0
+
+    for c in sorted(validation_results.keys()):
+        TOTAL_FAILED = TOTAL_FAILED + validation_results[c].failed
+        if not validation_results[c].valid():
+            # The details were reported as each test case was validated
+            print(f"Failed: { c }")
+            if validation_results[c].exception is not None:
+                print(f"  { validation_results[c].exception }")
+            for record in validation_results[c].failed_records():
+                if args.changed_only and not record.changed:
+                    continue
+                print(f"  {record.file}")
+
+    if TOTAL_FAILED == 0:
+        print("Everything succeeded!")
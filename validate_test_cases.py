@@ -0,0 +1,316 @@
+#!/bin/env python3.9
+
+import argparse
+import itertools
+import json
+import os
+import sys
+
+from collections import Counter, deque
+from datetime import datetime, timezone
+from functools import lru_cache
+
+from classes.DigitalCovidCertificate import DigitalCovidCertificate
+from classes.DigitalSigningCertificate import DigitalSigningCertificate
+from classes.Metrics import METRICS
+from classes.SchemaValidator import SchemaValidator, ENGINES, ENGINE_JSCHON
+from classes.SignatureValidator import SignatureValidator
+from classes.TestCaseManifest import EXCLUDED_PREFIXES
+from classes.TrustList import TrustList
+
+# Initialize components (see init_components)
+SCHEMA_VALIDATOR: SchemaValidator = None
+SIGNATURE_VALIDATOR: SignatureValidator = None
+CLI_PARSER = argparse.ArgumentParser(
+    description='Validates a tree of T-Systems test case JSON files and checks their EXPECTEDRESULTS')
+METRICS_PATH = 'metrics.json'
+
+# Number of validators for the certificates in the test cases' TESTCTX that are kept (see certificate_validator)
+TEST_CERTIFICATE_VALIDATORS = 256
+
+# The expected results that are checked, in the order of the steps; the others (e.g. EXPECTEDPICTUREDECODE)
+# are ignored
+CHECKED_RESULTS = [
+    "EXPECTEDUNPREFIX",
+    "EXPECTEDB45DECODE",
+    "EXPECTEDCOMPRESSION",
+    "EXPECTEDDECODE",
+    "EXPECTEDVALIDOBJECT",
+    "EXPECTEDSCHEMAVALIDATION",
+    "EXPECTEDVERIFY",
+    "EXPECTEDEXPIRATIONCHECK"
+]
+
+
+def init_components(use_trustlist=False, snapshot_dir=None, schema_engine=ENGINE_JSCHON, metrics=False):
+    """Loads the validators, once per process (also used as the worker initializer)"""
+    global SCHEMA_VALIDATOR, SIGNATURE_VALIDATOR
+    METRICS.enable(metrics)
+    if SCHEMA_VALIDATOR is None:
+        SCHEMA_VALIDATOR = SchemaValidator.create(schema_engine)
+    if SIGNATURE_VALIDATOR is None and use_trustlist:
+        SIGNATURE_VALIDATOR = SignatureValidator(TrustList.load("trustlist.json", snapshot_dir))
+
+
+def find_test_files(root):
+    """Lazily yields the JSON files in the directory tree, in name order"""
+    try:
+        with os.scandir(root) as iterator:
+            entries = sorted(iterator, key=lambda entry: entry.name)
+    except OSError:
+        return
+    for entry in entries:
+        if entry.is_dir():
+            if not entry.name.startswith(EXCLUDED_PREFIXES) and not entry.is_symlink():
+                yield from find_test_files(entry.path)
+        elif entry.name.upper().endswith(".JSON"):
+            yield entry.path
+
+
+def signature_validator(test_context, dcc):
+    """Returns the validator for the test case: its own certificate if it has one, else the trust list"""
+    certificate = test_context.get("CERTIFICATE")
+    if certificate is None:
+        return SIGNATURE_VALIDATOR
+    return certificate_validator(certificate, dcc.kid(), test_context.get("COUNTRY", ""))
+
+
+@lru_cache(maxsize=TEST_CERTIFICATE_VALIDATORS)
+def certificate_validator(certificate, kid, country):
+    """Returns a validator that trusts only the certificate, for the KID"""
+    return SignatureValidator(TrustList({kid: DigitalSigningCertificate(country, kid, certificate)}))
+
+
+def validation_clock(test_context):
+    """Returns the VALIDATIONCLOCK of the test case as a unix timestamp, or None"""
+    clock = test_context.get("VALIDATIONCLOCK")
+    if clock is None:
+        return None
+    moment = datetime.fromisoformat(clock.replace("Z", "+00:00"))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def run_test_case(test_case, use_trustlist):
+    """Runs the decoding and validation steps of the test case; returns (actual results, errors, KID)"""
+    actual = dict()
+    errors = dict()
+    test_context = test_case.get("TESTCTX", dict())
+    if "PREFIX" in test_case:
+        actual["EXPECTEDUNPREFIX"] = test_case["PREFIX"].startswith("HC1:")
+        dcc = DigitalCovidCertificate.from_hcert(test_case["PREFIX"])
+        steps = [("EXPECTEDB45DECODE", dcc.compressed), ("EXPECTEDCOMPRESSION", dcc.cose)]
+    else:
+        dcc = DigitalCovidCertificate.from_cose(bytes.fromhex(test_case["COSE"]))
+        steps = []
+    steps += [("EXPECTEDDECODE", dcc.claims), ("EXPECTEDVALIDOBJECT", dcc.dcc)]
+    for flag, step in steps:
+        try:
+            step()
+            actual[flag] = True
+        except Exception as error:
+            actual[flag] = False
+            errors[flag] = f"{type(error).__name__}: {error}"
+            # Everything after a failed step fails with it
+            for later_flag in CHECKED_RESULTS[CHECKED_RESULTS.index(flag) + 1:]:
+                actual[later_flag] = False
+            return actual, errors, None
+    actual["EXPECTEDVALIDOBJECT"] = isinstance(dcc.dcc(), dict)
+
+    try:
+        result = SCHEMA_VALIDATOR.validate_dcc(dcc.dcc(), dcc.version())
+        actual["EXPECTEDSCHEMAVALIDATION"] = result["valid"]
+        if not result["valid"]:
+            errors["EXPECTEDSCHEMAVALIDATION"] = [error["error"] for error in result.get("errors", [])]
+    except KeyError:
+        actual["EXPECTEDSCHEMAVALIDATION"] = False
+        errors["EXPECTEDSCHEMAVALIDATION"] = f"Unknown schema version {dcc.version()}"
+
+    validator = signature_validator(test_context, dcc) if not use_trustlist else SIGNATURE_VALIDATOR
+    if validator is None:
+        actual["EXPECTEDVERIFY"] = False
+        errors["EXPECTEDVERIFY"] = "No CERTIFICATE in TESTCTX (use --trustlist)"
+    else:
+        try:
+            result = validator.validate(dcc.cose())
+            actual["EXPECTEDVERIFY"] = result["valid"]
+            if result["error"] is not None:
+                errors["EXPECTEDVERIFY"] = f"{result['error']['type']}: {result['error']['message']}"
+        except Exception as error:
+            actual["EXPECTEDVERIFY"] = False
+            errors["EXPECTEDVERIFY"] = f"{type(error).__name__}: {error}"
+
+    clock = validation_clock(test_context)
+    if clock is not None and dcc.expires_at() is not None:
+        actual["EXPECTEDEXPIRATIONCHECK"] = clock <= dcc.expires_at()
+    return actual, errors, dcc.kid()
+
+
+def is_test_case(document):
+    """Returns whether the JSON document is a test case, and not e.g. the trust list of a generated corpus"""
+    return isinstance(document, dict) and ("EXPECTEDRESULTS" in document or "TESTCTX" in document)
+
+
+def validate_test_file(file, use_trustlist=False):
+    """Validates a test case file, returns a compact, JSON-serializable result; None when it's no test case"""
+    record = {
+        "file": file,
+        "passed": False,
+        "kid": None,
+        "mismatches": [],
+        "actual": None,
+        "errors": None
+    }
+    try:
+        with open(file, mode='r', encoding='utf-8') as test_file:
+            test_case = json.load(test_file)
+        if not is_test_case(test_case):
+            return None
+        expected = test_case.get("EXPECTEDRESULTS", dict())
+        actual, errors, record["kid"] = run_test_case(test_case, use_trustlist)
+    except Exception as error:
+        record["errors"] = {"file": f"{type(error).__name__}: {error}"}
+        return record
+    record["actual"] = actual
+    record["errors"] = errors or None
+    # Steps without input (e.g. no PREFIX, no VALIDATIONCLOCK) aren't checked
+    record["mismatches"] = [flag for flag in CHECKED_RESULTS
+                            if flag in expected and flag in actual and expected[flag] != actual[flag]]
+    record["passed"] = len(record["mismatches"]) == 0
+    return record
+
+
+def validate_chunk(files, use_trustlist=False):
+    """Validates a chunk of test case files, returns the results and the worker's metrics"""
+    records = []
+    for file in files:
+        with METRICS.measure("testcase.file"):
+            record = validate_test_file(file, use_trustlist)
+        if record is not None:
+            records.append(record)
+    return records, METRICS.drain()
+
+
+def read_chunks(files, chunk_size):
+    """Lazily splits the file paths into chunks"""
+    while True:
+        chunk = list(itertools.islice(files, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def validate_tree(root, workers, chunk_size, use_trustlist=False, snapshot_dir=None, schema_engine=ENGINE_JSCHON,
+                  metrics=False):
+    """Yields the result of every test case file under root, in name order"""
+    chunks = read_chunks(find_test_files(root), chunk_size)
+    if workers <= 1:
+        init_components(use_trustlist, snapshot_dir, schema_engine, metrics)
+        for chunk in chunks:
+            records, _ = validate_chunk(chunk, use_trustlist)
+            yield from records
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    # Only a bounded number of chunks are in flight, so memory use doesn't grow with the tree
+    max_in_flight = workers * 2
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_components,
+                             initargs=(use_trustlist, snapshot_dir, schema_engine, metrics)) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(validate_chunk, chunk, use_trustlist))
+            if len(pending) >= max_in_flight:
+                yield from merge_results(pending.popleft().result())
+        while pending:
+            yield from merge_results(pending.popleft().result())
+
+
+def merge_results(result):
+    records, worker_metrics = result
+    METRICS.merge(worker_metrics)
+    return records
+
+
+if __name__ == '__main__':
+    CLI_PARSER.add_argument(
+        '--path',
+        type=str,
+        help='Directory tree with the test case JSON files')
+    CLI_PARSER.add_argument(
+        '--workers',
+        type=int,
+        default=os.cpu_count(),
+        help='Number of worker processes (default: number of cores)')
+    CLI_PARSER.add_argument(
+        '--chunk-size',
+        type=int,
+        default=64,
+        help='Number of files handed to a worker at once (default: 64)')
+    CLI_PARSER.add_argument(
+        '--report-ndjson',
+        type=str,
+        help='Optional file to write the result of every test case to, one JSON object per line')
+    CLI_PARSER.add_argument(
+        '--trustlist',
+        action='store_true',
+        help='Verify the signatures against trustlist.json instead of the CERTIFICATE in each TESTCTX')
+    CLI_PARSER.add_argument(
+        '--trustlist-snapshot',
+        type=str,
+        help='Optional directory for a binary snapshot of the trust list, reused while trustlist.json is unchanged')
+    CLI_PARSER.add_argument(
+        '--schema-engine',
+        choices=ENGINES,
+        default=ENGINE_JSCHON,
+        help='Schema validation engine: jschon (reference) or compiled (generated code, much faster)')
+    CLI_PARSER.add_argument(
+        '--metrics',
+        type=str,
+        nargs='?',
+        const=METRICS_PATH,
+        help='Record the time spent per stage and write a JSON summary (p50/p95/p99) at the end' +
+        f' (default file: {METRICS_PATH})')
+
+    args = CLI_PARSER.parse_args()
+    METRICS.enable(args.metrics is not None)
+
+    if args.path is None:
+        CLI_PARSER.print_help()
+        sys.exit()
+
+    total = 0
+    unreadable = 0
+    failed_files = []
+    mismatch_counts = Counter()
+    report = open(args.report_ndjson, mode='w', encoding='utf-8') if args.report_ndjson is not None else None
+    try:
+        for test_record in validate_tree(args.path, max(1, args.workers), max(1, args.chunk_size), args.trustlist,
+                                         args.trustlist_snapshot, args.schema_engine, args.metrics is not None):
+            total += 1
+            if report is not None:
+                report.write(json.dumps(test_record, default=str, ensure_ascii=False))
+                report.write("\n")
+            if test_record["passed"]:
+                continue
+            if test_record["actual"] is None:
+                unreadable += 1
+            mismatch_counts.update(test_record["mismatches"])
+            failed_files.append((test_record["file"], test_record["mismatches"]))
+    finally:
+        if report is not None:
+            report.close()
+
+    print(f"Test cases: {total}, passed {total - len(failed_files)}, failed {len(failed_files)}" +
+          f" (unreadable {unreadable}).")
+    for flag in CHECKED_RESULTS:
+        if mismatch_counts[flag] > 0:
+            print(f"  {flag}: {mismatch_counts[flag]} not as expected")
+    if len(failed_files) > 0:
+        print("Failed:")
+        for failed_file, mismatches in failed_files:
+            print(f"  {failed_file}: {', '.join(mismatches) or 'unreadable'}")
+    if args.metrics is not None:
+        METRICS.write(args.metrics)
+        print(f"Metrics written to {args.metrics}")
+    if len(failed_files) > 0:
+        sys.exit(1)
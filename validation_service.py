@@ -0,0 +1,364 @@
+#!/bin/env python3.9
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import signal
+import sys
+
+import validate_hcert
+from classes.Metrics import METRICS
+from classes.QrReader import QrReader
+from classes.SchemaValidator import ENGINES, ENGINE_JSCHON
+
+# Initialize components
+CLI_PARSER = argparse.ArgumentParser(
+    description='Validation service: loads the schemas and the trust list once and validates hcerts over HTTP')
+
+# Global state
+QR_READER: QrReader = None
+MAX_HEADER_LINES = 100
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable"
+}
+
+
+class HttpError(Exception):
+    """Ends the request with the given status"""
+    def __init__(self, status, message):
+        self.status = status
+        self.message = message
+        super().__init__(message)
+
+
+def init_worker(snapshot_dir, watch_interval, schema_engine, metrics, revocation_path=None, rules_path=None,
+                value_sets_path=None, acceptor=None):
+    """Pool initializer: loads the validators, the revocation index, the rules and the QR reader once per worker"""
+    global QR_READER
+    validate_hcert.init_components(snapshot_dir, watch_interval, schema_engine, metrics, revocation_path, rules_path,
+                                   value_sets_path, acceptor)
+    # Like the command line tools: zxing reads what pyzbar can't, or everything when zbar isn't installed
+    QR_READER = QrReader()
+
+
+def validate_png(png_bytes):
+    """Reads the QR from the PNG bytes and validates it, returns the NDJSON line and the worker's metrics"""
+    qr_text = QR_READER.read(io.BytesIO(png_bytes))
+    if qr_text is None:
+        record = {"line": 1, "valid": False, "kid": None, "schema": None, "signature": None,
+                  "error": "QR: unable to read QR"}
+        return [json.dumps(record)], METRICS.drain()
+    return validate_hcert.validate_chunk([(1, qr_text)])
+
+
+class ValidationService:
+    """HTTP/1.1 front end; the validation itself runs in a process pool
+
+    At most max_pending jobs (single requests or batch chunks) are in the pool. A single request that can't get
+    a slot within queue_timeout seconds is answered with 503, so callers back off instead of piling up. At most
+    max_batches batches are accepted at a time, a batch that can't be accepted within queue_timeout seconds is a
+    503 too. The chunks of an accepted batch wait for their slots: once a batch is accepted, it's completed.
+    """
+    def __init__(self, executor, max_pending, queue_timeout, chunk_size, max_body, max_batches):
+        self._executor = executor
+        self._slots = asyncio.Semaphore(max_pending)
+        self._batches = asyncio.Semaphore(max_batches)
+        self._max_pending = max_pending
+        self._in_flight = 0
+        self._queue_timeout = queue_timeout
+        self._chunk_size = chunk_size
+        self._max_body = max_body
+        self._served = 0
+        self._rejected = 0
+
+    async def handle_connection(self, reader, writer):
+        """Serves the requests of one (keep-alive) connection"""
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except HttpError as error:
+                    await self._respond(writer, error.status, {"error": error.message}, keep_alive=False)
+                    return
+                if request is None:
+                    return
+                method, path, headers, body = request
+                keep_alive = headers.get("connection", "").lower() != "close"
+                try:
+                    status, response = await self._route(method, path, headers, body)
+                except HttpError as error:
+                    status, response = error.status, {"error": error.message}
+                except Exception as error:
+                    status, response = 500, {"error": f"{type(error).__name__}: {error}"}
+                await self._respond(writer, status, response, keep_alive)
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            return
+        finally:
+            writer.close()
+
+    async def _route(self, method, path, headers, body):
+        if path == "/health":
+            self._expect(method, "GET")
+            return 200, {
+                "status": "ok",
+                "in_flight": self._in_flight,
+                "max_pending": self._max_pending,
+                "served": self._served,
+                "rejected": self._rejected
+            }
+        if path == "/metrics":
+            self._expect(method, "GET")
+            return 200, METRICS.summary()
+        if path == "/validate":
+            self._expect(method, "POST")
+            if headers.get("content-type", "").startswith("image/png"):
+                lines = await self._submit(validate_png, body)
+            else:
+                qr_text = self._decode(body).strip()
+                lines = await self._submit(validate_hcert.validate_chunk, [(1, qr_text)])
+            return 200, json.loads(lines[0])
+        if path == "/validate/batch":
+            self._expect(method, "POST")
+            lines = [(number, line.rstrip("\r")) for number, line in
+                     enumerate(self._decode(body).split("\n"), start=1)]
+            if lines and lines[-1][1] == "":
+                lines.pop()
+            chunks = [lines[start:start + self._chunk_size] for start in range(0, len(lines), self._chunk_size)]
+            if not await self._acquire(self._batches, self._queue_timeout):
+                self._rejected += 1
+                raise HttpError(503, "Too many pending batches, retry later")
+            try:
+                results = await asyncio.gather(*[self._submit(validate_hcert.validate_chunk, chunk, wait=True)
+                                                 for chunk in chunks])
+            finally:
+                self._batches.release()
+            return 200, "".join(line + "\n" for chunk_lines in results for line in chunk_lines)
+        raise HttpError(404, f"Unknown path {path}")
+
+    async def _submit(self, function, argument, wait=False):
+        """Runs the function in the pool once a slot is free, returns its NDJSON lines
+
+        Unless wait is set, a slot that isn't free within queue_timeout seconds is a 503.
+        """
+        if not await self._acquire(self._slots, None if wait else self._queue_timeout):
+            self._rejected += 1
+            raise HttpError(503, "Too many pending validations, retry later")
+        self._in_flight += 1
+        try:
+            lines, worker_metrics = await asyncio.get_running_loop().run_in_executor(
+                self._executor, function, argument)
+        finally:
+            self._in_flight -= 1
+            self._slots.release()
+        METRICS.merge(worker_metrics)
+        self._served += len(lines)
+        return lines
+
+    @staticmethod
+    async def _acquire(semaphore, timeout):
+        """Acquires the semaphore within timeout seconds (None: no limit), returns False when it timed out"""
+        if timeout is None:
+            await semaphore.acquire()
+            return True
+        # Not wait_for: when the acquire completes as the timeout fires, it can drop the acquired slot
+        acquire = asyncio.ensure_future(semaphore.acquire())
+        done, _ = await asyncio.wait([acquire], timeout=timeout)
+        if acquire in done:
+            return True
+        acquire.cancel()
+        try:
+            await acquire
+        except asyncio.CancelledError:
+            return False
+        # The acquire won the race with the cancellation, the slot is ours
+        return True
+
+    async def _read_request(self, reader):
+        """Returns (method, path, headers, body), or None when the client closed the connection"""
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        try:
+            method, path, _ = request_line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            raise HttpError(400, "Malformed request line")
+        headers = dict()
+        for _ in range(MAX_HEADER_LINES):
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        else:
+            raise HttpError(400, "Too many headers")
+        try:
+            length = int(headers.get("content-length", "0"))
+        except ValueError:
+            raise HttpError(400, "Invalid Content-Length")
+        if length > self._max_body:
+            raise HttpError(413, f"Request body larger than {self._max_body} bytes")
+        body = await reader.readexactly(length) if length > 0 else b""
+        return method, path, headers, body
+
+    @staticmethod
+    async def _respond(writer, status, response, keep_alive=True):
+        if isinstance(response, str):
+            content_type = "application/x-ndjson"
+            body = response.encode("utf-8")
+        else:
+            content_type = "application/json"
+            body = json.dumps(response, default=str).encode("utf-8")
+        head = [
+            f"HTTP/1.1 {status} {REASONS[status]}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {len(body)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}"
+        ]
+        if status == 503:
+            head.append("Retry-After: 1")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    @staticmethod
+    def _expect(method, expected):
+        if method != expected:
+            raise HttpError(405, f"Use {expected}")
+
+    @staticmethod
+    def _decode(body):
+        try:
+            return body.decode("utf-8")
+        except UnicodeDecodeError:
+            raise HttpError(400, "Request body is not UTF-8")
+
+
+async def serve(args):
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker,
+                             initargs=(args.trustlist_snapshot, args.watch_trustlist, args.schema_engine,
+                                       args.metrics, args.revocation, args.rules, args.value_sets,
+                                       args.acceptor)) as executor:
+        service = ValidationService(executor, args.max_pending or args.workers * 2, args.queue_timeout,
+                                    args.chunk_size, args.max_body, args.max_batches)
+        if args.socket is not None:
+            server = await asyncio.start_unix_server(service.handle_connection, path=args.socket)
+            print(f"Listening on {args.socket}")
+        else:
+            server = await asyncio.start_server(service.handle_connection, args.host, args.port)
+            print(f"Listening on http://{args.host}:{args.port}")
+        # Stop on SIGTERM like on Ctrl-C, so the socket is removed
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if args.socket is not None and os.path.exists(args.socket):
+                os.unlink(args.socket)
+
+
+if __name__ == '__main__':
+    CLI_PARSER.add_argument(
+        '--host',
+        type=str,
+        default="127.0.0.1",
+        help='Address to listen on (default: 127.0.0.1)')
+    CLI_PARSER.add_argument(
+        '--port',
+        type=int,
+        default=8045,
+        help='Port to listen on (default: 8045)')
+    CLI_PARSER.add_argument(
+        '--socket',
+        type=str,
+        help='Listen on this Unix socket instead of TCP')
+    CLI_PARSER.add_argument(
+        '--workers',
+        type=int,
+        default=os.cpu_count(),
+        help='Number of worker processes (default: number of cores)')
+    CLI_PARSER.add_argument(
+        '--max-pending',
+        type=int,
+        help='Maximum number of jobs (requests or batch chunks) in the pool (default: 2 per worker)')
+    CLI_PARSER.add_argument(
+        '--max-batches',
+        type=int,
+        default=2,
+        help='Maximum number of batch requests accepted at a time, others get a 503 (default: 2)')
+    CLI_PARSER.add_argument(
+        '--queue-timeout',
+        type=float,
+        default=5.0,
+        help='Seconds a request (or batch) waits for a free slot before it gets a 503 (default: 5)')
+    CLI_PARSER.add_argument(
+        '--chunk-size',
+        type=int,
+        default=256,
+        help='Number of hcerts of a batch request handed to a worker at once (default: 256)')
+    CLI_PARSER.add_argument(
+        '--max-body',
+        type=int,
+        default=64 * 1024 * 1024,
+        help='Maximum request body in bytes (default: 64 MiB)')
+    CLI_PARSER.add_argument(
+        '--trustlist-snapshot',
+        type=str,
+        help='Optional directory for a binary snapshot of the trust list, reused while trustlist.json is unchanged')
+    CLI_PARSER.add_argument(
+        '--watch-trustlist',
+        type=float,
+        metavar='SECONDS',
+        help='Check trustlist.json for changes every SECONDS and reload it in the background')
+    CLI_PARSER.add_argument(
+        '--schema-engine',
+        choices=ENGINES,
+        default=ENGINE_JSCHON,
+        help='Schema validation engine: jschon (reference) or compiled (generated code, much faster)')
+    CLI_PARSER.add_argument(
+        '--revocation',
+        type=str,
+        metavar='FILE',
+        help='Also check the UCI and signature hashes against this revocation index (see' +
+        ' compile_revocation_list.py)')
+    CLI_PARSER.add_argument(
+        '--rules',
+        type=str,
+        metavar='PATH',
+        help='Also evaluate the CertLogic business rules in this JSON file or directory for --acceptor')
+    CLI_PARSER.add_argument(
+        '--value-sets',
+        type=str,
+        metavar='PATH',
+        help='JSON file or directory with the value sets the business rules refer to')
+    CLI_PARSER.add_argument(
+        '--acceptor',
+        type=str,
+        metavar='COUNTRY',
+        help='Country code of the accepting country, for the business rules')
+    CLI_PARSER.add_argument(
+        '--metrics',
+        action='store_true',
+        help='Record the time spent per stage, served as JSON on GET /metrics')
+
+    args = CLI_PARSER.parse_args()
+    if args.rules is not None and args.acceptor is None:
+        CLI_PARSER.error("--rules needs --acceptor")
+    args.workers = max(1, args.workers)
+    args.chunk_size = max(1, args.chunk_size)
+    args.max_batches = max(1, args.max_batches)
+    METRICS.enable(args.metrics)
+
+    try:
+        asyncio.run(serve(args))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        sys.exit()